@@ -1,18 +1,24 @@
+import asyncio
 import re
-from typing import Any
+import time
+from typing import Any, AsyncIterator, Callable
 
+from config import get_settings
 from llm_client import llm_client
-from openapi_parser import extract_endpoints
+from openapi_parser import OpenAPIEndpoint
 from prompt_templates import (
     PromptTemplates, 
     TestPriority, 
     get_api_autotest_prompt,
     get_ui_autotest_prompt
 )
+from deadlines import RequestAborted
+from repair import repair_code
+from sampling import generate_best_of_n
+from spec_registry import RegisteredSpec, spec_registry
+from tokens import PromptTooLarge, fit_prompt
 from loguru import logger
 
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
-
 
 def _extract_python_code(text: str) -> str:
     """Извлекает Python код из markdown блоков или текста ответа LLM"""
@@ -23,111 +29,383 @@ def _extract_python_code(text: str) -> str:
     return text.strip()
 
 
-async def generate_api_autotest(openapi_spec: Any, method: str, path: str) -> str:
-    """
-    Генерирует API автотест через Cloud.ru GigaChat
-    """
-    endpoints = extract_endpoints(openapi_spec)
-    endpoint = next(
-        (e for e in endpoints if e.method.upper() == method.upper() and e.path == path),
-        None,
-    )
-    if not endpoint:
-        raise ValueError("Endpoint not found in OpenAPI spec")
-    
-    logger.info(f"Генерация API автотеста для {method} {path} через Cloud.ru GigaChat")
-    
+def _build_api_autotest_prompt(spec: RegisteredSpec, endpoint: OpenAPIEndpoint) -> tuple[str, dict[str, Any]]:
+    """Формирует промпт API автотеста для эндпоинта"""
     # Подготавливаем информацию об эндпоинте
     endpoint_info = {
-        "method": method.upper(),
-        "path": path,
+        "method": endpoint.method.upper(),
+        "path": endpoint.path,
         "summary": endpoint.summary or "",
         "parameters": len(endpoint.parameters),
         "has_request_body": endpoint.request_body is not None
     }
     
-    try:
-        # Используем промпт-шаблон для API тестов
-        prompt, params = get_api_autotest_prompt(
-            openapi_spec=str(openapi_spec)[:5000],  # Ограничиваем длину
+    # Используем промпт-шаблон для API тестов; контекст спецификации подгоняется под окно модели
+    return fit_prompt(
+        spec.endpoint_context(endpoint, get_settings().PROMPT_SPEC_CONTEXT_MAX_CHARS),
+        lambda text: get_api_autotest_prompt(
+            openapi_spec=text,
             endpoint_info=endpoint_info,
             priority=TestPriority.CRITICAL
         )
-        
-        logger.debug(f"Отправка промпта для API автотеста, длина: {len(prompt)} символов")
-        
-        # Генерация через Cloud.ru GigaChat
-        raw = await llm_client.generate(
-            prompt=prompt,
-            system_prompt=params.get("system_role"),
-            use_cache=True,
-            validate=True
+    )
+
+
+def _finalize_api_code(raw: str) -> str:
+    """Извлекает код API автотеста и добавляет недостающие импорты"""
+    code = _extract_python_code(raw)
+    
+    # Добавляем необходимые импорты если их нет
+    if "import httpx" not in code and "AsyncClient" in code:
+        code = "import httpx\n" + code
+    if "import allure" not in code:
+        code = "import allure\n" + code
+    
+    return code
+
+
+def _api_fallback_test(method: str, path: str) -> str:
+    """Fallback API тест при ошибке генерации"""
+    return (
+        "import allure\n"
+        "import httpx\n"
+        "import pytest\n\n"
+        f"class TestAPI_{method}_{path.replace('/', '_').strip('_')}:\n"
+        f"    \"\"\"Fallback API тест для {method} {path}\"\"\"\n\n"
+        f"    @allure.feature('API Testing')\n"
+        f"    @allure.story('{path}')\n"
+        f"    @allure.title('{method} {path} - Fallback test')\n"
+        f"    @allure.tag('CRITICAL')\n"
+        f"    def test_fallback(self):\n"
+        f"        \"\"\"Fallback тест при ошибке генерации\"\"\"\n"
+        f"        assert True\n"
+    )
+
+
+def _build_ui_autotest_prompt(scenario: str) -> tuple[str, dict[str, Any]]:
+    """Формирует промпт UI автотеста"""
+    # Используем промпт-шаблон для UI тестов; сценарий подгоняется под окно модели
+    return fit_prompt(scenario, lambda text: get_ui_autotest_prompt(
+        scenario=text,
+        priority=TestPriority.NORMAL,
+        framework="playwright"
+    ))
+
+
+def _finalize_ui_code(raw: str) -> str:
+    """Извлекает код UI автотеста и добавляет недостающие импорты"""
+    code = _extract_python_code(raw)
+    
+    # Добавляем необходимые импорты если их нет
+    if "import allure" not in code:
+        code = "import allure\n" + code
+    if "from playwright" not in code and "page.goto" in code:
+        code = "from playwright.sync_api import Page, expect\n" + code
+    
+    return code
+
+
+async def _best_of_n_then_repair(
+    prompt: str,
+    params: dict[str, Any],
+    priority: TestPriority,
+    template: str,
+    finalize: Callable[[str], str],
+    request_type: str,
+    started: float,
+    repair: bool,
+) -> str:
+    """Best-of-N и при repair=True цикл исправления выбранного варианта"""
+    code = (await generate_best_of_n(prompt, params, priority, template, finalize, request_type)).code
+    if repair:
+        code = (await repair_code(code, request_type, started)).code
+    return code
+
+
+async def _generate_api_code(
+    spec: RegisteredSpec,
+    endpoint: OpenAPIEndpoint,
+    repair: bool = False,
+    best_of_n: bool = False,
+) -> str:
+    """Генерирует код API автотеста, ошибки модели пробрасываются"""
+    started = time.monotonic()
+    prompt, params = _build_api_autotest_prompt(spec, endpoint)
+    
+    logger.debug(f"Отправка промпта для API автотеста, длина: {len(prompt)} символов")
+    
+    if best_of_n:
+        return await _best_of_n_then_repair(
+            prompt, params, TestPriority.CRITICAL, "api_autotest",
+            _finalize_api_code, "autotest_api", started, repair,
         )
-        
-        code = _extract_python_code(raw)
-        
-        # Добавляем необходимые импорты если их нет
-        if "import httpx" not in code and "AsyncClient" in code:
-            code = "import httpx\n" + code
-        if "import allure" not in code:
-            code = "import allure\n" + code
-        
-        return code
-        
+    
+    # Генерация через Cloud.ru GigaChat
+    raw = await llm_client.generate(
+        prompt=prompt,
+        system_prompt=params.get("system_role"),
+        use_cache=True,
+        validate=True,
+        template="api_autotest",
+        fallback=False,
+        temperature=params.get("temperature"),
+        max_tokens=params.get("max_tokens")
+    )
+    
+    code = _finalize_api_code(raw)
+    if repair:
+        code = (await repair_code(code, "autotest_api", started)).code
+    return code
+
+
+async def generate_api_autotest(
+    openapi_spec: Any,
+    method: str,
+    path: str,
+    spec_id: str | None = None,
+    repair: bool = False,
+    best_of_n: bool = False,
+) -> str:
+    """
+    Генерирует API автотест через Cloud.ru GigaChat
+    
+    Спецификация берется из реестра по spec_id или регистрируется по содержимому.
+    При best_of_n=True берется первый валидный из нескольких параллельных
+    вариантов, при repair=True замечания валидатора исправляются повторными
+    запросами.
+    """
+    spec = spec_registry.resolve(openapi_spec, spec_id)
+    endpoint = spec.get_endpoint(method, path)
+    
+    logger.info(f"Генерация API автотеста для {method} {path} через Cloud.ru GigaChat")
+    
+    try:
+        return await _generate_api_code(spec, endpoint, repair, best_of_n)
+    except (RequestAborted, PromptTooLarge):
+        raise
     except Exception as e:
         logger.error(f"Ошибка при генерации API автотеста через Cloud.ru GigaChat: {e}")
         # Fallback
-        return (
-            "import allure\n"
-            "import httpx\n"
-            "import pytest\n\n"
-            f"class TestAPI_{method}_{path.replace('/', '_').strip('_')}:\n"
-            f"    \"\"\"Fallback API тест для {method} {path}\"\"\"\n\n"
-            f"    @allure.feature('API Testing')\n"
-            f"    @allure.story('{path}')\n"
-            f"    @allure.title('{method} {path} - Fallback test')\n"
-            f"    @allure.tag('CRITICAL')\n"
-            f"    def test_fallback(self):\n"
-            f"        \"\"\"Fallback тест при ошибке генерации\"\"\"\n"
-            f"        assert True\n"
-        )
+        return _api_fallback_test(method, path)
 
 
-async def generate_ui_autotest(scenario: str) -> str:
+async def generate_ui_autotest(
+    scenario: str,
+    repair: bool = False,
+    best_of_n: bool = False,
+) -> str:
     """
     Генерирует UI автотест через Cloud.ru GigaChat
     """
+    started = time.monotonic()
     logger.info(f"Генерация UI автотеста через Cloud.ru GigaChat")
     
     try:
-        # Используем промпт-шаблон для UI тестов
-        prompt, params = get_ui_autotest_prompt(
-            scenario=scenario,
-            priority=TestPriority.NORMAL,
-            framework="playwright"
-        )
+        prompt, params = _build_ui_autotest_prompt(scenario)
         
         logger.debug(f"Отправка промпта для UI автотеста, длина: {len(prompt)} символов")
         
+        if best_of_n:
+            return await _best_of_n_then_repair(
+                prompt, params, TestPriority.NORMAL, "ui_autotest",
+                _finalize_ui_code, "autotest_ui", started, repair,
+            )
+        
         # Генерация через Cloud.ru GigaChat
         raw = await llm_client.generate(
             prompt=prompt,
             system_prompt=params.get("system_role"),
             use_cache=True,
-            validate=True
+            validate=True,
+            template="ui_autotest",
+            temperature=params.get("temperature"),
+            max_tokens=params.get("max_tokens")
         )
         
-        code = _extract_python_code(raw)
-        
-        # Добавляем необходимые импорты если их нет
-        if "import allure" not in code:
-            code = "import allure\n" + code
-        if "from playwright" not in code and "page.goto" in code:
-            code = "from playwright.sync_api import Page, expect\n" + code
-        
+        code = _finalize_ui_code(raw)
+        if repair:
+            code = (await repair_code(code, "autotest_ui", started)).code
         return code
         
+    except (RequestAborted, PromptTooLarge):
+        raise
     except Exception as e:
         logger.error(f"Ошибка при генерации UI автотеста через Cloud.ru GigaChat: {e}")
         # Fallback
-        return llm_client._fallback_test()
\ No newline at end of file
+        return llm_client._fallback_test()
+
+
+async def _stream_autotest(
+    prompt: str,
+    params: dict[str, Any],
+    template: str,
+    finalize: Callable[[str], str],
+    fallback: Callable[[], str],
+) -> AsyncIterator[tuple[str, Any]]:
+    """Общий цикл потоковой генерации автотеста"""
+    parts: list[str] = []
+    
+    try:
+        async for delta in llm_client.generate_stream(
+            prompt=prompt,
+            system_prompt=params.get("system_role"),
+            use_cache=True,
+            template=template,
+            temperature=params.get("temperature"),
+            max_tokens=params.get("max_tokens")
+        ):
+            parts.append(delta)
+            yield "token", delta
+    except RequestAborted:
+        # Дедлайн: поток завершается событием error без fallback
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при потоковой генерации автотеста через Cloud.ru GigaChat: {e}")
+        yield "error", str(e)
+        yield "done", fallback()
+        return
+    
+    validated, _ = llm_client._validate_response("".join(parts))
+    yield "done", finalize(validated)
+
+
+def stream_api_autotest(
+    openapi_spec: Any,
+    method: str,
+    path: str,
+    spec_id: str | None = None,
+) -> AsyncIterator[tuple[str, Any]]:
+    """
+    Потоковая генерация API автотеста
+    
+    Yields:
+        ("token", фрагмент) по мере генерации, при ошибке ("error", сообщение),
+        в конце ("done", итоговый код)
+    """
+    spec = spec_registry.resolve(openapi_spec, spec_id)
+    endpoint = spec.get_endpoint(method, path)
+    prompt, params = _build_api_autotest_prompt(spec, endpoint)
+    logger.info(f"Потоковая генерация API автотеста для {method} {path} через Cloud.ru GigaChat")
+    return _stream_autotest(
+        prompt, params, "api_autotest", _finalize_api_code,
+        lambda: _api_fallback_test(method, path)
+    )
+
+
+def stream_ui_autotest(scenario: str) -> AsyncIterator[tuple[str, Any]]:
+    """
+    Потоковая генерация UI автотеста
+    
+    Yields:
+        ("token", фрагмент) по мере генерации, при ошибке ("error", сообщение),
+        в конце ("done", итоговый код)
+    """
+    prompt, params = _build_ui_autotest_prompt(scenario)
+    logger.info(f"Потоковая генерация UI автотеста через Cloud.ru GigaChat")
+    return _stream_autotest(prompt, params, "ui_autotest", _finalize_ui_code, llm_client._fallback_test)
+
+
+def select_endpoints(
+    endpoints: list[OpenAPIEndpoint],
+    tags: list[str] | None = None,
+    path_prefix: str | None = None,
+    methods: list[str] | None = None,
+) -> list[OpenAPIEndpoint]:
+    """Отбирает эндпоинты по тегам, префиксу пути и HTTP методам"""
+    wanted_tags = set(tags or [])
+    wanted_methods = {m.upper() for m in methods or []}
+    return [
+        e for e in endpoints
+        if (not wanted_tags or wanted_tags.intersection(e.tags))
+        and (not path_prefix or e.path.startswith(path_prefix))
+        and (not wanted_methods or e.method.upper() in wanted_methods)
+    ]
+
+
+def generate_api_autotests_batch(
+    openapi_spec: Any,
+    tags: list[str] | None = None,
+    path_prefix: str | None = None,
+    methods: list[str] | None = None,
+    concurrency: int | None = None,
+    spec_id: str | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Генерирует API автотесты для всех эндпоинтов спецификации
+    
+    Спецификация берется из реестра, генерации идут параллельно
+    не более чем по concurrency штук. Фильтры и лимиты проверяются
+    сразу, до начала потока.
+    
+    Yields:
+        Результат по каждому эндпоинту в порядке завершения
+        (type="result", status="ok" | "error"), в конце type="summary"
+    """
+    settings = get_settings()
+    spec = spec_registry.resolve(openapi_spec, spec_id)
+    endpoints = select_endpoints(list(spec.endpoints.values()), tags, path_prefix, methods)
+    if not endpoints:
+        raise ValueError("Не найдено эндпоинтов, подходящих под фильтр")
+    if len(endpoints) > settings.BATCH_MAX_ENDPOINTS:
+        raise ValueError(
+            f"Слишком много эндпоинтов: {len(endpoints)} "
+            f"(максимум {settings.BATCH_MAX_ENDPOINTS})"
+        )
+    
+    concurrency = min(concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    logger.info(
+        f"Пакетная генерация API автотестов: {len(endpoints)} эндпоинтов, "
+        f"параллельно: {concurrency}"
+    )
+    return _run_batch(spec, endpoints, concurrency)
+
+
+async def _run_batch(
+    spec: RegisteredSpec,
+    endpoints: list[OpenAPIEndpoint],
+    concurrency: int,
+) -> AsyncIterator[dict[str, Any]]:
+    """Параллельная генерация с ограничением через семафор"""
+    semaphore = asyncio.Semaphore(concurrency)
+    batch_start = time.time()
+    
+    async def run(endpoint: OpenAPIEndpoint) -> dict[str, Any]:
+        async with semaphore:
+            start = time.time()
+            result: dict[str, Any] = {
+                "type": "result",
+                "method": endpoint.method,
+                "path": endpoint.path,
+            }
+            try:
+                result["code"] = await _generate_api_code(spec, endpoint)
+                result["status"] = "ok"
+            except Exception as e:
+                logger.error(f"Ошибка пакетной генерации для {endpoint.method} {endpoint.path}: {e}")
+                result["status"] = "error"
+                result["error"] = str(e)
+            result["duration_ms"] = round((time.time() - start) * 1000, 1)
+            return result
+    
+    tasks = [asyncio.ensure_future(run(e)) for e in endpoints]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result["status"] == "ok":
+                succeeded += 1
+            else:
+                failed += 1
+            yield result
+    finally:
+        # Клиент отключился — не тратим токены на оставшиеся эндпоинты
+        for task in tasks:
+            task.cancel()
+    
+    yield {
+        "type": "summary",
+        "total": len(endpoints),
+        "succeeded": succeeded,
+        "failed": failed,
+        "duration_ms": round((time.time() - batch_start) * 1000, 1),
+    }
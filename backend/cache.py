@@ -0,0 +1,307 @@
+"""
+Бэкенды кэша ответов LLM: локальная память процесса и общий Redis
+"""
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from loguru import logger
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # redis не установлен — работаем только с локальным кэшем
+    aioredis = None
+    RedisError = OSError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Накладные расходы на запись в кэше (ключ, кортеж, узел OrderedDict), байт
+ENTRY_OVERHEAD_BYTES = 128
+
+# Ошибки разбора поврежденного значения или значения в чужом формате
+DECODE_ERRORS = (ValueError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class Codec:
+    """
+    Сжатие значений кэша
+
+    Первый байт значения — маркер алгоритма, поэтому данные, записанные
+    репликами с разными настройками, читаются всеми.
+    """
+
+    def __init__(self, compression: str = "zlib") -> None:
+        if compression == "zstd" and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, используем zlib")
+            compression = "zlib"
+        if compression not in {"zstd", "zlib", "none"}:
+            raise ValueError(f"Неизвестный алгоритм сжатия кэша: {compression}")
+        self.compression = compression
+        self._zstd_compressor = zstandard.ZstdCompressor() if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def encode(self, value: str) -> bytes:
+        data = value.encode("utf-8")
+        if self.compression == "zstd":
+            return b"s" + self._zstd_compressor.compress(data)
+        if self.compression == "zlib":
+            return b"z" + zlib.compress(data)
+        return b"n" + data
+
+    def decode(self, payload: bytes) -> str:
+        marker, data = payload[:1], payload[1:]
+        if marker == b"s":
+            if self._zstd_decompressor is None:
+                raise ValueError("Значение сжато zstd, но пакет zstandard не установлен")
+            return self._zstd_decompressor.decompress(data).decode("utf-8")
+        if marker == b"z":
+            return zlib.decompress(data).decode("utf-8")
+        return data.decode("utf-8")
+
+
+class CacheBackend(ABC):
+    """Базовый интерфейс кэша ответов LLM"""
+
+    name: str = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Получить значение по ключу или None при промахе"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        """Сохранить значение с TTL в секундах"""
+
+    def stats(self) -> dict:
+        """Статистика бэкенда для метрик"""
+        return {"backend": self.name}
+
+    async def close(self) -> None:
+        """Освобождение ресурсов бэкенда"""
+
+
+class MemoryCache(CacheBackend):
+    """
+    LRU кэш в памяти процесса с TTL и бюджетом по объему
+
+    При превышении max_bytes вытесняются самые давно использованные записи.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        ttl_seconds: int = 86400,
+        max_bytes: int = 64 * 1024 * 1024,
+        codec: Optional[Codec] = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.codec = codec or Codec()
+        self._data: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(key: str, payload: bytes) -> int:
+        return len(key) + len(payload) + ENTRY_OVERHEAD_BYTES
+
+    def _remove(self, key: str) -> None:
+        _, payload = self._data.pop(key)
+        self._size_bytes -= self._entry_size(key, payload)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return self.codec.decode(payload)
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = ttl or self.ttl_seconds
+        payload = self.codec.encode(value)
+        size = self._entry_size(key, payload)
+        if size > self.max_bytes:
+            logger.warning(f"Ответ {key} ({size} байт) больше бюджета кэша, не сохраняем")
+            return
+
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + ttl, payload)
+        self._size_bytes += size
+
+        while self._size_bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "entries": len(self._data),
+            "size_bytes": self._size_bytes,
+            "max_bytes": self.max_bytes,
+            "compression": self.codec.compression,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RedisCache(CacheBackend):
+    """
+    Общий кэш в Redis для всех воркеров и реплик
+
+    При недоступности Redis запросы обслуживаются локальным кэшем,
+    повторное подключение пробуется не чаще раза в retry_interval секунд.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        ttl_seconds: int = 86400,
+        prefix: str = "aitest:llm",
+        fallback: Optional[CacheBackend] = None,
+        codec: Optional[Codec] = None,
+        retry_interval: float = 30.0,
+        socket_timeout: float = 0.5,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.codec = codec or Codec()
+        self.fallback = fallback or MemoryCache(ttl_seconds, codec=self.codec)
+        self.retry_interval = retry_interval
+        self._down_until = 0.0
+        self._errors = 0
+        self.hits = 0
+        self.misses = 0
+        self._client = aioredis.Redis(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _mark_down(self, exc: Exception) -> None:
+        self._errors += 1
+        self._down_until = time.monotonic() + self.retry_interval
+        logger.warning(
+            f"Redis недоступен ({exc}), используем локальный кэш "
+            f"на {self.retry_interval:.0f}с"
+        )
+
+    async def get(self, key: str) -> Optional[str]:
+        if self._available():
+            try:
+                payload = await self._client.get(self._key(key))
+            except (RedisError, OSError) as exc:
+                self._mark_down(exc)
+            else:
+                if payload is None:
+                    self.misses += 1
+                    return None
+                try:
+                    value = self.codec.decode(payload)
+                except DECODE_ERRORS as exc:
+                    # Значение старой версии или другого писателя считается промахом
+                    self.misses += 1
+                    logger.warning(f"Значение кэша {key} не декодируется ({exc}), ключ удален")
+                    await self._delete(key)
+                    return None
+                self.hits += 1
+                return value
+        return await self.fallback.get(key)
+
+    async def _delete(self, key: str) -> None:
+        try:
+            await self._client.delete(self._key(key))
+        except (RedisError, OSError) as exc:
+            self._mark_down(exc)
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = ttl or self.ttl_seconds
+        # Локальная копия нужна, чтобы при падении Redis не терять уже полученные ответы
+        await self.fallback.set(key, value, ttl)
+        if not self._available():
+            return
+        try:
+            await self._client.set(self._key(key), self.codec.encode(value), ex=ttl)
+        except (RedisError, OSError) as exc:
+            self._mark_down(exc)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "available": self._available(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "errors": self._errors,
+            "fallback": self.fallback.stats(),
+        }
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_cache_backend(settings) -> CacheBackend:
+    """Создает бэкенд кэша по настройкам приложения"""
+    codec = Codec(settings.CACHE_COMPRESSION)
+    memory = MemoryCache(
+        ttl_seconds=settings.CACHE_TTL_SECONDS,
+        max_bytes=settings.CACHE_MAX_BYTES,
+        codec=codec,
+    )
+
+    if settings.CACHE_BACKEND != "redis" or not settings.REDIS_HOST:
+        return memory
+    if aioredis is None:
+        logger.warning("Пакет redis не установлен, используем локальный кэш")
+        return memory
+
+    logger.info(f"Кэш LLM в Redis: {settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}")
+    return RedisCache(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD,
+        ttl_seconds=settings.CACHE_TTL_SECONDS,
+        prefix=settings.CACHE_KEY_PREFIX,
+        fallback=memory,
+        codec=codec,
+    )
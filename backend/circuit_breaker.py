@@ -0,0 +1,151 @@
+"""
+Circuit breaker для запросов к LLM
+"""
+import time
+from collections import deque
+from typing import Any, Deque, Tuple
+
+from loguru import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Числовое значение состояния для Prometheus
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонен без обращения к модели: провайдер деградировал"""
+
+
+class CircuitBreaker:
+    """
+    Размыкатель по скользящему окну ошибок и медленных ответов
+
+    closed: запросы идут, исходы копятся в окне window_seconds. Если в окне
+    не меньше min_calls вызовов и доля ошибок или медленных ответов выше
+    порога, цепь размыкается.
+    open: запросы сразу отклоняются CircuitOpenError в течение open_seconds.
+    half_open: пропускается не больше half_open_probes пробных запросов;
+    успешная проба замыкает цепь, ошибка — снова размыкает.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 60.0,
+        min_calls: int = 10,
+        error_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 20.0,
+        slow_rate_threshold: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # (время, ошибка, медленный)
+        self._window: Deque[Tuple[float, bool, bool]] = deque()
+        self._errors = 0
+        self._slow = 0
+        self._probes = 0
+        self._probe_started = 0.0
+        self.rejected = 0
+        self.opened = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "CircuitBreaker":
+        return cls(
+            window_seconds=settings.LLM_BREAKER_WINDOW_SECONDS,
+            min_calls=settings.LLM_BREAKER_MIN_CALLS,
+            error_rate_threshold=settings.LLM_BREAKER_ERROR_RATE,
+            slow_call_seconds=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+            slow_rate_threshold=settings.LLM_BREAKER_SLOW_RATE,
+            open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+            half_open_probes=settings.LLM_BREAKER_HALF_OPEN_PROBES,
+        )
+
+    def _trim(self, now: float) -> None:
+        while self._window and self._window[0][0] < now - self.window_seconds:
+            _, error, slow = self._window.popleft()
+            self._errors -= error
+            self._slow -= slow
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker LLM: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened += 1
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._window.clear()
+            self._errors = self._slow = 0
+        self._probes = 0
+
+    def before_call(self) -> None:
+        """
+        Разрешить вызов или отклонить его
+
+        Raises:
+            CircuitOpenError: цепь разомкнута или все пробы уже выполняются
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpenError("LLM временно недоступна (circuit breaker разомкнут)")
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            # Проба без результата дольше open_seconds считается потерянной
+            if self._probes and time.monotonic() - self._probe_started > self.open_seconds:
+                self._probes = 0
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError("LLM проверяется пробным запросом (circuit breaker)")
+            self._probes += 1
+            self._probe_started = time.monotonic()
+
+    def record(self, success: bool, duration_s: float) -> None:
+        """Учесть исход вызова, пропущенного before_call"""
+        slow = duration_s >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED if success and not slow else OPEN)
+            return
+        if self.state == OPEN:
+            return
+
+        now = time.monotonic()
+        self._window.append((now, not success, slow))
+        self._errors += not success
+        self._slow += slow
+        self._trim(now)
+        calls = len(self._window)
+        if calls >= self.min_calls and (
+            self._errors / calls >= self.error_rate_threshold
+            or self._slow / calls >= self.slow_rate_threshold
+        ):
+            self._transition(OPEN)
+
+    def release_probe(self) -> None:
+        """Проба отменена без результата — освободить ее место"""
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def stats(self) -> dict[str, Any]:
+        self._trim(time.monotonic())
+        calls = len(self._window)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "error_rate": self._errors / calls if calls else 0.0,
+            "slow_rate": self._slow / calls if calls else 0.0,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
@@ -17,12 +17,138 @@ class Settings(BaseSettings):
     
     # Настройки запросов
     LLM_TIMEOUT_SECONDS: int = 60
-    LLM_MAX_RETRIES: int = 3
-    LLM_TEMPERATURE: float = 0.3
+    LLM_MAX_RETRIES: int = 3  # повторы выполняет LLMClient, ретраи SDK выключены
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 1.0
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 30.0
+    LLM_TEMPERATURE: float = 0.3  # по умолчанию, если шаблон не задает свою
     LLM_MAX_TOKENS: int = 2048
     
+    # Бюджет контекстного окна модели (оценка токенов локальная, см. tokens.py)
+    LLM_CONTEXT_WINDOW: int = 32768
+    LLM_CONTEXT_MARGIN_TOKENS: int = 256  # запас на погрешность оценки
+    LLM_MIN_OUTPUT_TOKENS: int = 512  # меньше места на ответ — запрос не отправляется
+    LLM_INPUT_OVERFLOW: str = "trim"  # trim | reject — ввод больше контекста
+    LLM_METRICS_HISTORY_SIZE: int = 1000  # размер кольцевого буфера записей метрик
+    
+    # Клиентские лимиты провайдера (0 — без лимита) и адаптивная параллельность (AIMD);
+    # значения на под, каждый из WEB_CONCURRENCY процессов получает свою долю
+    LLM_RATE_LIMIT_RPM: int = 120
+    LLM_RATE_LIMIT_TPM: int = 0
+    LLM_CONCURRENCY_INITIAL: int = 8
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 32
+    
+    # Circuit breaker: при деградации провайдера сразу кэш или fallback
+    LLM_BREAKER_WINDOW_SECONDS: float = 60.0
+    LLM_BREAKER_MIN_CALLS: int = 10  # минимум вызовов в окне для размыкания
+    LLM_BREAKER_ERROR_RATE: float = 0.5
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 20.0
+    LLM_BREAKER_SLOW_RATE: float = 0.8
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0  # пауза перед пробным запросом
+    LLM_BREAKER_HALF_OPEN_PROBES: int = 1
+    
+    # Хеджирование: дубль запроса, если ответа нет дольше квантиля недавних задержек
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_QUANTILE: float = 0.9
+    LLM_HEDGE_WINDOW: int = 200  # последних вызовов для квантиля и доли хеджей
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # до этого числа замеров хедж не отправляется
+    LLM_HEDGE_MAX_RATIO: float = 0.1  # максимум доли хеджированных вызовов
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 1.0
+    
+    # Кэш ответов LLM
+    CACHE_BACKEND: str = "redis"  # redis | memory
+    CACHE_TTL_SECONDS: int = 86400
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # бюджет локального кэша
+    CACHE_COMPRESSION: str = "zlib"  # zstd | zlib | none
+    CACHE_KEY_PREFIX: str = "aitest:llm"
+    
+    # Redis
+    REDIS_HOST: str | None = None
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_PASSWORD: str | None = None
+    
+    # Реестр OpenAPI спецификаций
+    SPEC_REGISTRY_MAX_ENTRIES: int = 64
+    SPEC_VALIDATION_STRICT: bool = False  # отклонять невалидные спецификации
+    SPEC_STORE_DIR: str | None = None  # общий каталог документов для нескольких воркеров
+    PROMPT_SPEC_CONTEXT_MAX_CHARS: int = 6000  # бюджет контекста эндпоинта в промпте
+    
+    # Пакетная генерация автотестов
+    BATCH_MAX_CONCURRENCY: int = 4
+    BATCH_MAX_ENDPOINTS: int = 500
+    
+    # Очередь фоновых задач генерации (async_job в /generate/testcase и /generate/autotest)
+    JOBS_ENABLED: bool = True
+    JOB_QUEUE_BACKEND: str = "redis"  # redis | sqlite; без REDIS_HOST — sqlite
+    JOB_DB_PATH: str = "data/jobs.db"
+    JOB_KEY_PREFIX: str = "aitest:jobs"
+    JOB_WORKER_CONCURRENCY: int = 4  # задач одновременно в одном процессе worker.py
+    JOB_API_WORKERS: int = 0  # задач выполняет сам API процесс (локальный запуск без worker.py)
+    JOB_TIMEOUT_SECONDS: float = 900.0  # дедлайн одной задачи
+    JOB_HEARTBEAT_SECONDS: float = 15.0
+    JOB_STALE_SECONDS: float = 120.0  # задача без heartbeat возвращается в очередь
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RESULT_TTL_SECONDS: int = 86400
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0
+    JOB_SHUTDOWN_GRACE_SECONDS: float = 30.0  # дождаться выполняемых задач при остановке
+    
+    # Сквозной дедлайн HTTP запроса (заголовок X-Request-Timeout или по маршруту)
+    REQUEST_DEADLINE_SECONDS: float = 180.0
+    REQUEST_DEADLINE_MAX_SECONDS: float = 1800.0
+    REQUEST_DEADLINE_ROUTES: str = "/generate/autotest/batch=1800,/validate=60"
+    REQUEST_DISCONNECT_POLL_SECONDS: float = 1.0
+    
+    # Исправление сгенерированного кода по замечаниям валидатора
+    REPAIR_MAX_ROUNDS: int = 2
+    REPAIR_TIME_BUDGET_SECONDS: float = 90.0  # от начала генерации
+    REPAIR_TOKEN_BUDGET: int = 8000  # оценка токенов на все раунды
+    REPAIR_WARNING_CODES: str = "missing_step_arrange,missing_step_act,missing_step_assert"
+    
+    # Best-of-N: параллельные варианты ответа, первый валидный побеждает
+    BEST_OF_N_SAMPLES: str = "CRITICAL=4,HIGH=3,NORMAL=2,LOW=1"  # по TestPriority
+    BEST_OF_N_DEADLINE_SECONDS: str = "CRITICAL=60,HIGH=45,NORMAL=30,LOW=30"
+    BEST_OF_N_TEMPERATURE_STEP: float = 0.15  # прибавка температуры для каждого следующего варианта
+    BEST_OF_N_MAX_TEMPERATURE: float = 0.9
+    
+    # Валидация тест-кейсов
+    VALIDATION_POOL_KIND: str = "process"  # process | thread
+    VALIDATION_MAX_WORKERS: int = 2
+    VALIDATION_MAX_FILE_BYTES: int = 512 * 1024
+    VALIDATION_TIMEOUT_SECONDS: float = 5.0
+    VALIDATION_BATCH_MAX_FILES: int = 200
+    VALIDATION_MEMO_SIZE: int = 1024  # отчетов в LRU по хэшу содержимого
+    
+    # Запуск pytest на присланном коде: это не песочница, включать только
+    # для доверенных клиентов (см. README)
+    EXECUTION_ENABLED: bool = False
+    EXECUTION_USER: str = "nobody"  # пользователь задачи, если API запущен от root
+    EXECUTION_ISOLATE_NETWORK: bool = True  # без сети; если unshare недоступен, задача не выполняется
+    EXECUTION_MAX_WORKERS: int = 2
+    EXECUTION_TIMEOUT_SECONDS: float = 30.0
+    EXECUTION_MEMORY_MB: int = 1024
+    EXECUTION_PRELOAD_MODULES: str = "pytest,allure,httpx,playwright.sync_api"
+    
+    # Долговременное хранилище метрик (SQLite на томе /app/data)
+    METRICS_STORE_ENABLED: bool = True
+    METRICS_DB_PATH: str = "data/metrics.db"
+    METRICS_FLUSH_INTERVAL_SECONDS: float = 5.0
+    METRICS_RAW_RETENTION_HOURS: int = 48
+    METRICS_MINUTE_RETENTION_DAYS: int = 14
+    METRICS_HOUR_RETENTION_DAYS: int = 365
+    
+    # Несколько воркеров uvicorn: снимки метрик процессов в общем каталоге,
+    # /metrics* объединяют их по всему поду (пусто — метрики одного процесса)
+    METRICS_MULTIPROC_DIR: str | None = None
+    METRICS_SNAPSHOT_INTERVAL_SECONDS: float = 5.0
+    WEB_CONCURRENCY: int = 1  # число процессов uvicorn (--workers), делит лимиты LLM
+    
     # Логирование
     LOG_LEVEL: str = "INFO"
+    LOG_FILE: str | None = "logs/app.log"  # пусто — только stderr
+    LOG_JSON: bool = False  # JSON-строки в файле лога
+    LOG_REQUEST_SAMPLE_RATE: float = 0.1  # доля успешных запросов в info-логе
+    LOG_SLOW_REQUEST_SECONDS: float = 2.0  # медленные запросы логируются всегда
 
 
 @lru_cache
@@ -0,0 +1,122 @@
+"""
+Сквозной дедлайн запроса и отмена работы, которую клиент уже не ждет
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, List, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+from metrics import metrics_collector
+
+T = TypeVar("T")
+
+# Абсолютный дедлайн текущего HTTP запроса по time.monotonic()
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+# Заголовок с бюджетом запроса в секундах
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class RequestAborted(Exception):
+    """Обработка запроса прервана"""
+    reason = "aborted"
+    status_code = 500
+
+
+class DeadlineExceeded(RequestAborted):
+    """Истек дедлайн запроса"""
+    reason = "deadline"
+    status_code = 504
+
+
+class ClientDisconnected(RequestAborted):
+    """Клиент закрыл соединение"""
+    reason = "client_disconnect"
+    # Код nginx для запроса, закрытого клиентом
+    status_code = 499
+
+
+def remaining() -> Optional[float]:
+    """Секунд до дедлайна текущего запроса; None — дедлайна нет"""
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def within_deadline(awaitable: Awaitable[T], message: str) -> T:
+    """
+    Дождаться результата не дольше остатка дедлайна текущего запроса
+
+    Raises:
+        DeadlineExceeded: дедлайн истек раньше, ожидание отменено
+    """
+    budget = remaining()
+    if budget is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(budget, 0.0))
+    except asyncio.TimeoutError as exc:
+        raise DeadlineExceeded(message) from exc
+
+
+def parse_route_deadlines(value: str) -> List[Tuple[str, float]]:
+    """Разбор "/prefix=seconds,..." в список, самые длинные префиксы первыми"""
+    routes = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        prefix, _, seconds = item.partition("=")
+        routes.append((prefix.strip(), float(seconds)))
+    return sorted(routes, key=lambda route: len(route[0]), reverse=True)
+
+
+def deadline_seconds(path: str, header: Optional[str], settings) -> float:
+    """
+    Бюджет запроса: из заголовка (не больше REQUEST_DEADLINE_MAX_SECONDS)
+    или по умолчанию для маршрута
+    """
+    if header:
+        try:
+            return min(max(float(header), 0.0), settings.REQUEST_DEADLINE_MAX_SECONDS)
+        except ValueError:
+            logger.warning(f"Некорректный {DEADLINE_HEADER}: {header!r}")
+    for prefix, seconds in parse_route_deadlines(settings.REQUEST_DEADLINE_ROUTES):
+        if path.startswith(prefix):
+            return seconds
+    return settings.REQUEST_DEADLINE_SECONDS
+
+
+async def run_guarded(request, work: Awaitable[T], route: str, poll_seconds: float = 1.0) -> T:
+    """
+    Выполнить обработку запроса, отменив ее при отключении клиента или по дедлайну
+
+    Отмена задачи прерывает и ожидающий вызов модели, поэтому брошенные
+    запросы не расходуют токены.
+
+    Raises:
+        ClientDisconnected: клиент закрыл соединение
+        DeadlineExceeded: истек дедлайн запроса
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            budget = remaining()
+            if budget is not None and budget <= 0:
+                raise DeadlineExceeded("Истек дедлайн запроса")
+            timeout = poll_seconds if budget is None else min(poll_seconds, budget)
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected("Клиент закрыл соединение")
+    except RequestAborted as exc:
+        metrics_collector.record_request_aborted(route, exc.reason)
+        logger.info(f"Обработка {route} прервана: {exc.reason}")
+        raise
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
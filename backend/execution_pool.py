@@ -0,0 +1,363 @@
+"""
+Запуск pytest на сгенерированном коде в пуле заранее прогретых процессов
+
+Воркеры пула при старте импортируют pytest, allure, httpx и playwright и
+один раз прогоняют pytest, чтобы загрузить плагины. Каждая задача
+выполняется в дочернем процессе, форкнутом от прогретого воркера, со своим
+временным каталогом, ограничениями ресурсов и таймаутом. Дочерний процесс
+получает минимальное окружение без секретов приложения, по возможности
+переключается на непривилегированного пользователя и отключается от сети.
+
+Это не песочница: код выполняется в контейнере API и видит его файловую
+систему с правами EXECUTION_USER.
+"""
+import asyncio
+import contextlib
+import ctypes
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from config import get_settings
+from schemas import ExecutionReport
+
+try:
+    import resource
+except ImportError:  # не POSIX — без ограничений ресурсов
+    resource = None
+
+
+# Сколько последних символов вывода pytest возвращать в отчете
+OUTPUT_TAIL_CHARS = 4000
+
+# Переменные окружения, которые передаются задаче; LLM_API_KEY, REDIS_* и
+# прочие настройки приложения не передаются
+CHILD_ENV_KEYS = ("PATH", "LANG", "LC_ALL", "TZ", "PLAYWRIGHT_BROWSERS_PATH")
+
+# Флаги unshare(2)
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+
+
+class _ResultCollector:
+    """Плагин pytest: собирает собранные тесты, ошибки сборки и исходы"""
+
+    def __init__(self) -> None:
+        self.collected: List[str] = []
+        self.errors: List[Dict[str, str]] = []
+        self.outcomes: Dict[str, int] = {"passed": 0, "failed": 0, "skipped": 0}
+
+    def pytest_collectreport(self, report) -> None:
+        if report.failed:
+            self.errors.append({"nodeid": report.nodeid, "message": str(report.longrepr)[-2000:]})
+
+    def pytest_collection_modifyitems(self, items) -> None:
+        self.collected.extend(item.nodeid for item in items)
+
+    def pytest_runtest_logreport(self, report) -> None:
+        if report.when == "call" or report.outcome != "passed":
+            if report.outcome in self.outcomes:
+                self.outcomes[report.outcome] += 1
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int) -> None:
+    if resource is None:
+        return
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (64 * 1024 * 1024,) * 2)
+
+
+def _unshare_network() -> None:
+    """Перевести процесс в новое сетевое пространство (только loopback)"""
+    # Без root новое сетевое пространство создается внутри своего user namespace
+    flags = CLONE_NEWNET if os.geteuid() == 0 else CLONE_NEWUSER | CLONE_NEWNET
+    if hasattr(os, "unshare"):
+        os.unshare(flags)
+        return
+    unshare = getattr(ctypes.CDLL(None, use_errno=True), "unshare", None)
+    if unshare is None:
+        raise OSError("unshare недоступен на этой платформе")
+    if unshare(flags) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _isolate(user: Optional[str], isolate_network: bool) -> None:
+    """Окружение, пользователь и сеть дочернего процесса задачи"""
+    env = {key: os.environ[key] for key in CHILD_ENV_KEYS if key in os.environ}
+    os.environ.clear()
+    os.environ.update(env, HOME=tempfile.gettempdir())
+    # Настройки с ключами, прочитанные воркером при импорте
+    get_settings.cache_clear()
+
+    if user and os.geteuid() == 0:
+        import pwd
+
+        entry = pwd.getpwnam(user)
+        os.setgroups([])
+        os.setgid(entry.pw_gid)
+        os.setuid(entry.pw_uid)
+
+    if isolate_network:
+        try:
+            _unshare_network()
+        except OSError as exc:
+            raise RuntimeError(
+                f"Не удалось отключить задачу от сети ({exc}); "
+                "запуск без изоляции сети — EXECUTION_ISOLATE_NETWORK=false"
+            ) from exc
+
+
+def _run_pytest(code: str, mode: str, module_name: str = "test_generated") -> Dict[str, Any]:
+    """pytest для одного файла во временном каталоге текущего процесса"""
+    import pytest
+
+    started = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix="aitest-run-")
+    collector = _ResultCollector()
+    output = io.StringIO()
+    try:
+        path = os.path.join(workdir, f"{module_name}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(code)
+        os.chdir(workdir)
+        args = [path, "-q", "-p", "no:cacheprovider", "--rootdir", workdir]
+        if mode == "collect":
+            args.append("--collect-only")
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            exit_code = int(pytest.main(args, plugins=[collector]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "mode": mode,
+        # 0 — тесты прошли или собраны
+        "status": "ok" if exit_code == 0 else "failed",
+        "exit_code": exit_code,
+        "collected": collector.collected,
+        "collection_errors": collector.errors,
+        **(collector.outcomes if mode == "run" else {}),
+        "duration_ms": (time.perf_counter() - started) * 1000,
+        "output": output.getvalue()[-OUTPUT_TAIL_CHARS:],
+    }
+
+
+def _warm_up(preload: Sequence[str]) -> None:
+    """Инициализатор воркера: импорт модулей и пробный прогон pytest для загрузки плагинов"""
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    cwd, path = os.getcwd(), list(sys.path)
+    try:
+        _run_pytest("def test_warm_up():\n    pass\n", "collect", module_name="aitest_warm_up")
+    finally:
+        # Форкнутые задачи не должны видеть следов прогрева
+        os.chdir(cwd)
+        sys.path[:] = path
+        sys.modules.pop("aitest_warm_up", None)
+
+
+def run_pytest_job(
+    code: str,
+    mode: str,
+    timeout_seconds: float,
+    memory_mb: int,
+    user: Optional[str] = None,
+    isolate_network: bool = True,
+) -> Dict[str, Any]:
+    """
+    Выполнить pytest в дочернем процессе, форкнутом от прогретого воркера
+
+    mode: collect — только pytest --collect-only, run — запуск тестов
+    """
+    started = time.perf_counter()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            _isolate(user, isolate_network)
+            _apply_limits(int(timeout_seconds) + 1, memory_mb)
+            payload = json.dumps(_run_pytest(code, mode)).encode("utf-8")
+        except BaseException as exc:
+            status = 1
+            payload = json.dumps({"mode": mode, "status": "failed", "output": repr(exc)}).encode("utf-8")
+        with os.fdopen(write_fd, "wb") as pipe:
+            pipe.write(payload)
+        os._exit(status)
+
+    os.close(write_fd)
+    chunks: List[bytes] = []
+    deadline = time.monotonic() + timeout_seconds
+    with os.fdopen(read_fd, "rb") as pipe:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                return {"mode": mode, "status": "timeout", "output": ""}
+            ready, _, _ = select.select([pipe], [], [], remaining)
+            if ready:
+                chunk = os.read(pipe.fileno(), 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    _, wait_status = os.waitpid(pid, 0)
+
+    if not chunks:
+        # Процесс убит сигналом: лимит CPU (SIGXCPU) или памяти
+        signum = os.WTERMSIG(wait_status) if os.WIFSIGNALED(wait_status) else None
+        return {
+            "mode": mode,
+            "status": "crashed",
+            "output": f"Процесс pytest аварийно завершился (сигнал {signum})",
+            "duration_ms": (time.perf_counter() - started) * 1000,
+        }
+    return json.loads(b"".join(chunks))
+
+
+class ExecutionPool:
+    """
+    Пул запуска pytest
+
+    Воркеры долгоживущие и прогретые; задачи изолированы друг от друга
+    форком. Таймаут задачи обрабатывает сам воркер, пул пересоздается
+    только если воркер перестал отвечать.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        timeout_seconds: float = 30.0,
+        memory_mb: int = 1024,
+        preload: Sequence[str] = ("pytest", "allure", "httpx", "playwright.sync_api"),
+        user: Optional[str] = "nobody",
+        isolate_network: bool = True,
+    ) -> None:
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self.memory_mb = memory_mb
+        self.preload = list(preload)
+        self.user = user
+        self.isolate_network = isolate_network
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.completed = 0
+        self.timeouts = 0
+        self.crashes = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ExecutionPool":
+        return cls(
+            max_workers=settings.EXECUTION_MAX_WORKERS,
+            timeout_seconds=settings.EXECUTION_TIMEOUT_SECONDS,
+            memory_mb=settings.EXECUTION_MEMORY_MB,
+            preload=[m.strip() for m in settings.EXECUTION_PRELOAD_MODULES.split(",") if m.strip()],
+            user=settings.EXECUTION_USER or None,
+            isolate_network=settings.EXECUTION_ISOLATE_NETWORK,
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: воркер однопоточный, поэтому os.fork в нем безопасен
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+                initargs=(self.preload,),
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """Запустить и прогреть все воркеры"""
+        executor = self._get_executor()
+        await asyncio.gather(*(
+            asyncio.wrap_future(executor.submit(os.getpid)) for _ in range(self.max_workers)
+        ))
+
+    def _restart(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        processes = list(getattr(executor, "_processes", {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    async def execute(self, code: str, mode: str = "collect") -> ExecutionReport:
+        """Собрать или запустить тесты из кода в отдельном процессе"""
+        if mode not in {"collect", "run"}:
+            raise ValueError(f"Неизвестный режим запуска: {mode}")
+
+        for attempt in range(2):
+            executor = self._get_executor()
+            future = executor.submit(
+                run_pytest_job, code, mode, self.timeout_seconds, self.memory_mb,
+                self.user, self.isolate_network,
+            )
+            try:
+                # Запас сверх таймаута задачи: его соблюдает сам воркер
+                result = await asyncio.wait_for(
+                    asyncio.wrap_future(future), self.timeout_seconds + 10
+                )
+            except asyncio.TimeoutError:
+                logger.error("Воркер pytest не отвечает, пул пересоздается")
+                if self._executor is executor:
+                    self._restart()
+                result = {"mode": mode, "status": "timeout", "output": ""}
+                break
+            except (BrokenProcessPool, asyncio.CancelledError):
+                task = asyncio.current_task()
+                if task is not None and task.cancelling():
+                    raise
+                if self._executor is executor:
+                    self._restart()
+                if attempt:
+                    result = {"mode": mode, "status": "crashed", "output": "Воркер pytest аварийно завершился"}
+                    break
+            else:
+                break
+
+        if result["status"] == "timeout":
+            self.timeouts += 1
+            logger.warning(f"pytest не уложился в {self.timeout_seconds}с")
+        elif result["status"] == "crashed":
+            self.crashes += 1
+        else:
+            self.completed += 1
+        return ExecutionReport(**result)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Глобальный пул запуска тестов
+execution_pool = ExecutionPool.from_settings(get_settings())
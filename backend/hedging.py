@@ -0,0 +1,177 @@
+"""
+Хеджирование запросов к LLM: дубль запроса, если ответ задерживается
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    """Скользящее окно последних задержек с квантилем по запросу"""
+
+    def __init__(self, size: int = 200) -> None:
+        self._values: Deque[float] = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self._sorted = None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._values:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._values)
+        index = min(int(q * len(self._sorted)), len(self._sorted) - 1)
+        return self._sorted[index]
+
+
+class HedgePolicy:
+    """
+    Хеджирование по квантилю недавних задержек
+
+    Если основной запрос не ответил за quantile задержек последних window
+    успешных вызовов, отправляется дубль; используется первый ответ, второй
+    запрос отменяется. Доля хеджированных вызовов среди последних window
+    ограничена max_ratio, чтобы дополнительный расход токенов был ограничен.
+
+    Задержка и таймер хеджа отсчитываются от отправки запроса провайдеру,
+    без ожидания в очереди ограничителя: вызов сообщает об отправке
+    через переданную ему отметку.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.9,
+        window: int = 200,
+        min_samples: int = 20,
+        max_ratio: float = 0.1,
+        min_delay_seconds: float = 1.0,
+    ) -> None:
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.min_delay_seconds = min_delay_seconds
+        self.latency = LatencyWindow(window)
+        # Был ли хедж у последних вызовов — для ограничения доли
+        self._recent: Deque[bool] = deque(maxlen=window)
+        self._recent_hedged = 0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.suppressed = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "HedgePolicy":
+        return cls(
+            quantile=settings.LLM_HEDGE_QUANTILE,
+            window=settings.LLM_HEDGE_WINDOW,
+            min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+            max_ratio=settings.LLM_HEDGE_MAX_RATIO,
+            min_delay_seconds=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+        )
+
+    def delay(self) -> Optional[float]:
+        """Через сколько секунд отправлять дубль; None — данных пока мало"""
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.latency.quantile(self.quantile), self.min_delay_seconds)
+
+    def _track(self, hedged: bool) -> None:
+        if len(self._recent) == self._recent.maxlen and self._recent[0]:
+            self._recent_hedged -= 1
+        self._recent.append(hedged)
+        self._recent_hedged += hedged
+
+    def _hedge_allowed(self) -> bool:
+        return self._recent_hedged + 1 <= self.max_ratio * max(len(self._recent), 1)
+
+    async def run(
+        self,
+        call: Callable[[Callable[[], None]], Awaitable[T]],
+        congested: Callable[[], bool] = lambda: False,
+    ) -> T:
+        """
+        Выполнить вызов с хеджированием
+
+        Args:
+            call: запрос; вызывает переданную отметку в момент отправки провайдеру
+            congested: есть ли очередь к провайдеру — тогда дубль не отправляется
+        """
+        self.calls += 1
+        delay = self.delay()
+        sent: Dict[asyncio.Future, float] = {}
+        primary_sent = asyncio.Event()
+
+        def launch(primary: bool) -> asyncio.Future:
+            def mark() -> None:
+                sent[task] = time.monotonic()
+                if primary:
+                    primary_sent.set()
+
+            task = asyncio.ensure_future(call(mark))
+            return task
+
+        primary = launch(True)
+        tasks = [primary]
+        hedged = False
+        try:
+            if delay is not None:
+                # Таймер хеджа запускается после получения слота ограничителя
+                waiter = asyncio.ensure_future(primary_sent.wait())
+                try:
+                    await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                if not primary.done():
+                    done, _ = await asyncio.wait({primary}, timeout=delay)
+                    if not done:
+                        if self._hedge_allowed() and not congested():
+                            hedged = True
+                            self.hedges += 1
+                            logger.debug(f"Ответ LLM дольше {delay:.2f}с, отправлен дублирующий запрос")
+                            tasks.append(launch(False))
+                        else:
+                            self.suppressed += 1
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Основной запрос в приоритете, если оба завершились одновременно
+                for task in sorted(done, key=lambda t: t is not primary):
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        if task in sent:
+                            self.latency.add(time.monotonic() - sent[task])
+                        return task.result()
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            self._track(hedged)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Ошибка проигравшего запроса уже не важна
+                    task.exception()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "suppressed": self.suppressed,
+            "hedge_ratio": self.hedges / self.calls if self.calls else 0.0,
+            "delay_seconds": self.delay(),
+        }
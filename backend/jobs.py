@@ -0,0 +1,610 @@
+"""
+Очередь фоновых задач генерации: Redis или SQLite как локальная замена
+
+API кладет задачу и сразу возвращает ее id, задачи выполняют отдельные
+процессы worker.py. Задача, воркер которой перестал присылать heartbeat,
+возвращается в очередь, поэтому перезапуск не теряет работу.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from autotest_generator import generate_api_autotest, generate_ui_autotest
+from config import get_settings
+from schemas import GenerateAutotestRequest, GenerateTestcaseRequest
+from testcase_generator import generate_testcase
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis не установлен — очередь только в SQLite
+    aioredis = None
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+FINISHED = (SUCCEEDED, FAILED)
+
+# Вид задачи -> схема запроса /generate/<вид>
+JOB_SCHEMAS = {
+    "testcase": GenerateTestcaseRequest,
+    "autotest": GenerateAutotestRequest,
+}
+
+
+def generation_request_type(kind: str, payload: BaseModel) -> str:
+    """Тип запроса для метрик"""
+    return "testcase_generation" if kind == "testcase" else f"autotest_{payload.target}"
+
+
+def check_generation_payload(kind: str, payload: BaseModel) -> None:
+    """
+    Проверка полей, обязательных для выбранного target
+
+    Raises:
+        ValueError: в запросе не хватает полей
+    """
+    if kind != "autotest":
+        return
+    if payload.target == "api":
+        if not ((payload.openapi_spec or payload.spec_id) and payload.method and payload.path):
+            raise ValueError("Для target=api нужны openapi_spec или spec_id, method и path")
+    elif not payload.scenario:
+        raise ValueError("Для target=ui нужен scenario")
+
+
+def generation_work(kind: str, payload: BaseModel) -> Awaitable[str]:
+    """
+    Корутина генерации по запросу /generate/<kind>
+
+    Общая для синхронных обработчиков API и воркеров очереди.
+
+    Raises:
+        ValueError: в запросе не хватает полей для выбранного target
+    """
+    check_generation_payload(kind, payload)
+    if kind == "testcase":
+        return generate_testcase(
+            test_type=payload.test_type,
+            requirements_text=payload.requirements_text,
+            openapi_spec=payload.openapi_spec,
+            repair=payload.repair,
+            best_of_n=payload.best_of_n,
+            priority=payload.priority,
+        )
+    if payload.target == "api":
+        return generate_api_autotest(
+            openapi_spec=payload.openapi_spec,
+            method=payload.method,
+            path=payload.path,
+            spec_id=payload.spec_id,
+            repair=payload.repair,
+            best_of_n=payload.best_of_n,
+        )
+    return generate_ui_autotest(payload.scenario, repair=payload.repair, best_of_n=payload.best_of_n)
+
+
+@dataclass
+class Job:
+    """Задача генерации и ее результат"""
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str = QUEUED
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    worker: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    heartbeat_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def new_job(kind: str, payload: Dict[str, Any]) -> Job:
+    return Job(id=uuid.uuid4().hex, kind=kind, payload=payload, created_at=time.time())
+
+
+class JobQueue(ABC):
+    """Базовый интерфейс очереди задач"""
+
+    name: str = "base"
+
+    def __init__(self, stale_seconds: float = 120.0, max_attempts: int = 3, result_ttl_seconds: int = 86400) -> None:
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.result_ttl_seconds = result_ttl_seconds
+
+    async def open(self) -> None:
+        """Подготовка хранилища"""
+
+    async def close(self) -> None:
+        """Освобождение ресурсов"""
+
+    @abstractmethod
+    async def enqueue(self, job: Job) -> Job:
+        """Сохранить задачу и поставить ее в очередь"""
+
+    @abstractmethod
+    async def claim(self, worker: str, timeout: float) -> Optional[Job]:
+        """Взять следующую задачу, ожидая не дольше timeout секунд"""
+
+    @abstractmethod
+    async def heartbeat(self, job_ids: List[str]) -> None:
+        """Отметить, что задачи еще выполняются"""
+
+    @abstractmethod
+    async def finish(
+        self, job_id: str, worker: str, status: str, result: Optional[str] = None, error: Optional[str] = None
+    ) -> bool:
+        """
+        Записать итог задачи, если она все еще выполняется этим воркером
+
+        Возвращает False, если задачу уже вернули в очередь или завершили:
+        итог потерявшего задачу воркера отбрасывается.
+        """
+
+    @abstractmethod
+    async def release(self, job_id: str) -> None:
+        """Вернуть невыполненную задачу в начало очереди (остановка воркера)"""
+
+    @abstractmethod
+    async def requeue_stale(self) -> int:
+        """
+        Вернуть в очередь задачи без heartbeat дольше stale_seconds
+
+        После max_attempts попыток задача помечается failed. Возвращает
+        число возвращенных задач.
+        """
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Задача по id или None"""
+
+    @abstractmethod
+    async def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и число выполняющихся задач"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    priority INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, created_at);
+"""
+
+_COLUMNS = (
+    "id, kind, payload, status, result, error, attempts, worker, "
+    "created_at, started_at, finished_at, heartbeat_at"
+)
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Очередь в файле SQLite (WAL) для локального запуска
+
+    API и воркеры на одном хосте работают с одним файлом; задача
+    захватывается в транзакции BEGIN IMMEDIATE, поэтому один и тот же
+    id не достанется двум воркерам. Обращения к SQLite выполняются в
+    asyncio.to_thread под одной блокировкой.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, poll_interval: float = 0.5, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._open)
+        logger.info(f"Очередь задач в SQLite: {self.path}")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Автокоммит: транзакции открываются явно
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        async with self._lock:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def _run(self, fn, *args):
+        if self._conn is None:
+            await self.open()
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def _conn_execute(self, sql: str, params: tuple = ()) -> int:
+        return self._conn.execute(sql, params).rowcount
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        (job_id, kind, payload, status, result, error, attempts, worker,
+         created_at, started_at, finished_at, heartbeat_at) = row
+        return Job(
+            id=job_id, kind=kind, payload=json.loads(payload), status=status,
+            result=result, error=error, attempts=attempts, worker=worker,
+            created_at=created_at, started_at=started_at, finished_at=finished_at,
+            heartbeat_at=heartbeat_at,
+        )
+
+    async def enqueue(self, job: Job) -> Job:
+        await self._run(
+            self._conn_execute,
+            f"INSERT INTO jobs ({_COLUMNS}) VALUES (?, ?, ?, ?, NULL, NULL, 0, NULL, ?, NULL, NULL, NULL)",
+            (job.id, job.kind, json.dumps(job.payload, ensure_ascii=False), QUEUED, job.created_at),
+        )
+        return job
+
+    def _claim(self, worker: str) -> Optional[Job]:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, created_at LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1, priority = 0 WHERE id = ?",
+                (RUNNING, worker, now, now, row[0]),
+            )
+            job = conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row_to_job(job)
+
+    async def claim(self, worker: str, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self._run(self._claim, worker)
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0.0)))
+
+    async def heartbeat(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        marks = ",".join("?" * len(job_ids))
+        await self._run(
+            self._conn_execute,
+            f"UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND id IN ({marks})",
+            (time.time(), RUNNING, *job_ids),
+        )
+
+    async def finish(
+        self, job_id: str, worker: str, status: str, result: Optional[str] = None, error: Optional[str] = None
+    ) -> bool:
+        updated = await self._run(
+            self._conn_execute,
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE id = ? AND status = ? AND worker = ?",
+            (status, result, error, time.time(), job_id, RUNNING, worker),
+        )
+        return updated > 0
+
+    async def release(self, job_id: str) -> None:
+        # Попытка не засчитывается, задача идет первой
+        await self._run(
+            self._conn_execute,
+            "UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - 1, priority = 1 "
+            "WHERE id = ? AND status = ?",
+            (QUEUED, job_id, RUNNING),
+        )
+
+    def _requeue_stale(self) -> int:
+        now = time.time()
+        stale_before = now - self.stale_seconds
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, "Воркер не завершил задачу за допустимое число попыток", now,
+                 RUNNING, stale_before, self.max_attempts),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, priority = 1 WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, stale_before),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (*FINISHED, now - self.result_ttl_seconds),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued
+
+    async def requeue_stale(self) -> int:
+        return await self._run(self._requeue_stale)
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self._run(self._get, job_id)
+
+    def _stats(self) -> Dict[str, Any]:
+        counts = dict(self._conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status", (QUEUED, RUNNING)
+        ).fetchall())
+        return {"backend": self.name, "queued": counts.get(QUEUED, 0), "running": counts.get(RUNNING, 0)}
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self._run(self._stats)
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Очередь в Redis для API и воркеров на разных хостах
+
+    Задача — хэш prefix:job:<id>; id ждут в списке prefix:queue и при
+    захвате атомарно переносятся BLMOVE в prefix:running, так что задача
+    не теряется, если воркер упал между захватом и записью статуса: такая
+    задача возвращается в очередь через stale_seconds после того, как ее
+    впервые увидел requeue_stale. Завершенные задачи хранятся result_ttl_seconds.
+    """
+
+    name = "redis"
+
+    # Продлевать только существующие выполняемые задачи: HSET по истекшему
+    # или завершенному хэшу создал бы неполный ключ без TTL
+    HEARTBEAT_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call("HGET", key, "status") == ARGV[2] then
+            redis.call("HSET", key, "heartbeat_at", ARGV[1])
+        end
+    end
+    return 0
+    """
+
+    # Итог пишет только владелец: задача выполняется этим воркером и ее id
+    # удален из running этим вызовом (как в _requeue)
+    FINISH_SCRIPT = """
+    if redis.call("HGET", KEYS[1], "status") ~= ARGV[1] or redis.call("HGET", KEYS[1], "worker") ~= ARGV[2] then
+        return 0
+    end
+    if redis.call("LREM", KEYS[2], 1, ARGV[3]) == 0 then
+        return 0
+    end
+    redis.call("HSET", KEYS[1], "status", ARGV[4], "result", ARGV[5], "error", ARGV[6], "finished_at", ARGV[7])
+    redis.call("EXPIRE", KEYS[1], ARGV[8])
+    return 1
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        prefix: str = "aitest:jobs",
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.prefix = prefix
+        self._queue_key = f"{prefix}:queue"
+        self._running_key = f"{prefix}:running"
+        self._client = aioredis.Redis(host=host, port=port, db=db, password=password, decode_responses=True)
+        self._heartbeat_script = self._client.register_script(self.HEARTBEAT_SCRIPT)
+        self._finish_script = self._client.register_script(self.FINISH_SCRIPT)
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    @staticmethod
+    def _to_job(data: Dict[str, str]) -> Job:
+        def number(name: str) -> Optional[float]:
+            value = data.get(name)
+            return float(value) if value else None
+
+        return Job(
+            id=data["id"],
+            kind=data["kind"],
+            payload=json.loads(data["payload"]),
+            status=data["status"],
+            result=data.get("result") or None,
+            error=data.get("error") or None,
+            attempts=int(data.get("attempts") or 0),
+            worker=data.get("worker") or None,
+            created_at=float(data["created_at"]),
+            started_at=number("started_at"),
+            finished_at=number("finished_at"),
+            heartbeat_at=number("heartbeat_at"),
+        )
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def enqueue(self, job: Job) -> Job:
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job.id), mapping={
+                "id": job.id,
+                "kind": job.kind,
+                "payload": json.dumps(job.payload, ensure_ascii=False),
+                "status": QUEUED,
+                "attempts": 0,
+                "created_at": job.created_at,
+            })
+            pipe.lpush(self._queue_key, job.id)
+            await pipe.execute()
+        return job
+
+    async def claim(self, worker: str, timeout: float) -> Optional[Job]:
+        job_id = await self._client.blmove(self._queue_key, self._running_key, timeout, "RIGHT", "LEFT")
+        if job_id is None:
+            return None
+        now = time.time()
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={
+                "status": RUNNING, "worker": worker, "started_at": now, "heartbeat_at": now,
+            })
+            pipe.hdel(self._key(job_id), "orphaned_at")
+            pipe.hincrby(self._key(job_id), "attempts", 1)
+            pipe.hgetall(self._key(job_id))
+            *_, data = await pipe.execute()
+        if "kind" not in data:
+            # Хэш истек или удален — задачи больше нет
+            await self._client.lrem(self._running_key, 1, job_id)
+            await self._client.delete(self._key(job_id))
+            return None
+        return self._to_job(data)
+
+    async def heartbeat(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        await self._heartbeat_script(keys=[self._key(job_id) for job_id in job_ids], args=[time.time(), RUNNING])
+
+    async def finish(
+        self, job_id: str, worker: str, status: str, result: Optional[str] = None, error: Optional[str] = None
+    ) -> bool:
+        finished = await self._finish_script(
+            keys=[self._key(job_id), self._running_key],
+            args=[RUNNING, worker, job_id, status, result or "", error or "", time.time(), self.result_ttl_seconds],
+        )
+        return bool(finished)
+
+    async def _fail_stale(self, job_id: str) -> None:
+        # Пометить failed может только тот, кто убрал задачу из running
+        if not await self._client.lrem(self._running_key, 1, job_id):
+            return
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={
+                "status": FAILED,
+                "result": "",
+                "error": "Воркер не завершил задачу за допустимое число попыток",
+                "finished_at": time.time(),
+            })
+            pipe.hdel(self._key(job_id), "orphaned_at")
+            pipe.expire(self._key(job_id), self.result_ttl_seconds)
+            await pipe.execute()
+
+    async def _requeue(self, job_id: str, refund_attempt: bool) -> bool:
+        # Вернуть задачу может только тот, кто убрал ее из running
+        if not await self._client.lrem(self._running_key, 1, job_id):
+            return False
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={"status": QUEUED, "worker": ""})
+            pipe.hdel(self._key(job_id), "orphaned_at")
+            if refund_attempt:
+                pipe.hincrby(self._key(job_id), "attempts", -1)
+            pipe.rpush(self._queue_key, job_id)
+            await pipe.execute()
+        return True
+
+    async def release(self, job_id: str) -> None:
+        await self._requeue(job_id, refund_attempt=True)
+
+    async def requeue_stale(self) -> int:
+        now = time.time()
+        stale_before = now - self.stale_seconds
+        requeued = 0
+        for job_id in await self._client.lrange(self._running_key, 0, -1):
+            status, heartbeat, orphaned, attempts = await self._client.hmget(
+                self._key(job_id), "status", "heartbeat_at", "orphaned_at", "attempts"
+            )
+            if status is None:
+                # Хэш истек — убрать id из running
+                await self._client.lrem(self._running_key, 1, job_id)
+                continue
+            if status == RUNNING:
+                if heartbeat and float(heartbeat) >= stale_before:
+                    continue
+            elif status == QUEUED:
+                # Перенесена BLMOVE, но статус еще не записан: heartbeat_at может
+                # остаться от прошлой попытки. Отсчет идет с первого обнаружения
+                if not orphaned:
+                    await self._client.hsetnx(self._key(job_id), "orphaned_at", now)
+                    continue
+                if float(orphaned) >= stale_before:
+                    continue
+            else:
+                # Завершена, пока шел обход
+                continue
+            if int(attempts or 0) >= self.max_attempts:
+                await self._fail_stale(job_id)
+            elif await self._requeue(job_id, refund_attempt=False):
+                requeued += 1
+        return requeued
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        data = await self._client.hgetall(self._key(job_id))
+        return self._to_job(data) if data and "kind" in data else None
+
+    async def stats(self) -> Dict[str, Any]:
+        queued, running = await asyncio.gather(
+            self._client.llen(self._queue_key), self._client.llen(self._running_key)
+        )
+        return {"backend": self.name, "queued": queued, "running": running}
+
+
+def create_job_queue(settings) -> JobQueue:
+    """Создает очередь задач по настройкам приложения"""
+    common = dict(
+        stale_seconds=settings.JOB_STALE_SECONDS,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        result_ttl_seconds=settings.JOB_RESULT_TTL_SECONDS,
+    )
+    if settings.JOB_QUEUE_BACKEND == "redis" and settings.REDIS_HOST:
+        if aioredis is not None:
+            logger.info(f"Очередь задач в Redis: {settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}")
+            return RedisJobQueue(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD,
+                prefix=settings.JOB_KEY_PREFIX,
+                **common,
+            )
+        logger.warning("Пакет redis не установлен, очередь задач в SQLite")
+    return SqliteJobQueue(settings.JOB_DB_PATH, poll_interval=settings.JOB_POLL_INTERVAL_SECONDS, **common)
+
+
+# Глобальный экземпляр очереди
+job_queue = create_job_queue(get_settings())
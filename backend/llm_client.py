@@ -1,9 +1,12 @@
 """
 LLM клиент для работы с Cloud.ru GigaChat через OpenAI-совместимый API
 """
+import asyncio
 import json
 import time
-from typing import Any, Dict, List, Optional
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
 import hashlib
 from dataclasses import dataclass
 from datetime import datetime
@@ -11,10 +14,18 @@ from datetime import datetime
 from openai import AsyncOpenAI
 from loguru import logger
 
+from cache import create_cache_backend
+from circuit_breaker import CircuitBreaker, CircuitOpenError
 from config import get_settings
+from deadlines import DeadlineExceeded, RequestAborted, remaining, within_deadline
+from hedging import HedgePolicy
+from metrics import QuantileSketch, metrics_collector
+from rate_limiter import RateLimiter, backoff_delay, is_retryable, retry_after_seconds
+from singleflight import SingleFlight
+from tokens import PromptTooLarge, estimate_tokens, output_budget
 
 
-@dataclass
+@dataclass(slots=True)
 class GenerationMetrics:
     """Метрики генерации для мониторинга"""
     prompt_hash: str
@@ -26,6 +37,11 @@ class GenerationMetrics:
     timestamp: datetime
     model_used: str = ""
     validation_issues: List[str] = None
+    coalesced: bool = False
+
+
+# Последняя генерация в текущем контексте запроса (для метрик обработчиков)
+last_generation: ContextVar[Optional[GenerationMetrics]] = ContextVar("last_generation", default=None)
 
 
 class LLMClient:
@@ -40,11 +56,22 @@ class LLMClient:
             api_key=self.settings.LLM_API_KEY,
             base_url=self.settings.LLM_BASE_URL,
             timeout=self.settings.LLM_TIMEOUT_SECONDS,
-            max_retries=self.settings.LLM_MAX_RETRIES,
+            # Повторы выполняет сам клиент с учетом лимитов и Retry-After
+            max_retries=0,
         )
         
-        self._cache: Dict[str, str] = {}
-        self.metrics: List[GenerationMetrics] = []
+        self._cache = create_cache_backend(self.settings)
+        self._inflight = SingleFlight()
+        self._limiter = RateLimiter.from_settings(self.settings)
+        self._breaker = CircuitBreaker.from_settings(self.settings)
+        self._hedge = HedgePolicy.from_settings(self.settings) if self.settings.LLM_HEDGE_ENABLED else None
+        # Кольцевой буфер последних запросов и накопительные счетчики
+        self.metrics: Deque[GenerationMetrics] = deque(maxlen=self.settings.LLM_METRICS_HISTORY_SIZE)
+        self._total_requests = 0
+        self._successful = 0
+        self._cache_hits = 0
+        self._latency_ms = QuantileSketch()
+        self._response_length = QuantileSketch()
         
         logger.info(f"Инициализирован LLMClient для Cloud.ru GigaChat")
         logger.info(f"Модель: {self.settings.LLM_MODEL}")
@@ -53,8 +80,85 @@ class LLMClient:
     def _generate_cache_key(self, messages: List[Dict], params: dict) -> str:
         """Генерация ключа для кэширования"""
         content = f"{json.dumps(messages, sort_keys=True)}_{params.get('temperature', 0.3)}_{params.get('max_tokens', 2048)}"
+        if params.get("seed") is not None:
+            content += f"_{params['seed']}"
         return hashlib.sha256(content.encode()).hexdigest()[:16]
     
+    def _cache_namespace(self, template: str) -> str:
+        """Пространство имен кэша: модель + шаблон промпта"""
+        return f"{self.settings.LLM_MODEL}:{template}"
+    
+    @staticmethod
+    def _build_messages(prompt: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+        """Подготовка сообщений для API"""
+        # Системный промпт по умолчанию для QA
+        if system_prompt is None:
+            system_prompt = (
+                "Ты — Senior QA Automation Engineer с 10+ лет опыта. "
+                "Ты специализируешься на генерации production-ready тестов на Python. "
+                "Твой код должен быть чистым, читаемым и сразу готовым к запуску. "
+                "Ты строго следуешь паттерну AAA (Arrange-Act-Assert). "
+                "Ты всегда используешь Allure для отчетности. "
+                "Ты пишешь тесты, которые легко поддерживать и расширять."
+            )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _request_params(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        seed: Optional[int] = None
+    ) -> dict:
+        """
+        Параметры запроса к модели
+        
+        Параметры шаблона имеют приоритет над LLM_TEMPERATURE/LLM_MAX_TOKENS;
+        max_tokens ограничивается остатком контекстного окна после промпта.
+        
+        Raises:
+            PromptTooLarge: промпт не оставляет места для ответа
+        """
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        requested = self.settings.LLM_MAX_TOKENS if max_tokens is None else max_tokens
+        params = {
+            "temperature": self.settings.LLM_TEMPERATURE if temperature is None else temperature,
+            "max_tokens": output_budget(prompt_tokens, requested, self.settings),
+        }
+        if params["max_tokens"] < requested:
+            logger.info(f"max_tokens снижен до {params['max_tokens']}: промпт ~{prompt_tokens} токенов")
+        if seed is not None:
+            params["seed"] = seed
+        return params
+    
+    def _record_metrics(self, metrics: GenerationMetrics) -> None:
+        """Сохраняет запись в кольцевой буфер и обновляет счетчики за O(1)"""
+        self.metrics.append(metrics)
+        last_generation.set(metrics)
+        self._total_requests += 1
+        if metrics.cache_hit:
+            self._cache_hits += 1
+        if metrics.success:
+            self._successful += 1
+            self._latency_ms.add(metrics.generation_time_ms)
+            self._response_length.add(metrics.response_length)
+    
+    async def _generate_and_store(
+        self,
+        cache_key: str,
+        messages: List[Dict[str, str]],
+        params: dict
+    ) -> str:
+        """Запрос к модели с сохранением ответа в кэш (выполняется один раз на ключ)"""
+        raw_response = await self._generate_with_openai(messages, **params)
+        if raw_response:
+            await self._cache.set(cache_key, raw_response)
+            logger.info(f"Добавлено в кэш: {cache_key}")
+        return raw_response
+    
     def _validate_response(self, response: str) -> tuple[str, List[str]]:
         """
         Валидирует ответ LLM и возвращает исправленный код + список проблем
@@ -92,27 +196,156 @@ class LLMClient:
         
         return fixed_response, issues
     
+    @staticmethod
+    def _estimate_request_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Оценка токенов запроса с ответом максимальной длины"""
+        return sum(estimate_tokens(m["content"]) for m in messages) + max_tokens
+    
+    def _on_request_error(self, exc: BaseException, started: float, sent: bool = True) -> None:
+        """
+        Учет ошибки запроса в ограничителе и circuit breaker
+
+        Отмена вызывающим кодом (проигравший хедж, отключение клиента) и
+        дедлайн до отправки не говорят о состоянии провайдера. Ответ,
+        оборванный дедлайном запроса, считается таймаутом провайдера, если
+        ждали дольше порога медленного вызова breaker.
+        """
+        elapsed = time.monotonic() - started
+        if isinstance(exc, DeadlineExceeded) and sent and elapsed >= self._breaker.slow_call_seconds:
+            exc = asyncio.TimeoutError()
+        elif isinstance(exc, (asyncio.CancelledError, RequestAborted)):
+            self._breaker.release_probe()
+            return
+        self._limiter.on_error(exc)
+        # Деградацией провайдера считаются только перегрузка, таймауты и 5xx
+        self._breaker.record(not is_retryable(exc), elapsed)
+    
+    async def _request_completion(
+        self,
+        estimated_tokens: int,
+        on_sent: Optional[Callable[[], None]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Один запрос к модели через circuit breaker и ограничитель нагрузки
+
+        on_sent вызывается после получения слота, перед отправкой запроса.
+        Слот ждется не дольше остатка дедлайна. Ответ ждется
+        LLM_TIMEOUT_SECONDS, но не дольше остатка дедлайна; таймаут
+        отсчитывается от отправки, без ожидания слота.
+
+        Raises:
+            asyncio.TimeoutError: провайдер не ответил за LLM_TIMEOUT_SECONDS
+            DeadlineExceeded: слот или ответ не успели к дедлайну запроса
+        """
+        # Разомкнутая цепь отклоняет запрос до постановки в очередь лимитера
+        self._breaker.before_call()
+        started = time.monotonic()
+        sent = False
+        try:
+            async with self._limiter.slot(estimated_tokens, timeout=remaining()) as waited:
+                metrics_collector.record_llm_wait(waited)
+                budget = remaining()
+                if budget is not None and budget <= 0:
+                    raise DeadlineExceeded("Истек дедлайн запроса до обращения к модели")
+                timeout = self.settings.LLM_TIMEOUT_SECONDS
+                if budget is not None:
+                    timeout = min(timeout, budget)
+                started = time.monotonic()
+                sent = True
+                if on_sent is not None:
+                    on_sent()
+                try:
+                    response = await asyncio.wait_for(
+                        self._client.chat.completions.create(**kwargs), timeout
+                    )
+                except asyncio.TimeoutError as e:
+                    if timeout < self.settings.LLM_TIMEOUT_SECONDS:
+                        raise DeadlineExceeded("Модель не ответила до дедлайна запроса") from e
+                    raise
+        except asyncio.TimeoutError as e:
+            if not sent:
+                # Очередь лимитера — не ошибка провайдера и не повод для повтора
+                self._breaker.release_probe()
+                raise DeadlineExceeded("Слот запроса к модели не освободился до дедлайна") from e
+            self._on_request_error(e, started, sent)
+            raise
+        except BaseException as e:
+            self._on_request_error(e, started, sent)
+            raise
+        await self._limiter.on_success()
+        self._breaker.record(True, time.monotonic() - started)
+        
+        # Резерв TPM был по максимальной длине ответа — возвращаем остаток
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self._limiter.refund_tokens(estimated_tokens - usage.total_tokens)
+        return response
+    
     async def _generate_with_openai(
         self, 
         messages: List[Dict[str, str]],
         temperature: float = 0.3,
-        max_tokens: int = 2048
+        max_tokens: int = 2048,
+        seed: Optional[int] = None
     ) -> str:
         """
         Генерация через OpenAI-совместимый API (Cloud.ru GigaChat)
         """
+        # seed передается только если задан: не все модели его принимают
+        extra = {"seed": seed} if seed is not None else {}
+        estimated_tokens = self._estimate_request_tokens(messages, max_tokens)
+        attempts = self.settings.LLM_MAX_RETRIES + 1
         try:
             logger.debug(f"Отправка запроса к Cloud.ru GigaChat, модель: {self.settings.LLM_MODEL}")
             
-            response = await self._client.chat.completions.create(
-                model=self.settings.LLM_MODEL,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=0.9,
-                frequency_penalty=0.1,
-                presence_penalty=0.1,
-            )
+            def request(on_sent: Optional[Callable[[], None]] = None):
+                return self._request_completion(
+                    estimated_tokens,
+                    on_sent,
+                    model=self.settings.LLM_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=0.9,
+                    frequency_penalty=0.1,
+                    presence_penalty=0.1,
+                    **extra,
+                )
+            
+            for attempt in range(attempts):
+                # Таймаут попытки (LLM_TIMEOUT_SECONDS, не больше остатка дедлайна)
+                # соблюдает _request_completion; повторы ограничены остатком дедлайна
+                budget = remaining()
+                if budget is not None and budget <= 0:
+                    raise DeadlineExceeded("Истек дедлайн запроса до обращения к модели")
+                call = (
+                    self._hedge.run(request, self._limiter.congested)
+                    if self._hedge is not None
+                    else request()
+                )
+                try:
+                    response = await call
+                    break
+                except Exception as e:
+                    if attempt + 1 >= attempts or not is_retryable(e):
+                        raise
+                    # Retry-After провайдера важнее собственной задержки
+                    delay = retry_after_seconds(e)
+                    if delay is None:
+                        delay = backoff_delay(
+                            attempt,
+                            self.settings.LLM_RETRY_BASE_DELAY_SECONDS,
+                            self.settings.LLM_RETRY_MAX_DELAY_SECONDS,
+                        )
+                    budget = remaining()
+                    if budget is not None and delay >= budget:
+                        raise DeadlineExceeded("Повтор запроса не укладывается в дедлайн") from e
+                    logger.warning(
+                        f"Повтор запроса к Cloud.ru GigaChat {attempt + 1}/{attempts - 1} "
+                        f"через {delay:.1f}с: {e.__class__.__name__}"
+                    )
+                    await asyncio.sleep(delay)
             
             # Извлекаем контент из ответа
             if response.choices and len(response.choices) > 0:
@@ -124,6 +357,9 @@ class LLMClient:
             logger.warning("Пустой ответ от Cloud.ru GigaChat")
             return ""
             
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.warning(f"Запрос к Cloud.ru GigaChat отклонен: {e}")
+            raise
         except Exception as e:
             logger.error(f"Ошибка при запросе к Cloud.ru GigaChat: {e}")
             
@@ -140,12 +376,91 @@ class LLMClient:
             
             raise
     
+    async def _stream_with_openai(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.3,
+        max_tokens: int = 2048
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация через OpenAI-совместимый API (stream=True)
+        
+        Слот, начало ответа и каждый следующий фрагмент ждутся не дольше остатка
+        дедлайна запроса.
+        
+        Yields:
+            Фрагменты текста ответа по мере их получения
+        
+        Raises:
+            DeadlineExceeded: истек дедлайн запроса
+        """
+        logger.debug(f"Потоковый запрос к Cloud.ru GigaChat, модель: {self.settings.LLM_MODEL}")
+        budget = remaining()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded("Истек дедлайн запроса до обращения к модели")
+        
+        # Слот занят до конца потока: параллельность считается по открытым ответам
+        self._breaker.before_call()
+        started = time.monotonic()
+        stream = None
+        sent = False
+        try:
+            async with self._limiter.slot(
+                self._estimate_request_tokens(messages, max_tokens), timeout=remaining()
+            ) as waited:
+                metrics_collector.record_llm_wait(waited)
+                started = time.monotonic()
+                sent = True
+                stream = await within_deadline(
+                    self._client.chat.completions.create(
+                        model=self.settings.LLM_MODEL,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        top_p=0.9,
+                        frequency_penalty=0.1,
+                        presence_penalty=0.1,
+                        stream=True,
+                    ),
+                    "Модель не начала ответ до дедлайна запроса",
+                )
+                # Для потока в breaker учитывается время до начала ответа
+                self._breaker.record(True, time.monotonic() - started)
+                chunks = stream.__aiter__()
+                try:
+                    while True:
+                        try:
+                            chunk = await within_deadline(
+                                chunks.__anext__(), "Ответ модели не завершился до дедлайна запроса"
+                            )
+                        except StopAsyncIteration:
+                            break
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                finally:
+                    await stream.close()
+        except asyncio.TimeoutError as e:
+            if sent:
+                raise
+            self._breaker.release_probe()
+            raise DeadlineExceeded("Слот запроса к модели не освободился до дедлайна") from e
+        except BaseException as e:
+            if stream is None:
+                self._on_request_error(e, started, sent)
+            raise
+        await self._limiter.on_success()
+    
     async def generate(
         self, 
         prompt: str, 
         system_prompt: Optional[str] = None,
         use_cache: bool = True, 
-        validate: bool = True
+        validate: bool = True,
+        template: str = "default",
+        fallback: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        seed: Optional[int] = None
     ) -> str:
         """
         Генерирует ответ на промпт через Cloud.ru GigaChat
@@ -155,49 +470,41 @@ class LLMClient:
             system_prompt: Системный промпт (роль AI)
             use_cache: Использовать кэширование
             validate: Валидировать ответ
+            template: Имя шаблона промпта (пространство имен кэша)
+            fallback: При ошибке вернуть fallback тест вместо исключения
+            temperature: Температура шаблона вместо LLM_TEMPERATURE
+            max_tokens: Ожидаемая длина ответа шаблона вместо LLM_MAX_TOKENS
+            seed: Seed сэмплирования (для независимых вариантов ответа)
         
         Returns:
             Сгенерированный текст
         """
         start_time = time.time()
         cache_hit = False
+        coalesced = False
         prompt_hash = None
         
         try:
-            # Системный промпт по умолчанию для QA
-            if system_prompt is None:
-                system_prompt = (
-                    "Ты — Senior QA Automation Engineer с 10+ лет опыта. "
-                    "Ты специализируешься на генерации production-ready тестов на Python. "
-                    "Твой код должен быть чистым, читаемым и сразу готовым к запуску. "
-                    "Ты строго следуешь паттерну AAA (Arrange-Act-Assert). "
-                    "Ты всегда используешь Allure для отчетности. "
-                    "Ты пишешь тесты, которые легко поддерживать и расширять."
-                )
-            
-            # Подготовка сообщений для API
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # Параметры запроса
-            params = {
-                "temperature": self.settings.LLM_TEMPERATURE,
-                "max_tokens": self.settings.LLM_MAX_TOKENS,
-            }
+            messages = self._build_messages(prompt, system_prompt)
+            params = self._request_params(messages, temperature, max_tokens, seed)
             
             # Кэширование
             if use_cache:
                 prompt_hash = self._generate_cache_key(messages, params)
-                if prompt_hash in self._cache:
+                cache_key = f"{self._cache_namespace(template)}:{prompt_hash}"
+                cached = await self._cache.get(cache_key)
+                if cached is not None:
                     cache_hit = True
                     logger.info(f"Кэш-попадание для промпта: {prompt_hash}")
-                    raw_response = self._cache[prompt_hash]
+                    raw_response = cached
                 else:
-                    raw_response = await self._generate_with_openai(messages, **params)
-                    self._cache[prompt_hash] = raw_response
-                    logger.info(f"Добавлено в кэш: {prompt_hash}")
+                    # Одинаковые одновременные запросы ждут один вызов модели
+                    raw_response, coalesced = await self._inflight.do(
+                        cache_key,
+                        lambda: self._generate_and_store(cache_key, messages, params)
+                    )
+                    if coalesced:
+                        logger.info(f"Запрос объединен с выполняющимся: {prompt_hash}")
             else:
                 raw_response = await self._generate_with_openai(messages, **params)
             
@@ -221,14 +528,15 @@ class LLMClient:
                 success=True,
                 timestamp=datetime.now(),
                 model_used=self.settings.LLM_MODEL,
-                validation_issues=validation_issues
+                validation_issues=validation_issues,
+                coalesced=coalesced
             )
-            self.metrics.append(metrics)
+            self._record_metrics(metrics)
             
             logger.info(
                 f"Генерация завершена: {generation_time_ms:.1f}ms, "
                 f"длина ответа: {len(validated_response)}, "
-                f"кэш: {'hit' if cache_hit else 'miss'}, "
+                f"кэш: {'hit' if cache_hit else ('coalesced' if coalesced else 'miss')}, "
                 f"модель: {self.settings.LLM_MODEL}"
             )
             
@@ -250,11 +558,103 @@ class LLMClient:
                 model_used=self.settings.LLM_MODEL,
                 validation_issues=[f"Ошибка: {str(e)}"]
             )
-            self.metrics.append(metrics)
+            self._record_metrics(metrics)
+            
+            # Fallback после дедлайна уже никому не нужен, а слишком
+            # большой ввод — ошибка запроса, а не недоступность модели
+            if not fallback or isinstance(e, (DeadlineExceeded, PromptTooLarge)):
+                raise
             
             # Fallback на локальный шаблон
             return self._fallback_test()
     
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        template: str = "default",
+        replay_chunk_size: int = 256,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа через Cloud.ru GigaChat
+        
+        Кэшированный ответ воспроизводится фрагментами по replay_chunk_size
+        символов, новый ответ сохраняется в кэш после завершения потока.
+        Ошибки модели пробрасываются вызывающему коду.
+        
+        Args:
+            prompt: Текст промпта пользователя
+            system_prompt: Системный промпт (роль AI)
+            use_cache: Использовать кэширование
+            template: Имя шаблона промпта (пространство имен кэша)
+            replay_chunk_size: Размер фрагмента при воспроизведении из кэша
+            temperature: Температура шаблона вместо LLM_TEMPERATURE
+            max_tokens: Ожидаемая длина ответа шаблона вместо LLM_MAX_TOKENS
+        
+        Yields:
+            Фрагменты сырого ответа модели
+        """
+        start_time = time.time()
+        messages = self._build_messages(prompt, system_prompt)
+        params = self._request_params(messages, temperature, max_tokens)
+        prompt_hash = self._generate_cache_key(messages, params)
+        cache_key = f"{self._cache_namespace(template)}:{prompt_hash}"
+        cache_hit = False
+        parts: List[str] = []
+        
+        try:
+            cached = await self._cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                cache_hit = True
+                logger.info(f"Кэш-попадание для потокового промпта: {prompt_hash}")
+                for i in range(0, len(cached), replay_chunk_size):
+                    parts.append(cached[i:i + replay_chunk_size])
+                    yield parts[-1]
+            else:
+                async for delta in self._stream_with_openai(messages, **params):
+                    parts.append(delta)
+                    yield delta
+                if use_cache and parts:
+                    await self._cache.set(cache_key, "".join(parts))
+                    logger.info(f"Добавлено в кэш: {cache_key}")
+        except Exception as e:
+            generation_time_ms = (time.time() - start_time) * 1000
+            logger.error(f"Ошибка потоковой генерации Cloud.ru GigaChat: {e}, время: {generation_time_ms:.1f}ms")
+            self._record_metrics(GenerationMetrics(
+                prompt_hash=prompt_hash,
+                prompt_length=len(prompt),
+                response_length=0,
+                generation_time_ms=generation_time_ms,
+                cache_hit=cache_hit,
+                success=False,
+                timestamp=datetime.now(),
+                model_used=self.settings.LLM_MODEL,
+                validation_issues=[f"Ошибка: {str(e)}"]
+            ))
+            raise
+        
+        generation_time_ms = (time.time() - start_time) * 1000
+        response_length = sum(len(p) for p in parts)
+        self._record_metrics(GenerationMetrics(
+            prompt_hash=prompt_hash,
+            prompt_length=len(prompt),
+            response_length=response_length,
+            generation_time_ms=generation_time_ms,
+            cache_hit=cache_hit,
+            success=True,
+            timestamp=datetime.now(),
+            model_used=self.settings.LLM_MODEL,
+            validation_issues=[]
+        ))
+        logger.info(
+            f"Потоковая генерация завершена: {generation_time_ms:.1f}ms, "
+            f"длина ответа: {response_length}, "
+            f"кэш: {'hit' if cache_hit else 'miss'}"
+        )
+    
     @staticmethod
     def _fallback_test() -> str:
         """Fallback тест при недоступности Cloud.ru GigaChat"""
@@ -281,29 +681,63 @@ class LLMClient:
             "            assert result == expected, f'Ожидалось {{expected}}, получено {{result}}'\n"
         )
     
+    def circuit_state(self) -> str:
+        """Состояние circuit breaker: closed, open или half_open"""
+        return self._breaker.state
+    
     def get_metrics_summary(self) -> dict:
-        """Возвращает сводку метрик"""
-        if not self.metrics:
+        """Возвращает сводку метрик (O(1) от числа запросов)"""
+        if not self._total_requests:
             return {
                 "model": self.settings.LLM_MODEL,
                 "total_requests": 0,
-                "provider": "Cloud.ru GigaChat"
+                "provider": "Cloud.ru GigaChat",
+                "coalesced_requests": self._inflight.coalesced,
+                "cache": self._cache.stats(),
+                "hedging": self._hedge.stats() if self._hedge else None,
+                "rate_limiter": self._limiter.stats(),
+                "circuit_breaker": self._breaker.stats(),
             }
         
-        successful = [m for m in self.metrics if m.success]
-        failed = [m for m in self.metrics if not m.success]
-        
         return {
             "model": self.settings.LLM_MODEL,
             "provider": "Cloud.ru GigaChat",
-            "total_requests": len(self.metrics),
-            "successful": len(successful),
-            "failed": len(failed),
-            "cache_hit_rate": len([m for m in self.metrics if m.cache_hit]) / len(self.metrics) if self.metrics else 0,
-            "avg_generation_time_ms": sum(m.generation_time_ms for m in successful) / len(successful) if successful else 0,
-            "avg_response_length": sum(m.response_length for m in successful) / len(successful) if successful else 0,
+            "total_requests": self._total_requests,
+            "successful": self._successful,
+            "failed": self._total_requests - self._successful,
+            "cache_hit_rate": self._cache_hits / self._total_requests,
+            "avg_generation_time_ms": self._latency_ms.mean,
+            "avg_response_length": self._response_length.mean,
+            "generation_time_ms": self._latency_ms.percentiles(),
+            "response_length": self._response_length.percentiles(),
+            "coalesced_requests": self._inflight.coalesced,
+            "in_flight": self._inflight.in_flight,
             "base_url": self.settings.LLM_BASE_URL,
+            "cache": self._cache.stats(),
+            "hedging": self._hedge.stats() if self._hedge else None,
+            "rate_limiter": self._limiter.stats(),
+            "circuit_breaker": self._breaker.stats(),
         }
+    
+    def metrics_snapshot(self) -> dict:
+        """Счетчики и скетчи клиента для сводных метрик нескольких процессов"""
+        return {
+            "total_requests": self._total_requests,
+            "successful": self._successful,
+            "cache_hits": self._cache_hits,
+            "latency_ms": self._latency_ms.to_dict(),
+            "response_length": self._response_length.to_dict(),
+            "coalesced_requests": self._inflight.coalesced,
+            "in_flight": self._inflight.in_flight,
+            "hedging": self._hedge.stats() if self._hedge else None,
+            "rate_limiter": self._limiter.stats(),
+            "circuit_breaker": self._breaker.stats(),
+        }
+    
+    async def close(self) -> None:
+        """Закрытие соединений клиента"""
+        await self._cache.close()
+        await self._client.close()
 
 
 # Глобальный инстанс клиента
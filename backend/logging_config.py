@@ -0,0 +1,56 @@
+"""
+Единая настройка логирования приложения
+"""
+import sys
+from contextvars import ContextVar
+
+from loguru import logger
+
+# Идентификатор текущего HTTP запроса, попадает в каждую запись лога
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "{extra[request_id]} | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+    "<level>{message}</level>"
+)
+
+_configured = False
+
+
+def _add_request_id(record) -> None:
+    record["extra"].setdefault("request_id", request_id_var.get())
+
+
+def setup_logging(settings) -> None:
+    """
+    Настроить синки loguru один раз на процесс
+
+    Запись идет через очередь (enqueue=True): форматирование и запись на диск
+    выполняются в фоновом потоке, а не в event loop.
+    """
+    global _configured
+    if _configured:
+        return
+
+    logger.remove()
+    logger.configure(patcher=_add_request_id)
+    logger.add(
+        sys.stderr,
+        level=settings.LOG_LEVEL,
+        format=TEXT_FORMAT,
+        enqueue=True,
+        backtrace=False,
+    )
+    if settings.LOG_FILE:
+        logger.add(
+            settings.LOG_FILE,
+            level=settings.LOG_LEVEL,
+            format=TEXT_FORMAT,
+            serialize=settings.LOG_JSON,
+            rotation="500 MB",
+            retention="10 days",
+            enqueue=True,
+            backtrace=False,
+        )
+    _configured = True
@@ -1,26 +1,125 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+from datetime import datetime
 
-from autotest_generator import generate_api_autotest, generate_ui_autotest
+from autotest_generator import (
+    generate_api_autotests_batch,
+    stream_api_autotest,
+    stream_ui_autotest,
+)
 from config import get_settings
+from deadlines import RequestAborted, run_guarded
+from jobs import (
+    FINISHED,
+    Job,
+    check_generation_payload,
+    generation_request_type,
+    generation_work,
+    job_queue,
+    new_job,
+)
+from llm_client import last_generation, llm_client
+from logging_config import setup_logging
 from middleware import log_requests, exception_handler
-from metrics import metrics_collector
+from metrics import PROMETHEUS_CONTENT_TYPE, metrics_collector
+from metrics_multiprocess import MultiprocessMetrics
+from metrics_store import MetricsStore
 from schemas import (
+    GenerateAutotestBatchRequest,
     GenerateAutotestRequest,
     GenerateCodeResponse,
     GenerateTestcaseRequest,
+    JobInfo,
+    SpecInfo,
+    SpecUploadRequest,
+    ValidateTestcaseBatchRequest,
     ValidateTestcaseRequest,
+    ValidationBatchItem,
+    ValidationBatchReport,
     ValidationReport,
+    ValidationRuleInfo,
 )
-from testcase_generator import generate_testcase
-from validator import validate_testcase
+from spec_registry import spec_registry
+from testcase_generator import stream_testcase
+from execution_pool import execution_pool
+from validation_pool import validation_pool
+from validation_rules import RULES
 
 from loguru import logger
 
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
-
 settings = get_settings()
-app = FastAPI(title=settings.APP_NAME, version=settings.APP_VERSION)
+setup_logging(settings)
+
+# Сводные метрики воркеров uvicorn (None — один процесс)
+multiprocess_metrics = MultiprocessMetrics.from_settings(settings, metrics_collector, llm_client)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка фоновых ресурсов приложения"""
+    tasks = [asyncio.create_task(metrics_collector.rollup.run_sampler())]
+    if multiprocess_metrics is not None:
+        tasks.append(asyncio.create_task(multiprocess_metrics.run_writer()))
+    await validation_pool.start()
+    if settings.EXECUTION_ENABLED:
+        try:
+            await execution_pool.start()
+        except Exception as e:
+            logger.error(f"Пул запуска pytest не стартовал: {e}")
+    store = None
+    if settings.METRICS_STORE_ENABLED:
+        store = MetricsStore.from_settings(settings)
+        try:
+            await store.open()
+        except Exception as e:
+            logger.error(f"Хранилище метрик недоступно, история не сохраняется: {e}")
+            store = None
+        else:
+            metrics_collector.store = store
+            tasks.append(asyncio.create_task(store.run_flusher()))
+    jobs_worker = None
+    if settings.JOBS_ENABLED:
+        try:
+            await job_queue.open()
+        except Exception as e:
+            logger.error(f"Очередь задач недоступна: {e}")
+        else:
+            if settings.JOB_API_WORKERS:
+                from worker import Worker
+                jobs_worker = Worker.from_settings(job_queue, settings, settings.JOB_API_WORKERS)
+                tasks.append(asyncio.create_task(jobs_worker.run()))
+    try:
+        yield
+    finally:
+        if jobs_worker is not None:
+            # Воркер сам дожидается задач и возвращает незавершенные в очередь
+            jobs_worker.stop()
+            await tasks.pop()
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        if store is not None:
+            metrics_collector.store = None
+            await store.close()
+        validation_pool.close()
+        execution_pool.close()
+        if settings.JOBS_ENABLED:
+            await job_queue.close()
+        await logger.complete()
+        await llm_client.close()
+
+
+app = FastAPI(title=settings.APP_NAME, version=settings.APP_VERSION, lifespan=lifespan)
 
 # Middleware
 app.middleware("http")(log_requests)
@@ -36,18 +135,125 @@ app.add_middleware(
 )
 
 
+def _record_generation(
+    request_type: str,
+    started: float,
+    code: str | None,
+    outcome: str | None = None,
+) -> None:
+    """
+    Запись метрик завершенной генерации с реальной длительностью
+    
+    code=None означает ошибку запроса. Если LLM недоступна и вернулся
+    fallback тест, исход помечается как fallback.
+    """
+    generation = last_generation.get()
+    if outcome is None:
+        if code is None:
+            outcome = "error"
+        elif generation is not None and not generation.success:
+            outcome = "fallback"
+        else:
+            outcome = "ok"
+    metrics_collector.record_request(
+        request_type,
+        code is not None,
+        (time.perf_counter() - started) * 1000,
+        len(code or ""),
+        cache_hit=bool(generation and generation.cache_hit),
+        outcome=outcome,
+    )
+
+
+# Интервал комментариев keep-alive в долгих потоках SSE
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Форматирование события Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_generation(
+    events: AsyncIterator[tuple[str, Any]],
+    request_type: str,
+    started: float,
+    route: str,
+) -> AsyncIterator[str]:
+    """
+    Преобразует события генерации в SSE; финальное событие содержит отчет валидации
+
+    По дедлайну запроса поток завершается событием error с полем reason.
+    """
+    code = None
+    failed = False
+    aborted = None
+    try:
+        async for event, payload in events:
+            if event == "token":
+                yield _sse_event("token", {"delta": payload})
+            elif event == "error":
+                failed = True
+                yield _sse_event("error", {"message": payload})
+            elif event == "done":
+                code = payload
+                report = await validation_pool.validate(payload)
+                yield _sse_event("done", {"code": payload, "validation": report.model_dump()})
+    except RequestAborted as exc:
+        aborted = exc.reason
+        metrics_collector.record_request_aborted(route, exc.reason)
+        logger.info(f"Обработка {route} прервана: {exc.reason}")
+        yield _sse_event("error", {"message": str(exc), "reason": exc.reason})
+    finally:
+        if aborted is not None:
+            _record_generation(request_type, started, None, outcome=aborted)
+        elif code is None:
+            # Клиент отключился до завершения потока
+            _record_generation(request_type, started, None, outcome="cancelled")
+        else:
+            _record_generation(request_type, started, code, outcome="fallback" if failed else "ok")
+
+
+def _sse_response(
+    events: AsyncIterator[tuple[str, Any]],
+    request_type: str,
+    started: float,
+    route: str,
+) -> StreamingResponse:
+    """Потоковый ответ text/event-stream без буферизации на прокси"""
+    return StreamingResponse(
+        _sse_generation(events, request_type, started, route),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/health")
 async def health() -> dict[str, str]:
     """Health check endpoint"""
-    return {"status": "ok", "service": settings.APP_NAME, "version": settings.APP_VERSION}
+    circuit = llm_client.circuit_state()
+    return {
+        # При разомкнутой цепи сервис отвечает, но только из кэша и fallback
+        "status": "ok" if circuit == "closed" else "degraded",
+        "service": settings.APP_NAME,
+        "version": settings.APP_VERSION,
+        "llm_circuit": circuit,
+    }
+
+
+async def _pod_metrics() -> tuple[Any, Any]:
+    """Сборщик и источник сводки LLM: по всем воркерам или текущего процесса"""
+    if multiprocess_metrics is not None:
+        return await multiprocess_metrics.collect()
+    return metrics_collector, llm_client
 
 
 @app.get("/metrics")
 async def get_metrics() -> dict:
-    """Метрики AI-агента"""
+    """Метрики AI-агента (по всем воркерам при METRICS_MULTIPROC_DIR)"""
     try:
-        from llm_client import llm_client
-        metrics = metrics_collector.collect_metrics(llm_client)
+        collector, llm_source = await _pod_metrics()
+        metrics = collector.collect_metrics(llm_source)
         return metrics.to_dict()
     except Exception as e:
         logger.error(f"Ошибка при сборе метрик: {e}")
@@ -55,77 +261,386 @@ async def get_metrics() -> dict:
 
 
 @app.get("/metrics/prometheus")
-async def get_metrics_prometheus() -> str:
+async def get_metrics_prometheus() -> Response:
     """Метрики в формате Prometheus"""
     try:
-        from llm_client import llm_client
-        metrics_collector.collect_metrics(llm_client)
-        return metrics_collector.export_metrics_prometheus()
+        collector, llm_source = await _pod_metrics()
+        collector.collect_metrics(llm_source)
+        content = collector.export_metrics_prometheus()
     except Exception as e:
         logger.error(f"Ошибка при экспорте метрик Prometheus: {e}")
-        return "# Error collecting metrics\n"
+        content = "# Error collecting metrics\n"
+    return Response(content=content, media_type=PROMETHEUS_CONTENT_TYPE)
 
 
 @app.get("/metrics/summary")
-async def get_metrics_summary(hours: int = 24) -> dict:
-    """Сводная статистика метрик"""
+async def get_metrics_summary(hours: int = Query(24, ge=1, description="Период в часах")) -> dict:
+    """Сводная статистика метрик (из хранилища, если оно подключено)"""
     try:
-        return metrics_collector.get_summary_stats(hours)
+        # Хранилище SQLite общее для всех воркеров
+        if metrics_collector.store is not None:
+            return await metrics_collector.store.summary(hours)
+        collector, _ = await _pod_metrics()
+        return collector.get_summary_stats(hours)
     except Exception as e:
         logger.error(f"Ошибка при получении сводки метрик: {e}")
         return {"error": "Failed to get metrics summary"}
 
 
-@app.post("/generate/testcase", response_model=GenerateCodeResponse)
-async def generate_testcase_endpoint(payload: GenerateTestcaseRequest) -> GenerateCodeResponse:
-    """Генерация тест-кейса"""
+@app.post("/specs", response_model=SpecInfo)
+async def upload_spec_endpoint(payload: SpecUploadRequest) -> SpecInfo:
+    """Загрузка OpenAPI спецификации в реестр, возвращает spec_id"""
+    try:
+        spec = spec_registry.register(payload.openapi_spec)
+    except Exception as exc:
+        logger.error(f"Ошибка загрузки спецификации: {exc}")
+        raise HTTPException(status_code=400, detail=str(exc))
+    return SpecInfo(**spec.to_dict())
+
+
+@app.get("/specs/{spec_id}", response_model=SpecInfo)
+async def get_spec_endpoint(spec_id: str) -> SpecInfo:
+    """Информация о загруженной спецификации"""
+    spec = spec_registry.find(spec_id)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Спецификация {spec_id} не найдена")
+    return SpecInfo(**spec.to_dict())
+
+
+@app.delete("/specs/{spec_id}")
+async def delete_spec_endpoint(spec_id: str) -> dict:
+    """Удаление спецификации из реестра"""
+    if not spec_registry.remove(spec_id):
+        raise HTTPException(status_code=404, detail=f"Спецификация {spec_id} не найдена")
+    return {"spec_id": spec_id, "deleted": True}
+
+
+def _job_info(job: Job) -> JobInfo:
+    def iso(ts: float | None) -> str | None:
+        return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+    return JobInfo(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        attempts=job.attempts,
+        created_at=iso(job.created_at),
+        started_at=iso(job.started_at),
+        finished_at=iso(job.finished_at),
+        code=job.result,
+        error=job.error,
+    )
+
+
+async def _enqueue_generation(kind: str, payload, response: Response) -> JobInfo:
+    """
+    Поставить генерацию в очередь задач и ответить 202 с id задачи
+    
+    Реестр спецификаций у каждого процесса свой, поэтому spec_id
+    заменяется самим документом.
+    """
+    if not settings.JOBS_ENABLED:
+        raise HTTPException(status_code=400, detail="Очередь задач отключена (JOBS_ENABLED)")
+    # Неполный запрос отклоняется сразу, а не после ожидания в очереди
+    try:
+        check_generation_payload(kind, payload)
+        if getattr(payload, "spec_id", None):
+            spec = spec_registry.get(payload.spec_id)
+            payload = payload.model_copy(update={"openapi_spec": spec.raw, "spec_id": None})
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    try:
+        job = await job_queue.enqueue(new_job(kind, payload.model_dump(exclude={"async_job"})))
+    except Exception as exc:
+        logger.error(f"Не удалось поставить задачу в очередь: {exc}")
+        raise HTTPException(status_code=503, detail="Очередь задач недоступна")
+    logger.info(f"Задача {job.id} ({kind}) поставлена в очередь")
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return _job_info(job)
+
+
+@app.post("/generate/testcase", response_model=GenerateCodeResponse | JobInfo)
+async def generate_testcase_endpoint(
+    payload: GenerateTestcaseRequest, request: Request, response: Response
+) -> GenerateCodeResponse | JobInfo:
+    """Генерация тест-кейса (при async_job=true — задача в очереди)"""
+    if payload.async_job:
+        return await _enqueue_generation("testcase", payload, response)
+    started = time.perf_counter()
     try:
-        metrics_collector.record_request("testcase_generation", True, 0, 0)
-        
-        code = await generate_testcase(
+        code = await run_guarded(
+            request,
+            generation_work("testcase", payload),
+            "/generate/testcase",
+            settings.REQUEST_DISCONNECT_POLL_SECONDS,
+        )
+    except RequestAborted as exc:
+        _record_generation("testcase_generation", started, None, outcome=exc.reason)
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
+    except Exception as exc:
+        _record_generation("testcase_generation", started, None)
+        logger.error(f"Ошибка генерации тест-кейса: {exc}")
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    _record_generation("testcase_generation", started, code)
+    return GenerateCodeResponse(code=code)
+
+
+@app.post("/generate/autotest", response_model=GenerateCodeResponse | JobInfo)
+async def generate_autotest_endpoint(
+    payload: GenerateAutotestRequest, request: Request, response: Response
+) -> GenerateCodeResponse | JobInfo:
+    """Генерация автотеста (при async_job=true — задача в очереди)"""
+    if payload.async_job:
+        return await _enqueue_generation("autotest", payload, response)
+    started = time.perf_counter()
+    request_type = generation_request_type("autotest", payload)
+    try:
+        code = await run_guarded(
+            request,
+            generation_work("autotest", payload),
+            "/generate/autotest",
+            settings.REQUEST_DISCONNECT_POLL_SECONDS,
+        )
+    except RequestAborted as exc:
+        _record_generation(request_type, started, None, outcome=exc.reason)
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
+    except Exception as exc:
+        _record_generation(request_type, started, None)
+        logger.error(f"Ошибка генерации автотеста: {exc}")
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    _record_generation(request_type, started, code)
+    return GenerateCodeResponse(code=code)
+
+
+@app.post("/generate/testcase/stream")
+async def generate_testcase_stream_endpoint(payload: GenerateTestcaseRequest) -> StreamingResponse:
+    """Потоковая генерация тест-кейса (Server-Sent Events)"""
+    started = time.perf_counter()
+    try:
+        events = stream_testcase(
             test_type=payload.test_type,
             requirements_text=payload.requirements_text,
             openapi_spec=payload.openapi_spec,
+            priority=payload.priority,
         )
-        return GenerateCodeResponse(code=code)
     except Exception as exc:
-        metrics_collector.record_request("testcase_generation", False, 0, 0)
-        logger.error(f"Ошибка генерации тест-кейса: {exc}")
+        _record_generation("testcase_generation", started, None)
+        logger.error(f"Ошибка потоковой генерации тест-кейса: {exc}")
         raise HTTPException(status_code=400, detail=str(exc))
+    
+    return _sse_response(events, "testcase_generation", started, "/generate/testcase/stream")
 
 
-@app.post("/generate/autotest", response_model=GenerateCodeResponse)
-async def generate_autotest_endpoint(payload: GenerateAutotestRequest) -> GenerateCodeResponse:
-    """Генерация автотеста"""
+@app.post("/generate/autotest/stream")
+async def generate_autotest_stream_endpoint(payload: GenerateAutotestRequest) -> StreamingResponse:
+    """Потоковая генерация автотеста (Server-Sent Events)"""
+    started = time.perf_counter()
+    request_type = f"autotest_{payload.target}"
     try:
         if payload.target == "api":
-            metrics_collector.record_request("autotest_api", True, 0, 0)
-            
-            if not (payload.openapi_spec and payload.method and payload.path):
-                raise ValueError("Для target=api нужны openapi_spec, method и path")
-            code = await generate_api_autotest(
+            if not ((payload.openapi_spec or payload.spec_id) and payload.method and payload.path):
+                raise ValueError("Для target=api нужны openapi_spec или spec_id, method и path")
+            events = stream_api_autotest(
                 openapi_spec=payload.openapi_spec,
                 method=payload.method,
                 path=payload.path,
+                spec_id=payload.spec_id,
             )
         else:
-            metrics_collector.record_request("autotest_ui", True, 0, 0)
-            
             if not payload.scenario:
                 raise ValueError("Для target=ui нужен scenario")
-            code = await generate_ui_autotest(payload.scenario)
-        return GenerateCodeResponse(code=code)
+            events = stream_ui_autotest(payload.scenario)
     except Exception as exc:
-        metrics_collector.record_request(f"autotest_{payload.target}", False, 0, 0)
-        logger.error(f"Ошибка генерации автотеста: {exc}")
+        _record_generation(request_type, started, None)
+        logger.error(f"Ошибка потоковой генерации автотеста: {exc}")
         raise HTTPException(status_code=400, detail=str(exc))
+    
+    return _sse_response(events, request_type, started, "/generate/autotest/stream")
+
+
+async def _ndjson(items: AsyncIterator[dict], started: float) -> AsyncIterator[str]:
+    """Сериализация результатов в NDJSON (одна JSON-строка на результат)"""
+    summary = None
+    try:
+        async for item in items:
+            if item.get("type") == "summary":
+                summary = item
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    finally:
+        if summary is None:
+            outcome = "cancelled"
+        else:
+            outcome = "ok" if not summary["failed"] else "partial"
+        metrics_collector.record_request(
+            "autotest_batch",
+            summary is not None,
+            (time.perf_counter() - started) * 1000,
+            summary["total"] if summary else 0,
+            outcome=outcome,
+        )
+
+
+@app.post("/generate/autotest/batch")
+async def generate_autotest_batch_endpoint(payload: GenerateAutotestBatchRequest) -> StreamingResponse:
+    """Пакетная генерация API автотестов по всей спецификации (NDJSON)"""
+    started = time.perf_counter()
+    try:
+        results = generate_api_autotests_batch(
+            openapi_spec=payload.openapi_spec,
+            tags=payload.tags,
+            path_prefix=payload.path_prefix,
+            methods=payload.methods,
+            concurrency=payload.concurrency,
+            spec_id=payload.spec_id,
+        )
+    except Exception as exc:
+        metrics_collector.record_request(
+            "autotest_batch", False, (time.perf_counter() - started) * 1000, 0
+        )
+        logger.error(f"Ошибка пакетной генерации автотестов: {exc}")
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    return StreamingResponse(
+        _ndjson(results, started),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs")
+async def jobs_stats_endpoint() -> dict:
+    """Глубина очереди задач генерации"""
+    try:
+        return await job_queue.stats()
+    except Exception as exc:
+        logger.error(f"Ошибка при получении статистики очереди: {exc}")
+        raise HTTPException(status_code=503, detail="Очередь задач недоступна")
+
+
+async def _get_job(job_id: str) -> Job:
+    try:
+        job = await job_queue.get(job_id)
+    except Exception as exc:
+        logger.error(f"Ошибка чтения задачи {job_id}: {exc}")
+        raise HTTPException(status_code=503, detail="Очередь задач недоступна")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача {job_id} не найдена")
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job_endpoint(job_id: str) -> JobInfo:
+    """Статус и результат задачи генерации"""
+    return _job_info(await _get_job(job_id))
+
+
+async def _job_events(job: Job) -> AsyncIterator[str]:
+    """События SSE при смене статуса задачи; финальное событие done содержит результат"""
+    status = None
+    last_sent = time.monotonic()
+    while True:
+        if job.status != status:
+            status = job.status
+            last_sent = time.monotonic()
+            info = _job_info(job).model_dump()
+            if status in FINISHED:
+                yield _sse_event("done", info)
+                return
+            yield _sse_event("status", info)
+        elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+            # Комментарий SSE не дает прокси закрыть простаивающее соединение
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+        job_id = job.id
+        job = await job_queue.get(job_id)
+        if job is None:
+            yield _sse_event("error", {"message": f"Задача {job_id} не найдена"})
+            return
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events_endpoint(job_id: str) -> StreamingResponse:
+    """Подписка на статус задачи (Server-Sent Events)"""
+    job = await _get_job(job_id)
+    return StreamingResponse(
+        _job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _attach_execution(report: ValidationReport, code: str, mode: str) -> ValidationReport:
+    """Добавить к отчету результат pytest, если код разбирается"""
+    if mode == "none":
+        return report
+    if not settings.EXECUTION_ENABLED:
+        raise HTTPException(status_code=400, detail="Запуск pytest отключен (EXECUTION_ENABLED)")
+    if any(issue.code == "syntax_error" for issue in report.issues):
+        return report
+    report.execution = await execution_pool.execute(code, mode)
+    return report
 
 
 @app.post("/validate/testcase", response_model=ValidationReport)
 async def validate_testcase_endpoint(payload: ValidateTestcaseRequest) -> ValidationReport:
-    """Валидация тест-кейса"""
-    metrics_collector.record_request("validation", True, 0, 0)
-    return validate_testcase(payload.code)
+    """Валидация тест-кейса (в пуле процессов, вне event loop)"""
+    started = time.perf_counter()
+    report = await validation_pool.validate(payload.code, payload.incremental, payload.rules)
+    report = await _attach_execution(report, payload.code, payload.execute)
+    metrics_collector.record_request(
+        "validation", True, (time.perf_counter() - started) * 1000, len(payload.code)
+    )
+    return report
+
+
+@app.post("/validate/testcase/batch", response_model=ValidationBatchReport)
+async def validate_testcase_batch_endpoint(payload: ValidateTestcaseBatchRequest) -> ValidationBatchReport:
+    """Параллельная валидация набора файлов: отчет по каждому файлу и общая статистика"""
+    if len(payload.files) > settings.VALIDATION_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Не больше {settings.VALIDATION_BATCH_MAX_FILES} файлов за запрос",
+        )
+    
+    started = time.perf_counter()
+    results, stats = await validation_pool.validate_many(
+        [(f.name, f.code) for f in payload.files], payload.rules
+    )
+    if payload.execute != "none":
+        reports = await asyncio.gather(*(
+            _attach_execution(report, f.code, payload.execute)
+            for f, (_, report) in zip(payload.files, results)
+        ))
+        results = list(zip((name for name, _ in results), reports))
+    metrics_collector.record_request(
+        "validation",
+        True,
+        (time.perf_counter() - started) * 1000,
+        sum(len(f.code) for f in payload.files),
+    )
+    return ValidationBatchReport(
+        is_valid=stats["invalid_files"] == 0,
+        results=[ValidationBatchItem(name=name, report=report) for name, report in results],
+        stats=stats,
+    )
+
+
+@app.get("/validate/rules", response_model=list[ValidationRuleInfo])
+async def list_validation_rules() -> list[ValidationRuleInfo]:
+    """Зарегистрированные правила валидации"""
+    return [
+        ValidationRuleInfo(
+            name=rule.name,
+            description=rule.description,
+            node_types=[t.__name__ for t in rule.node_types],
+            enabled_by_default=rule.enabled_by_default,
+        )
+        for rule in RULES.values()
+    ]
 
 
 @app.get("/")
@@ -137,7 +652,15 @@ async def root():
         "endpoints": {
             "generate_testcase": "/generate/testcase",
             "generate_autotest": "/generate/autotest",
+            "generate_testcase_stream": "/generate/testcase/stream",
+            "generate_autotest_stream": "/generate/autotest/stream",
+            "generate_autotest_batch": "/generate/autotest/batch",
             "validate_testcase": "/validate/testcase",
+            "validate_testcase_batch": "/validate/testcase/batch",
+            "validate_rules": "/validate/rules",
+            "specs": "/specs",
+            "jobs": "/jobs/{job_id}",
+            "job_events": "/jobs/{job_id}/events",
             "metrics": "/metrics",
             "health": "/health",
             "docs": "/docs",
@@ -1,14 +1,218 @@
 """
 Сбор и экспорт метрик для мониторинга AI-агента
 """
-from typing import Dict, List, Any
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Deque, Sequence, Tuple
+from datetime import datetime
 from dataclasses import dataclass, asdict
-from collections import defaultdict
-import statistics
+from collections import defaultdict, deque
+from array import array
+import asyncio
+import math
+import time
 
 from loguru import logger
 
+from circuit_breaker import STATE_VALUES
+
+
+class QuantileSketch:
+    """
+    Потоковая оценка квантилей с фиксированной памятью
+
+    Логарифмические корзины (как в DDSketch): значение v попадает в корзину
+    ceil(log_gamma(v)), поэтому оценка любого квантиля отличается от точной
+    не более чем на relative_accuracy. Добавление — O(1), квантиль — O(корзин).
+    """
+
+    __slots__ = ("relative_accuracy", "max_value", "_gamma", "_log_gamma",
+                 "counts", "count", "total", "min", "max")
+
+    def __init__(self, relative_accuracy: float = 0.01, max_value: float = 1e7) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        buckets = int(math.ceil(math.log(max_value) / self._log_gamma)) + 1
+        self.counts = array("Q", bytes(8 * buckets))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def index_of(self, value: float) -> int:
+        """Номер корзины для значения"""
+        if value <= 1:
+            return 0
+        return min(int(math.ceil(math.log(value) / self._log_gamma)), len(self.counts) - 1)
+
+    def value_at(self, index: int) -> float:
+        """Представитель корзины (середина в логарифмической шкале)"""
+        return 2 * self._gamma ** index / (self._gamma + 1) if index else 1.0
+
+    def add(self, value: float) -> None:
+        self.counts[self.index_of(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля q (0..1), 0 если данных нет"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative > rank:
+                return min(max(self.value_at(index), self.min), self.max)
+        return self.max
+
+    def quantile_of_counts(self, counts: Dict[int, int], q: float) -> float:
+        """Квантиль по разреженным счетчикам корзин {номер: количество}"""
+        total = sum(counts.values())
+        if not total:
+            return 0.0
+        rank = q * (total - 1)
+        cumulative = 0
+        for index in sorted(counts):
+            cumulative += counts[index]
+            if cumulative > rank:
+                return self.value_at(index)
+        return self.value_at(max(counts))
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Добавить данные другого скетча с теми же параметрами"""
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentiles(self) -> Dict[str, float]:
+        return {
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Разреженное представление для снимка метрик процесса"""
+        return {
+            "counts": {index: count for index, count in enumerate(self.counts) if count},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    def merge_dict(self, data: Dict[str, Any]) -> None:
+        """Добавить данные из to_dict() скетча с теми же параметрами"""
+        if not data["count"]:
+            return
+        for index, bucket_count in data["counts"].items():
+            self.counts[int(index)] += bucket_count
+        self.count += data["count"]
+        self.total += data["total"]
+        self.min = min(self.min, data["min"])
+        self.max = max(self.max, data["max"])
+
+
+# Границы корзин гистограмм длительности (секунды): от быстрых кэш-попаданий до таймаута LLM
+DURATION_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 240.0
+)
+
+REPAIR_ROUND_BUCKETS: Tuple[float, ...] = (0, 1, 2, 3, 5, 10)
+SAMPLE_COUNT_BUCKETS: Tuple[float, ...] = (1, 2, 3, 4, 6, 8)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items())
+    return "{" + inner + "}"
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками и фиксированными корзинами"""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счетчики корзин..., +Inf], сумма
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def _get_series(self, key: Tuple[str, ...]) -> List[Any]:
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [array("Q", bytes(8 * (len(self.buckets) + 1))), 0.0]
+        return series
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._get_series(key)
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+
+    def snapshot(self) -> List[Any]:
+        """Серии гистограммы для снимка метрик процесса: [метки, корзины, сумма]"""
+        return [[list(key), counts.tolist(), total] for key, (counts, total) in self._series.items()]
+
+    def merge_snapshot(self, data: List[Any]) -> None:
+        """Добавить серии из snapshot() другого процесса"""
+        for key, counts, total in data:
+            series = self._get_series(tuple(key))
+            # Снимок процесса с другими границами корзин не складывается
+            if len(counts) != len(series[0]):
+                continue
+            for index, count in enumerate(counts):
+                series[0][index] += count
+            series[1] += total
+
+    def render(self) -> List[str]:
+        """Строки в текстовом формате экспозиции Prometheus"""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (counts, total) in sorted(self._series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
 
 @dataclass
 class AgentMetrics:
@@ -22,6 +226,16 @@ class AgentMetrics:
     avg_response_length: int
     requests_by_type: Dict[str, int]
     errors_by_type: Dict[str, int]
+    llm_calls: int = 0
+    hedged_requests: int = 0
+    hedge_wins: int = 0
+    llm_concurrency_limit: int = 0
+    llm_in_flight: int = 0
+    llm_queue_depth: int = 0
+    llm_throttled: int = 0
+    llm_circuit_state: str = "closed"
+    llm_circuit_rejected: int = 0
+    processes: int = 1
     
     def to_dict(self) -> Dict[str, Any]:
         """Конвертация в словарь"""
@@ -30,15 +244,353 @@ class AgentMetrics:
         return result
 
 
+# Типы запросов, которые не считаются генерацией в сводной статистике
+NON_GENERATION_TYPES = {"validation"}
+
+# Уровни агрегации: (длительность корзины в секундах, число корзин)
+ROLLUP_TIERS: Tuple[Tuple[int, int], ...] = (
+    (10, 360),      # 10 секунд за последний час
+    (60, 1440),     # 1 минута за последние сутки
+    (3600, 720),    # 1 час за последние 30 дней
+)
+
+# Общая шкала корзин латентности для всех агрегатов
+_latency_scale = QuantileSketch()
+
+
+class RollupBucket:
+    """Агрегат запросов за фиксированный интервал времени"""
+
+    __slots__ = ("start", "requests", "errors", "cache_hits", "response_length_total",
+                 "by_type", "errors_by_type", "latency_total_ms", "latency_counts")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.response_length_total = 0
+        self.by_type: Dict[str, int] = {}
+        self.errors_by_type: Dict[str, int] = {}
+        # Латентность по типам: сумма и разреженные корзины QuantileSketch
+        self.latency_total_ms: Dict[str, float] = {}
+        self.latency_counts: Dict[str, Dict[int, int]] = {}
+
+    def add(self, request_type: str, success: bool, time_ms: float, length: int, cache_hit: bool) -> None:
+        self.requests += 1
+        self.by_type[request_type] = self.by_type.get(request_type, 0) + 1
+        if not success:
+            self.errors += 1
+            self.errors_by_type[request_type] = self.errors_by_type.get(request_type, 0) + 1
+        if cache_hit:
+            self.cache_hits += 1
+        self.response_length_total += length
+        self.latency_total_ms[request_type] = self.latency_total_ms.get(request_type, 0.0) + time_ms
+        counts = self.latency_counts.setdefault(request_type, {})
+        index = _latency_scale.index_of(time_ms)
+        counts[index] = counts.get(index, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RollupBucket":
+        bucket = cls(data["start"])
+        for name in cls.__slots__[1:]:
+            setattr(bucket, name, data[name])
+        # Ключи JSON — строки, номера корзин латентности восстанавливаются в int
+        bucket.latency_counts = {
+            name: {int(index): count for index, count in counts.items()}
+            for name, counts in data["latency_counts"].items()
+        }
+        return bucket
+
+    def merge(self, other: "RollupBucket") -> None:
+        self.requests += other.requests
+        self.errors += other.errors
+        self.cache_hits += other.cache_hits
+        self.response_length_total += other.response_length_total
+        for name, count in other.by_type.items():
+            self.by_type[name] = self.by_type.get(name, 0) + count
+        for name, count in other.errors_by_type.items():
+            self.errors_by_type[name] = self.errors_by_type.get(name, 0) + count
+        for name, total in other.latency_total_ms.items():
+            self.latency_total_ms[name] = self.latency_total_ms.get(name, 0.0) + total
+        for name, counts in other.latency_counts.items():
+            target = self.latency_counts.setdefault(name, {})
+            for index, count in counts.items():
+                target[index] = target.get(index, 0) + count
+
+
+class _RollupTier:
+    """Кольцо закрытых корзин одного разрешения и текущая открытая корзина"""
+
+    __slots__ = ("resolution", "ring", "open")
+
+    def __init__(self, resolution: int, capacity: int) -> None:
+        self.resolution = resolution
+        self.ring: Deque[RollupBucket] = deque(maxlen=capacity)
+        self.open: RollupBucket | None = None
+
+    def align(self, ts: float) -> float:
+        return ts - ts % self.resolution
+
+
+class MetricsRollup:
+    """
+    Агрегация запросов в корзины фиксированной длительности
+
+    Запросы попадают в открытую 10-секундную корзину. Сэмплер закрывает ее
+    раз в интервал (в том числе пустую), закрытая корзина сливается в
+    открытую корзину следующего уровня и так далее. Каждая запись хранится
+    ровно в одном из: кольцо уровня k, открытая корзина уровня k или
+    открытые корзины более мелких уровней.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[int, int]] = ROLLUP_TIERS) -> None:
+        self.tiers = [_RollupTier(resolution, capacity) for resolution, capacity in tiers]
+
+    def record(self, request_type: str, success: bool, time_ms: float, length: int,
+               cache_hit: bool, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        self.tick(now)
+        self.tiers[0].open.add(request_type, success, time_ms, length, cache_hit)
+
+    def tick(self, now: float | None = None) -> None:
+        """Закрыть все завершившиеся корзины нижнего уровня"""
+        now = time.time() if now is None else now
+        base = self.tiers[0]
+        if base.open is None:
+            base.open = RollupBucket(base.align(now))
+            return
+        # После долгой паузы не создаем больше пустых корзин, чем помещается в кольцо
+        if now - base.open.start > base.resolution * base.ring.maxlen:
+            self._close(0)
+            base.open = RollupBucket(base.align(now))
+            return
+        while base.open.start + base.resolution <= now:
+            next_start = base.open.start + base.resolution
+            self._close(0)
+            base.open = RollupBucket(next_start)
+
+    def _close(self, level: int) -> None:
+        tier = self.tiers[level]
+        bucket = tier.open
+        tier.ring.append(bucket)
+        if level + 1 < len(self.tiers):
+            self._push(level + 1, bucket)
+
+    def _push(self, level: int, bucket: RollupBucket) -> None:
+        tier = self.tiers[level]
+        if tier.open is not None and bucket.start >= tier.open.start + tier.resolution:
+            self._close(level)
+            tier.open = None
+        if tier.open is None:
+            tier.open = RollupBucket(tier.align(bucket.start))
+        tier.open.merge(bucket)
+
+    def window(self, seconds: float, now: float | None = None) -> Tuple[RollupBucket, int]:
+        """
+        Слияние корзин за последние seconds секунд за O(число корзин)
+
+        Returns:
+            tuple: (суммарная корзина, разрешение использованного уровня)
+        """
+        now = time.time() if now is None else now
+        self.tick(now)
+        cutoff = now - seconds
+        level = next(
+            (i for i, t in enumerate(self.tiers) if t.resolution * t.ring.maxlen >= seconds),
+            len(self.tiers) - 1,
+        )
+        total = RollupBucket(cutoff)
+        for bucket in self.tiers[level].ring:
+            if bucket.start + self.tiers[level].resolution > cutoff:
+                total.merge(bucket)
+        for tier in self.tiers[:level + 1]:
+            if tier.open is not None:
+                total.merge(tier.open)
+        return total, self.tiers[level].resolution
+
+    def snapshot(self, now: float | None = None) -> List[Dict[str, Any]]:
+        """Непустые корзины по уровням для снимка метрик процесса"""
+        self.tick(now)
+        return [
+            {
+                "ring": [bucket.to_dict() for bucket in tier.ring if bucket.requests],
+                "open": tier.open.to_dict() if tier.open is not None and tier.open.requests else None,
+            }
+            for tier in self.tiers
+        ]
+
+    async def run_sampler(self, interval: float | None = None) -> None:
+        """Фоновый сэмплер: закрывает корзины по расписанию, независимо от опроса /metrics"""
+        interval = interval or self.tiers[0].resolution
+        while True:
+            await asyncio.sleep(interval - time.time() % interval)
+            self.tick()
+
+
+class RollupView:
+    """
+    Окно по снимкам MetricsRollup нескольких процессов (только чтение)
+
+    Корзины каждого уровня складываются из всех снимков; окно считается
+    так же, как MetricsRollup.window, но открытые корзины тоже отсекаются
+    по времени: снимок завершившегося процесса может быть старым.
+    """
+
+    def __init__(self, tiers: Sequence[Tuple[int, int]] = ROLLUP_TIERS) -> None:
+        self.tiers = tuple(tiers)
+        self._ring: List[List[RollupBucket]] = [[] for _ in self.tiers]
+        self._open: List[List[RollupBucket]] = [[] for _ in self.tiers]
+
+    def add(self, snapshot: List[Dict[str, Any]]) -> None:
+        for level, tier in enumerate(snapshot[:len(self.tiers)]):
+            self._ring[level].extend(RollupBucket.from_dict(data) for data in tier["ring"])
+            if tier["open"] is not None:
+                self._open[level].append(RollupBucket.from_dict(tier["open"]))
+
+    def window(self, seconds: float, now: float | None = None) -> Tuple[RollupBucket, int]:
+        now = time.time() if now is None else now
+        cutoff = now - seconds
+        level = next(
+            (i for i, (resolution, capacity) in enumerate(self.tiers) if resolution * capacity >= seconds),
+            len(self.tiers) - 1,
+        )
+        total = RollupBucket(cutoff)
+        resolution = self.tiers[level][0]
+        for bucket in self._ring[level]:
+            if bucket.start + resolution > cutoff:
+                total.merge(bucket)
+        for open_level in range(level + 1):
+            for bucket in self._open[open_level]:
+                if bucket.start + self.tiers[open_level][0] > cutoff:
+                    total.merge(bucket)
+        return total, resolution
+
+
+def summarize_bucket(total: RollupBucket, hours: float, resolution: int) -> Dict[str, Any]:
+    """Сводная статистика по агрегату за период (формат /metrics/summary)"""
+    if not total.requests:
+        return {"message": "Нет данных за указанный период"}
+
+    generation_counts: Dict[int, int] = {}
+    generation_time_total = 0.0
+    generation_requests = 0
+    latency_by_type = {}
+    for req_type, counts in total.latency_counts.items():
+        type_requests = sum(counts.values())
+        latency_by_type[req_type] = {
+            "avg_ms": total.latency_total_ms[req_type] / type_requests,
+            "p50_ms": _latency_scale.quantile_of_counts(counts, 0.5),
+            "p95_ms": _latency_scale.quantile_of_counts(counts, 0.95),
+            "p99_ms": _latency_scale.quantile_of_counts(counts, 0.99),
+        }
+        if req_type in NON_GENERATION_TYPES:
+            continue
+        generation_requests += type_requests
+        generation_time_total += total.latency_total_ms[req_type]
+        for index, count in counts.items():
+            generation_counts[index] = generation_counts.get(index, 0) + count
+
+    return {
+        "period_hours": hours,
+        "resolution_seconds": resolution,
+        "total_requests": total.requests,
+        "requests_per_minute": total.requests / (hours * 60),
+        "success_rate": (total.requests - total.errors) / total.requests,
+        "avg_cache_hit_rate": total.cache_hits / total.requests,
+        "avg_generation_time_ms": generation_time_total / generation_requests if generation_requests else 0,
+        "p50_generation_time_ms": _latency_scale.quantile_of_counts(generation_counts, 0.5),
+        "p95_generation_time_ms": _latency_scale.quantile_of_counts(generation_counts, 0.95),
+        "p99_generation_time_ms": _latency_scale.quantile_of_counts(generation_counts, 0.99),
+        "avg_response_length": total.response_length_total / total.requests,
+        "latency_by_type": latency_by_type,
+        "requests_by_type": dict(total.by_type),
+        "errors_by_type": dict(total.errors_by_type),
+    }
+
+
 class MetricsCollector:
     """Сборщик метрик для AI-агента"""
     
     def __init__(self):
-        self.metrics_history: List[AgentMetrics] = []
+        self.latest: AgentMetrics | None = None
+        self.rollup = MetricsRollup()
+        # Долговременное хранилище (MetricsStore), подключается при старте приложения
+        self.store = None
         self.request_types = defaultdict(int)
         self.error_types = defaultdict(int)
+        # (маршрут, причина) -> число прерванных запросов
+        self.request_aborts = defaultdict(int)
+        self.http_duration = Histogram(
+            "aitest_agent_http_request_duration_seconds",
+            "HTTP request duration until response headers, by route",
+            ("route", "method", "status"),
+        )
+        self.generation_duration = Histogram(
+            "aitest_agent_generation_duration_seconds",
+            "End-to-end generation duration by request type",
+            ("request_type", "cache_hit", "outcome"),
+        )
+        self.repair_rounds = Histogram(
+            "aitest_agent_repair_rounds",
+            "Validator-driven repair rounds per generation",
+            ("request_type", "outcome"),
+            buckets=REPAIR_ROUND_BUCKETS,
+        )
+        self.llm_wait = Histogram(
+            "aitest_agent_llm_limiter_wait_seconds",
+            "Time spent waiting for the LLM rate limiter",
+            (),
+        )
+        self.best_of_n_samples = Histogram(
+            "aitest_agent_best_of_n_samples",
+            "Best-of-N samples completed before a result was chosen",
+            ("request_type", "outcome"),
+            buckets=SAMPLE_COUNT_BUCKETS,
+        )
         
-        logger.info("Инициализирован MetricsCollector")
+        logger.debug("Инициализирован MetricsCollector")
+    
+    def _histograms(self) -> Tuple[Histogram, ...]:
+        return (
+            self.http_duration,
+            self.generation_duration,
+            self.repair_rounds,
+            self.best_of_n_samples,
+            self.llm_wait,
+        )
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Счетчики, гистограммы и агрегаты процесса для сводных метрик нескольких процессов"""
+        return {
+            "request_types": dict(self.request_types),
+            "error_types": dict(self.error_types),
+            "request_aborts": [[route, reason, count] for (route, reason), count in self.request_aborts.items()],
+            "histograms": {histogram.name: histogram.snapshot() for histogram in self._histograms()},
+            "rollup": self.rollup.snapshot(),
+        }
+    
+    @classmethod
+    def from_snapshots(cls, snapshots: List[Dict[str, Any]]) -> "MetricsCollector":
+        """Сборщик, объединяющий снимки snapshot() нескольких процессов (только для чтения)"""
+        merged = cls()
+        merged.rollup = RollupView()
+        histograms = {histogram.name: histogram for histogram in merged._histograms()}
+        for snapshot in snapshots:
+            for name, count in snapshot["request_types"].items():
+                merged.request_types[name] += count
+            for name, count in snapshot["error_types"].items():
+                merged.error_types[name] += count
+            for route, reason, count in snapshot["request_aborts"]:
+                merged.request_aborts[(route, reason)] += count
+            for name, series in snapshot["histograms"].items():
+                if name in histograms:
+                    histograms[name].merge_snapshot(series)
+            merged.rollup.add(snapshot["rollup"])
+        return merged
     
     def record_request(
         self,
@@ -46,10 +598,11 @@ class MetricsCollector:
         success: bool,
         generation_time_ms: float,
         response_length: int,
-        cache_hit: bool = False
+        cache_hit: bool = False,
+        outcome: str | None = None
     ):
         """
-        Запись метрик запроса
+        Запись метрик запроса (вызывается после завершения обработки)
         
         Args:
             request_type: Тип запроса (testcase, autotest_api, autotest_ui)
@@ -57,18 +610,49 @@ class MetricsCollector:
             generation_time_ms: Время генерации в мс
             response_length: Длина ответа
             cache_hit: Попадание в кэш
+            outcome: Исход для гистограммы (ok, fallback, error), по умолчанию из success
         """
         self.request_types[request_type] += 1
         
         if not success:
             self.error_types[request_type] += 1
         
+        self.rollup.record(request_type, success, generation_time_ms, response_length, cache_hit)
+        if self.store is not None:
+            self.store.record(request_type, success, generation_time_ms, response_length, cache_hit)
+        self.generation_duration.observe(
+            generation_time_ms / 1000,
+            request_type=request_type,
+            cache_hit=str(cache_hit).lower(),
+            outcome=outcome or ("ok" if success else "error"),
+        )
+        
         # Логируем медленные запросы
         if generation_time_ms > 10000:  # > 10 секунд
             logger.warning(
                 f"Медленный запрос {request_type}: {generation_time_ms:.1f}ms"
             )
     
+    def record_repair(self, request_type: str, rounds: int, outcome: str) -> None:
+        """Запись числа раундов исправления кода по замечаниям валидатора"""
+        self.repair_rounds.observe(rounds, request_type=request_type, outcome=outcome)
+    
+    def record_llm_wait(self, wait_s: float) -> None:
+        """Запись времени ожидания слота в ограничителе запросов к LLM"""
+        self.llm_wait.observe(wait_s)
+    
+    def record_best_of_n(self, request_type: str, completed: int, outcome: str) -> None:
+        """Запись числа завершенных вариантов best-of-N до выбора результата"""
+        self.best_of_n_samples.observe(completed, request_type=request_type, outcome=outcome)
+    
+    def record_request_aborted(self, route: str, reason: str) -> None:
+        """Запись запроса, прерванного отключением клиента или дедлайном"""
+        self.request_aborts[(route, reason)] += 1
+    
+    def record_http_request(self, route: str, method: str, status: int, duration_s: float) -> None:
+        """Запись длительности HTTP запроса"""
+        self.http_duration.observe(duration_s, route=route, method=method, status=status)
+    
     def collect_metrics(self, llm_client) -> AgentMetrics:
         """
         Сбор агрегированных метрик
@@ -79,6 +663,10 @@ class MetricsCollector:
         # Получаем метрики из LLM клиента
         llm_summary = llm_client.get_metrics_summary() if hasattr(llm_client, 'get_metrics_summary') else {}
         
+        hedging = llm_summary.get("hedging") or {}
+        limiter = llm_summary.get("rate_limiter") or {}
+        breaker = llm_summary.get("circuit_breaker") or {}
+        
         # Рассчитываем cache hit rate
         total_requests = sum(self.request_types.values())
         if total_requests > 0:
@@ -96,35 +684,24 @@ class MetricsCollector:
             avg_response_length=int(llm_summary.get('avg_response_length', 0)),
             requests_by_type=dict(self.request_types),
             errors_by_type=dict(self.error_types),
+            llm_calls=hedging.get("calls", 0),
+            hedged_requests=hedging.get("hedges", 0),
+            hedge_wins=hedging.get("hedge_wins", 0),
+            llm_concurrency_limit=limiter.get("concurrency_limit", 0),
+            llm_in_flight=limiter.get("in_flight", 0),
+            llm_queue_depth=limiter.get("queue_depth", 0),
+            llm_throttled=limiter.get("throttled", 0),
+            llm_circuit_state=breaker.get("state", "closed"),
+            llm_circuit_rejected=breaker.get("rejected", 0),
+            processes=llm_summary.get("processes", 1),
         )
         
-        self.metrics_history.append(metrics)
-        
-        # Очищаем старые метрики (храним только последние 1000)
-        if len(self.metrics_history) > 1000:
-            self.metrics_history = self.metrics_history[-1000:]
-        
+        self.latest = metrics
         return metrics
     
-    def get_recent_metrics(self, hours: int = 1) -> List[AgentMetrics]:
-        """
-        Получить метрики за последние N часов
-        
-        Args:
-            hours: Количество часов
-            
-        Returns:
-            Список метрик
-        """
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        return [
-            m for m in self.metrics_history
-            if m.timestamp >= cutoff_time
-        ]
-    
     def get_summary_stats(self, hours: int = 24) -> Dict[str, Any]:
         """
-        Получить сводную статистику
+        Получить сводную статистику по агрегатам фиксированных интервалов
         
         Args:
             hours: Количество часов для анализа
@@ -132,55 +709,8 @@ class MetricsCollector:
         Returns:
             Словарь со статистикой
         """
-        recent_metrics = self.get_recent_metrics(hours)
-        
-        if not recent_metrics:
-            return {"message": "Нет данных за указанный период"}
-        
-        # Собираем данные
-        generation_times = []
-        response_lengths = []
-        
-        for metric in recent_metrics:
-            if metric.avg_generation_time_ms > 0:
-                generation_times.append(metric.avg_generation_time_ms)
-            if metric.avg_response_length > 0:
-                response_lengths.append(metric.avg_response_length)
-        
-        # Рассчитываем статистику
-        stats = {
-            "period_hours": hours,
-            "total_requests": sum(m.total_requests for m in recent_metrics),
-            "success_rate": (
-                sum(m.successful_requests for m in recent_metrics) / 
-                sum(m.total_requests for m in recent_metrics)
-                if sum(m.total_requests for m in recent_metrics) > 0 else 0
-            ),
-            "avg_cache_hit_rate": statistics.mean(
-                [m.cache_hit_rate for m in recent_metrics if m.cache_hit_rate > 0]
-            ) if any(m.cache_hit_rate > 0 for m in recent_metrics) else 0,
-            "avg_generation_time_ms": statistics.mean(generation_times) if generation_times else 0,
-            "p95_generation_time_ms": (
-                sorted(generation_times)[int(len(generation_times) * 0.95)]
-                if generation_times else 0
-            ),
-            "avg_response_length": statistics.mean(response_lengths) if response_lengths else 0,
-            "requests_by_type": defaultdict(int),
-            "errors_by_type": defaultdict(int),
-        }
-        
-        # Агрегируем по типам
-        for metric in recent_metrics:
-            for req_type, count in metric.requests_by_type.items():
-                stats["requests_by_type"][req_type] += count
-            for err_type, count in metric.errors_by_type.items():
-                stats["errors_by_type"][err_type] += count
-        
-        # Конвертируем defaultdict в dict
-        stats["requests_by_type"] = dict(stats["requests_by_type"])
-        stats["errors_by_type"] = dict(stats["errors_by_type"])
-        
-        return stats
+        total, resolution = self.rollup.window(hours * 3600)
+        return summarize_bucket(total, hours, resolution)
     
     def export_metrics_prometheus(self) -> str:
         """
@@ -189,10 +719,10 @@ class MetricsCollector:
         Returns:
             Строка с метриками в формате Prometheus
         """
-        if not self.metrics_history:
+        if self.latest is None:
             return "# Нет метрик\n"
         
-        latest = self.metrics_history[-1]
+        latest = self.latest
         
         metrics_lines = [
             "# HELP aitest_agent_requests_total Total number of requests",
@@ -214,17 +744,76 @@ class MetricsCollector:
             "# HELP aitest_agent_response_length Average response length",
             "# TYPE aitest_agent_response_length gauge",
             f"aitest_agent_response_length {latest.avg_response_length}",
+            "",
+            "# HELP aitest_agent_llm_calls_total Upstream LLM calls (hedge policy scope)",
+            "# TYPE aitest_agent_llm_calls_total counter",
+            f"aitest_agent_llm_calls_total {latest.llm_calls}",
+            "",
+            "# HELP aitest_agent_llm_hedges_total Duplicate LLM requests fired by the hedge policy",
+            "# TYPE aitest_agent_llm_hedges_total counter",
+            f"aitest_agent_llm_hedges_total {latest.hedged_requests}",
+            "",
+            "# HELP aitest_agent_llm_hedge_wins_total Hedged requests that answered before the primary",
+            "# TYPE aitest_agent_llm_hedge_wins_total counter",
+            f"aitest_agent_llm_hedge_wins_total {latest.hedge_wins}",
+            "",
+            "# HELP aitest_agent_llm_concurrency_limit Current adaptive LLM concurrency limit",
+            "# TYPE aitest_agent_llm_concurrency_limit gauge",
+            f"aitest_agent_llm_concurrency_limit {latest.llm_concurrency_limit}",
+            "",
+            "# HELP aitest_agent_llm_in_flight LLM requests in flight",
+            "# TYPE aitest_agent_llm_in_flight gauge",
+            f"aitest_agent_llm_in_flight {latest.llm_in_flight}",
+            "",
+            "# HELP aitest_agent_llm_queue_depth LLM requests waiting for the rate limiter",
+            "# TYPE aitest_agent_llm_queue_depth gauge",
+            f"aitest_agent_llm_queue_depth {latest.llm_queue_depth}",
+            "",
+            "# HELP aitest_agent_llm_throttled_total LLM responses with 429 or timeout",
+            "# TYPE aitest_agent_llm_throttled_total counter",
+            f"aitest_agent_llm_throttled_total {latest.llm_throttled}",
+            "",
+            "# HELP aitest_agent_llm_circuit_state LLM circuit breaker state (0 closed, 1 half-open, 2 open)",
+            "# TYPE aitest_agent_llm_circuit_state gauge",
+            f"aitest_agent_llm_circuit_state {STATE_VALUES.get(latest.llm_circuit_state, 0)}",
+            "",
+            "# HELP aitest_agent_llm_circuit_rejected_total LLM calls rejected by the open circuit",
+            "# TYPE aitest_agent_llm_circuit_rejected_total counter",
+            f"aitest_agent_llm_circuit_rejected_total {latest.llm_circuit_rejected}",
+            "",
+            "# HELP aitest_agent_processes Live worker processes included in these metrics",
+            "# TYPE aitest_agent_processes gauge",
+            f"aitest_agent_processes {latest.processes}",
         ]
         
         # Добавляем метрики по типам
-        for req_type, count in latest.requests_by_type.items():
+        if latest.requests_by_type:
             metrics_lines.extend([
                 "",
-                f"# HELP aitest_agent_requests_by_type_total Requests by type",
+                "# HELP aitest_agent_requests_by_type_total Requests by type",
                 "# TYPE aitest_agent_requests_by_type_total counter",
-                f'ai_test_agent_requests_by_type_total{{type="{req_type}"}} {count}',
             ])
+            for req_type, count in latest.requests_by_type.items():
+                metrics_lines.append(
+                    f"aitest_agent_requests_by_type_total{_format_labels({'type': req_type})} {count}"
+                )
+        
+        if self.request_aborts:
+            metrics_lines.extend([
+                "",
+                "# HELP aitest_agent_requests_aborted_total Requests cancelled on client disconnect or deadline",
+                "# TYPE aitest_agent_requests_aborted_total counter",
+            ])
+            for (route, reason), count in sorted(self.request_aborts.items()):
+                metrics_lines.append(
+                    f"aitest_agent_requests_aborted_total{_format_labels({'route': route, 'reason': reason})} {count}"
+                )
+        
+        for histogram in self._histograms():
+            metrics_lines.append("")
+            metrics_lines.extend(histogram.render())
         
+        metrics_lines.append("")
         return "\n".join(metrics_lines)
 
 
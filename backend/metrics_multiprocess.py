@@ -0,0 +1,214 @@
+"""
+Сводные метрики нескольких процессов (uvicorn --workers)
+
+Каждый процесс раз в interval атомарно записывает снимок своих метрик в
+METRICS_MULTIPROC_DIR/<host>-<pid>.json. При опросе /metrics обслуживающий
+процесс обновляет свой снимок и объединяет снимки всех процессов пода.
+Воркеры очереди (worker.py) с тем же каталогом тоже попадают в сводку.
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from circuit_breaker import CLOSED, STATE_VALUES
+from metrics import MetricsCollector, QuantileSketch
+
+# Снимок старше стольких интервалов записи — процесс считается завершенным
+STALE_INTERVALS = 3
+
+
+class _MergedLLMSummary:
+    """Источник сводки LLM для MetricsCollector.collect_metrics"""
+
+    def __init__(self, summary: Dict[str, Any]) -> None:
+        self._summary = summary
+
+    def get_metrics_summary(self) -> Dict[str, Any]:
+        return self._summary
+
+
+def merge_llm_snapshots(snapshots: List[Dict[str, Any]], live: List[bool]) -> Dict[str, Any]:
+    """
+    Сводка LLMClient.get_metrics_summary() по снимкам metrics_snapshot()
+
+    Счетчики суммируются по всем процессам, включая завершившиеся;
+    мгновенные значения (in_flight, лимит параллельности, состояние
+    circuit breaker) берутся только у живых процессов.
+    """
+    latency = QuantileSketch()
+    response_length = QuantileSketch()
+    total = successful = cache_hits = coalesced = in_flight = 0
+    hedging = {"calls": 0, "hedges": 0, "hedge_wins": 0, "suppressed": 0, "delay_seconds": None}
+    limiter = {
+        "concurrency_limit": 0, "in_flight": 0, "queue_depth": 0,
+        "throttled": 0, "acquired": 0, "blocked_for_seconds": 0.0,
+    }
+    wait_seconds_total = 0.0
+    breaker = {"state": CLOSED, "window_calls": 0, "rejected": 0, "opened": 0}
+    window_errors = window_slow = 0.0
+
+    for snapshot, alive in zip(snapshots, live):
+        total += snapshot["total_requests"]
+        successful += snapshot["successful"]
+        cache_hits += snapshot["cache_hits"]
+        coalesced += snapshot["coalesced_requests"]
+        latency.merge_dict(snapshot["latency_ms"])
+        response_length.merge_dict(snapshot["response_length"])
+
+        hedge = snapshot.get("hedging") or {}
+        for name in ("calls", "hedges", "hedge_wins", "suppressed"):
+            hedging[name] += hedge.get(name, 0)
+
+        rate = snapshot["rate_limiter"]
+        limiter["throttled"] += rate["throttled"]
+        limiter["acquired"] += rate["acquired"]
+        wait_seconds_total += rate["avg_wait_seconds"] * rate["acquired"]
+
+        circuit = snapshot["circuit_breaker"]
+        breaker["rejected"] += circuit["rejected"]
+        breaker["opened"] += circuit["opened"]
+
+        if not alive:
+            continue
+        in_flight += snapshot["in_flight"]
+        if hedge.get("delay_seconds") is not None:
+            hedging["delay_seconds"] = max(hedging["delay_seconds"] or 0.0, hedge["delay_seconds"])
+        for name in ("concurrency_limit", "in_flight", "queue_depth"):
+            limiter[name] += rate[name]
+        limiter["blocked_for_seconds"] = max(limiter["blocked_for_seconds"], rate["blocked_for_seconds"])
+        # Худшее состояние среди процессов
+        if STATE_VALUES.get(circuit["state"], 0) > STATE_VALUES.get(breaker["state"], 0):
+            breaker["state"] = circuit["state"]
+        breaker["window_calls"] += circuit["window_calls"]
+        window_errors += circuit["error_rate"] * circuit["window_calls"]
+        window_slow += circuit["slow_rate"] * circuit["window_calls"]
+
+    hedging["hedge_ratio"] = hedging["hedges"] / hedging["calls"] if hedging["calls"] else 0.0
+    limiter["avg_wait_seconds"] = wait_seconds_total / limiter["acquired"] if limiter["acquired"] else 0.0
+    calls = breaker["window_calls"]
+    breaker["error_rate"] = window_errors / calls if calls else 0.0
+    breaker["slow_rate"] = window_slow / calls if calls else 0.0
+
+    summary: Dict[str, Any] = {
+        "processes": sum(live),
+        "total_requests": total,
+        "coalesced_requests": coalesced,
+        "in_flight": in_flight,
+        "hedging": hedging,
+        "rate_limiter": limiter,
+        "circuit_breaker": breaker,
+    }
+    if total:
+        summary.update({
+            "successful": successful,
+            "failed": total - successful,
+            "cache_hit_rate": cache_hits / total,
+            "avg_generation_time_ms": latency.mean,
+            "avg_response_length": response_length.mean,
+            "generation_time_ms": latency.percentiles(),
+            "response_length": response_length.percentiles(),
+        })
+    return summary
+
+
+class MultiprocessMetrics:
+    """
+    Снимки метрик процессов в общем каталоге
+
+    Счетчики и гистограммы завершившихся процессов продолжают учитываться,
+    поэтому счетчики Prometheus не уменьшаются при перезапуске воркера.
+    Каталог очищается при старте контейнера (см. Dockerfile).
+    """
+
+    def __init__(self, directory: str, collector: MetricsCollector, llm_client: Any, interval: float = 5.0) -> None:
+        self.directory = Path(directory)
+        self.collector = collector
+        self.llm_client = llm_client
+        self.interval = interval
+        # Имя хоста различает процессы контейнеров с общим каталогом
+        self.process = f"{socket.gethostname()}-{os.getpid()}"
+
+    @classmethod
+    def from_settings(cls, settings, collector: MetricsCollector, llm_client: Any) -> Optional["MultiprocessMetrics"]:
+        if not settings.METRICS_MULTIPROC_DIR:
+            return None
+        return cls(
+            settings.METRICS_MULTIPROC_DIR,
+            collector,
+            llm_client,
+            interval=settings.METRICS_SNAPSHOT_INTERVAL_SECONDS,
+        )
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"{self.process}.json"
+
+    def _serialize(self) -> str:
+        # Снимок берется в потоке event loop, пока метрики не меняются
+        return json.dumps({
+            "process": self.process,
+            "time": time.time(),
+            "collector": self.collector.snapshot(),
+            "llm": self.llm_client.metrics_snapshot(),
+        })
+
+    def _write(self, content: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(content, encoding="utf-8")
+        # Атомарная замена: читатели видят либо старый, либо новый снимок
+        os.replace(tmp, self.path)
+
+    async def write(self) -> None:
+        await asyncio.to_thread(self._write, self._serialize())
+
+    def _read(self) -> List[Dict[str, Any]]:
+        snapshots = []
+        for path in self.directory.glob("*.json"):
+            try:
+                snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Снимок метрик {path.name} не прочитан: {e}")
+        return snapshots
+
+    def _merge(self) -> Tuple[MetricsCollector, _MergedLLMSummary]:
+        snapshots = self._read()
+        stale_before = time.time() - STALE_INTERVALS * self.interval
+        live = [s.get("process") == self.process or s["time"] >= stale_before for s in snapshots]
+        merged = MetricsCollector.from_snapshots([s["collector"] for s in snapshots])
+        summary = merge_llm_snapshots([s["llm"] for s in snapshots], live)
+        summary["model"] = self.llm_client.settings.LLM_MODEL
+        summary["provider"] = "Cloud.ru GigaChat"
+        return merged, _MergedLLMSummary(summary)
+
+    async def collect(self) -> Tuple[MetricsCollector, _MergedLLMSummary]:
+        """
+        Метрики всего пода
+
+        Returns:
+            tuple: (сборщик с объединенными счетчиками, источник сводки LLM
+            для collect_metrics)
+        """
+        await self.write()
+        return await asyncio.to_thread(self._merge)
+
+    async def run_writer(self) -> None:
+        """Фоновая запись снимка; последний снимок пишется при остановке"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.write()
+                except OSError as e:
+                    logger.error(f"Не удалось записать снимок метрик: {e}")
+        finally:
+            try:
+                self._write(self._serialize())
+            except OSError as e:
+                logger.error(f"Не удалось записать снимок метрик: {e}")
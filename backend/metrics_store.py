@@ -0,0 +1,404 @@
+"""
+Долговременное хранилище метрик запросов в SQLite (WAL)
+
+Записи копятся в памяти и пачками пишутся в фоновом потоке. Сырые записи
+прореживаются в поминутные агрегаты, поминутные — в почасовые; у каждого
+уровня свой срок хранения. Базу могут делить несколько процессов.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from metrics import RollupBucket, summarize_bucket
+
+
+MINUTE = 60
+HOUR = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests_raw (
+    ts REAL NOT NULL,
+    request_type TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    time_ms REAL NOT NULL,
+    response_length INTEGER NOT NULL,
+    cache_hit INTEGER NOT NULL,
+    rolled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_requests_raw_ts ON requests_raw (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    request_type TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    cache_hits INTEGER NOT NULL,
+    time_ms_total REAL NOT NULL,
+    response_length_total INTEGER NOT NULL,
+    latency_counts TEXT NOT NULL,
+    PRIMARY KEY (resolution, start, request_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS store_state (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# Записи, еще не учтенные в поминутных агрегатах
+_PENDING_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_requests_raw_pending ON requests_raw (ts) WHERE rolled = 0"
+)
+
+_RAW_COLUMNS = "ts, request_type, success, time_ms, response_length, cache_hit"
+
+RawRow = Tuple[float, str, int, float, int, int]
+
+
+def _align(ts: float, resolution: int) -> int:
+    return int(ts - ts % resolution)
+
+
+class MetricsStore:
+    """
+    Хранилище метрик с пакетной записью и даунсэмплингом
+
+    Все обращения к SQLite выполняются в asyncio.to_thread под одной
+    блокировкой, поэтому event loop не ждет диск. Агрегаты пересчитываются
+    целиком по корзинам с задержкой lag_seconds, так что повторный
+    пересчет той же корзины дает тот же результат. Сырая запись помечается
+    rolled, когда попала в агрегат: запись другого процесса, пришедшая
+    после закрытия своей минуты, пересчитывает эту минуту и ее час.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 5.0,
+        raw_retention_hours: int = 48,
+        minute_retention_days: int = 14,
+        hour_retention_days: int = 365,
+        max_buffer: int = 100_000,
+    ) -> None:
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.raw_retention = raw_retention_hours * HOUR
+        self.minute_retention = minute_retention_days * 86400
+        self.hour_retention = hour_retention_days * 86400
+        self.max_buffer = max_buffer
+        # Запись может попасть в базу через flush_interval после события
+        self.lag_seconds = 2 * flush_interval
+        self._buffer: List[RawRow] = []
+        self._lock = asyncio.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.written = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "MetricsStore":
+        return cls(
+            settings.METRICS_DB_PATH,
+            flush_interval=settings.METRICS_FLUSH_INTERVAL_SECONDS,
+            raw_retention_hours=settings.METRICS_RAW_RETENTION_HOURS,
+            minute_retention_days=settings.METRICS_MINUTE_RETENTION_DAYS,
+            hour_retention_days=settings.METRICS_HOUR_RETENTION_DAYS,
+        )
+
+    # ---- Жизненный цикл ----
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._open)
+        logger.info(f"Хранилище метрик: {self.path}")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(requests_raw)")}
+        if "rolled" not in columns:
+            # База прежней версии: записи до minute_mark уже в агрегатах
+            conn.execute("ALTER TABLE requests_raw ADD COLUMN rolled INTEGER NOT NULL DEFAULT 0")
+            mark = self._get_mark(conn, "minute_mark")
+            if mark is not None:
+                conn.execute("UPDATE requests_raw SET rolled = 1 WHERE ts < ?", (mark,))
+        conn.execute(_PENDING_INDEX)
+        conn.commit()
+        self._conn = conn
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        await self.flush()
+        async with self._lock:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def run_flusher(self) -> None:
+        """Фоновая запись накопленных метрик"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # ---- Запись ----
+
+    def record(
+        self,
+        request_type: str,
+        success: bool,
+        generation_time_ms: float,
+        response_length: int,
+        cache_hit: bool,
+        ts: Optional[float] = None,
+    ) -> None:
+        """Добавить запись в буфер (без обращения к диску)"""
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append((
+            time.time() if ts is None else ts,
+            request_type,
+            int(success),
+            float(generation_time_ms),
+            int(response_length),
+            int(cache_hit),
+        ))
+
+    async def flush(self, now: Optional[float] = None) -> None:
+        """Записать буфер, пересчитать агрегаты и применить сроки хранения"""
+        if self._conn is None:
+            return
+        rows, self._buffer = self._buffer, []
+        now = time.time() if now is None else now
+        async with self._lock:
+            try:
+                await asyncio.to_thread(self._write, rows, now)
+            except sqlite3.Error as exc:
+                self.dropped += len(rows)
+                logger.error(f"Ошибка записи метрик в {self.path}: {exc}")
+            else:
+                self.written += len(rows)
+
+    def _write(self, rows: List[RawRow], now: float) -> None:
+        conn = self._conn
+        with conn:
+            # Пересчет агрегатов не должен пересекаться с записью других процессов
+            conn.execute("BEGIN IMMEDIATE")
+            if rows:
+                conn.executemany(
+                    f"INSERT INTO requests_raw ({_RAW_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+            minute_mark, late_minutes = self._rollup_minutes(conn, now)
+            self._rollup_hours(conn, minute_mark, late_minutes)
+            conn.execute("DELETE FROM requests_raw WHERE ts < ?", (now - self.raw_retention,))
+            conn.execute(
+                "DELETE FROM rollups WHERE resolution = ? AND start < ?",
+                (MINUTE, now - self.minute_retention),
+            )
+            conn.execute(
+                "DELETE FROM rollups WHERE resolution = ? AND start < ?",
+                (HOUR, now - self.hour_retention),
+            )
+
+    # ---- Даунсэмплинг ----
+
+    @staticmethod
+    def _get_mark(conn: sqlite3.Connection, name: str) -> Optional[int]:
+        row = conn.execute("SELECT value FROM store_state WHERE name = ?", (name,)).fetchone()
+        return int(row[0]) if row else None
+
+    @staticmethod
+    def _set_mark(conn: sqlite3.Connection, name: str, value: int) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO store_state (name, value) VALUES (?, ?)", (name, value)
+        )
+
+    def _rollup_minutes(self, conn: sqlite3.Connection, now: float) -> Tuple[int, Set[int]]:
+        """
+        Сырые записи -> поминутные агрегаты
+
+        Пересчитываются все минуты до конца закрытого диапазона, где есть
+        неучтенные записи, включая опоздавшие записи до minute_mark.
+
+        Returns:
+            Начало первой незакрытой минуты и минуты, пересчитанные задним числом
+        """
+        end = _align(now - self.lag_seconds, MINUTE)
+        mark = self._get_mark(conn, "minute_mark")
+        if mark is None:
+            first = conn.execute("SELECT MIN(ts) FROM requests_raw").fetchone()[0]
+            mark = _align(first, MINUTE) if first is not None else end
+        end = max(end, mark)
+
+        minutes = {
+            row[0]
+            for row in conn.execute(
+                "SELECT DISTINCT CAST(ts AS INTEGER) / ? * ? FROM requests_raw WHERE rolled = 0 AND ts < ?",
+                (MINUTE, MINUTE, end),
+            )
+        }
+        if minutes:
+            # Минута пересчитывается по всем своим записям, учтенным и новым
+            buckets: Dict[Tuple[int, str], RollupBucket] = {}
+            for ts, request_type, success, time_ms, length, cache_hit in conn.execute(
+                f"SELECT {_RAW_COLUMNS} FROM requests_raw WHERE ts >= ? AND ts < ?",
+                (min(minutes), end),
+            ):
+                start = _align(ts, MINUTE)
+                if start not in minutes:
+                    continue
+                bucket = buckets.get((start, request_type))
+                if bucket is None:
+                    bucket = buckets[(start, request_type)] = RollupBucket(start)
+                bucket.add(request_type, bool(success), time_ms, length, bool(cache_hit))
+
+            self._replace_rollups(conn, MINUTE, minutes, buckets)
+            conn.execute("UPDATE requests_raw SET rolled = 1 WHERE rolled = 0 AND ts < ?", (end,))
+        self._set_mark(conn, "minute_mark", end)
+        return end, {minute for minute in minutes if minute < mark}
+
+    def _rollup_hours(self, conn: sqlite3.Connection, minute_mark: int, late_minutes: Set[int]) -> None:
+        """
+        Поминутные агрегаты -> почасовые, только для полностью закрытых часов
+
+        Уже закрытые часы с минутами, пересчитанными задним числом, пересчитываются.
+        """
+        end = _align(minute_mark, HOUR)
+        mark = self._get_mark(conn, "hour_mark")
+        if mark is None:
+            first = conn.execute(
+                "SELECT MIN(start) FROM rollups WHERE resolution = ?", (MINUTE,)
+            ).fetchone()[0]
+            mark = _align(first, HOUR) if first is not None else end
+        end = max(end, mark)
+
+        hours = set(range(mark, end, HOUR))
+        hours.update(_align(minute, HOUR) for minute in late_minutes if minute < mark)
+        if not hours:
+            return
+
+        buckets: Dict[Tuple[int, str], RollupBucket] = {}
+        for row in conn.execute(
+            "SELECT * FROM rollups WHERE resolution = ? AND start >= ? AND start < ?",
+            (MINUTE, min(hours), end),
+        ):
+            minute = self._bucket_from_row(row)
+            start = _align(minute.start, HOUR)
+            if start not in hours:
+                continue
+            bucket = buckets.get((start, row[2]))
+            if bucket is None:
+                bucket = buckets[(start, row[2])] = RollupBucket(start)
+            bucket.merge(minute)
+
+        self._replace_rollups(conn, HOUR, hours, buckets)
+        self._set_mark(conn, "hour_mark", end)
+
+    @staticmethod
+    def _replace_rollups(
+        conn: sqlite3.Connection,
+        resolution: int,
+        starts: Iterable[int],
+        buckets: Dict[Tuple[int, str], RollupBucket],
+    ) -> None:
+        conn.executemany(
+            "DELETE FROM rollups WHERE resolution = ? AND start = ?",
+            [(resolution, start) for start in starts],
+        )
+        conn.executemany(
+            "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    resolution,
+                    bucket_start,
+                    request_type,
+                    bucket.requests,
+                    bucket.errors,
+                    bucket.cache_hits,
+                    bucket.latency_total_ms[request_type],
+                    bucket.response_length_total,
+                    json.dumps(bucket.latency_counts[request_type]),
+                )
+                for (bucket_start, request_type), bucket in buckets.items()
+            ],
+        )
+
+    @staticmethod
+    def _bucket_from_row(row: Tuple[Any, ...]) -> RollupBucket:
+        _, start, request_type, requests, errors, cache_hits, time_total, length_total, counts = row
+        bucket = RollupBucket(start)
+        bucket.requests = requests
+        bucket.errors = errors
+        bucket.cache_hits = cache_hits
+        bucket.response_length_total = length_total
+        bucket.by_type[request_type] = requests
+        if errors:
+            bucket.errors_by_type[request_type] = errors
+        bucket.latency_total_ms[request_type] = time_total
+        bucket.latency_counts[request_type] = {int(k): v for k, v in json.loads(counts).items()}
+        return bucket
+
+    # ---- Чтение ----
+
+    async def summary(self, hours: int = 24, now: Optional[float] = None) -> Dict[str, Any]:
+        """Сводная статистика за последние hours часов (формат /metrics/summary)"""
+        await self.flush(now)
+        now = time.time() if now is None else now
+        async with self._lock:
+            total, resolution = await asyncio.to_thread(self._query, hours * HOUR, now)
+        return summarize_bucket(total, hours, resolution)
+
+    def _query(self, seconds: int, now: float) -> Tuple[RollupBucket, int]:
+        """
+        Агрегат за период по индексированным диапазонам: самые крупные
+        подходящие агрегаты, затем поминутные и сырые записи за хвост
+        """
+        conn = self._conn
+        cutoff = now - seconds
+        total = RollupBucket(cutoff)
+        minute_mark = self._get_mark(conn, "minute_mark") or _align(now, MINUTE)
+        hour_mark = self._get_mark(conn, "hour_mark") or _align(minute_mark, HOUR)
+
+        # Корзина, пересекающая начало периода, учитывается целиком
+        if seconds > self.minute_retention:
+            resolution = HOUR
+            minute_from = max(_align(cutoff, MINUTE), hour_mark)
+            self._merge_rollups(conn, total, HOUR, _align(cutoff, HOUR), hour_mark)
+        else:
+            resolution = MINUTE
+            minute_from = _align(cutoff, MINUTE)
+        self._merge_rollups(conn, total, MINUTE, minute_from, minute_mark)
+
+        # Неучтенные записи, в том числе опоздавшие до minute_mark
+        for ts, request_type, success, time_ms, length, cache_hit in conn.execute(
+            f"SELECT {_RAW_COLUMNS} FROM requests_raw WHERE rolled = 0 AND ts >= ?", (cutoff,)
+        ):
+            total.add(request_type, bool(success), time_ms, length, bool(cache_hit))
+        return total, resolution
+
+    def _merge_rollups(
+        self,
+        conn: sqlite3.Connection,
+        total: RollupBucket,
+        resolution: int,
+        start: float,
+        end: float,
+    ) -> None:
+        for row in conn.execute(
+            "SELECT * FROM rollups WHERE resolution = ? AND start >= ? AND start < ?",
+            (resolution, start, end),
+        ):
+            total.merge(self._bucket_from_row(row))
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
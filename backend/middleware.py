@@ -1,28 +1,49 @@
 """
 Middleware для FastAPI приложения
 """
+import random
 import time
 import json
+import uuid
 from typing import Callable, Dict, Any
 from fastapi import Request, Response
 from fastapi.responses import JSONResponse
 from loguru import logger
 
+from config import get_settings
+from deadlines import DEADLINE_HEADER, deadline_seconds, deadline_var
+from logging_config import request_id_var
+from metrics import metrics_collector
+
+settings = get_settings()
+
+
+def _route_label(request: Request) -> str:
+    """Шаблон маршрута для меток метрик (без подстановки параметров пути)"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
 
 async def log_requests(request: Request, call_next) -> Response:
     """
     Middleware для логирования всех запросов
+    
+    Успешные быстрые запросы попадают в info-лог с вероятностью
+    LOG_REQUEST_SAMPLE_RATE, ошибки и медленные запросы — всегда.
     """
     start_time = time.time()
     
-    # Логируем входящий запрос
-    request_id = request.headers.get("X-Request-ID", "unknown")
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    # Каждый запрос обрабатывается в своей задаче, сбрасывать значение не нужно
+    request_id_var.set(request_id)
+    request.state.request_id = request_id
+    deadline_var.set(
+        time.monotonic()
+        + deadline_seconds(request.url.path, request.headers.get(DEADLINE_HEADER), settings)
+    )
     client_ip = request.client.host if request.client else "unknown"
     
-    logger.info(
-        f"← [{request_id}] {request.method} {request.url.path} "
-        f"from {client_ip}"
-    )
+    logger.debug(f"← {request.method} {request.url.path} from {client_ip}")
     
     # Обрабатываем запрос
     try:
@@ -30,18 +51,27 @@ async def log_requests(request: Request, call_next) -> Response:
     except Exception as exc:
         # Логируем необработанные исключения
         process_time = time.time() - start_time
+        metrics_collector.record_http_request(_route_label(request), request.method, 500, process_time)
         logger.error(
-            f"✗ [{request_id}] {request.method} {request.url.path} "
+            f"✗ {request.method} {request.url.path} "
             f"failed in {process_time:.3f}s: {exc}"
         )
         raise
     
     # Логируем результат
     process_time = time.time() - start_time
-    logger.info(
-        f"→ [{request_id}] {request.method} {request.url.path} "
-        f"{response.status_code} in {process_time:.3f}s"
+    metrics_collector.record_http_request(
+        _route_label(request), request.method, response.status_code, process_time
     )
+    if (
+        response.status_code >= 400
+        or process_time >= settings.LOG_SLOW_REQUEST_SECONDS
+        or random.random() < settings.LOG_REQUEST_SAMPLE_RATE
+    ):
+        logger.info(
+            f"→ {request.method} {request.url.path} from {client_ip} "
+            f"{response.status_code} in {process_time:.3f}s"
+        )
     
     # Добавляем метаданные в заголовки
     response.headers["X-Process-Time"] = f"{process_time:.3f}"
@@ -54,7 +84,7 @@ def exception_handler(request: Request, exc: Exception) -> JSONResponse:
     """
     Глобальный обработчик исключений
     """
-    request_id = request.headers.get("X-Request-ID", "unknown")
+    request_id = getattr(request.state, "request_id", None) or request_id_var.get()
     
     # Определяем статус код на основе типа исключения
     if isinstance(exc, ValueError):
@@ -68,7 +98,7 @@ def exception_handler(request: Request, exc: Exception) -> JSONResponse:
     
     # Логируем ошибку
     logger.error(
-        f"⚠ [{request_id}] Exception in {request.method} {request.url.path}: "
+        f"⚠ Exception in {request.method} {request.url.path}: "
         f"{type(exc).__name__}: {exc}"
     )
     
@@ -1,3 +1,4 @@
+import json
 from typing import Any
 
 import yaml
@@ -5,7 +6,6 @@ from pydantic import BaseModel, Field
 
 from loguru import logger
 
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
 
 class OpenAPIParameter(BaseModel):
     name: str
@@ -18,6 +18,7 @@ class OpenAPIEndpoint(BaseModel):
     path: str
     method: str
     summary: str | None = None
+    tags: list[str] = []
     parameters: list[OpenAPIParameter] = []
     request_body: dict[str, Any] | None = None
     responses: dict[str, Any] | None = None
@@ -31,6 +32,11 @@ def _normalize_spec(spec: Any) -> dict[str, Any]:
     raise ValueError("Unsupported OpenAPI spec type")
 
 
+def load_spec(spec: Any) -> dict[str, Any]:
+    """Разбирает спецификацию (YAML/JSON строка или dict) в словарь"""
+    return _normalize_spec(spec)
+
+
 def extract_endpoints(spec: Any) -> list[OpenAPIEndpoint]:
     data = _normalize_spec(spec)
     paths = data.get("paths", {}) or {}
@@ -46,9 +52,142 @@ def extract_endpoints(spec: Any) -> list[OpenAPIEndpoint]:
                 path=path,
                 method=method.upper(),
                 summary=meta.get("summary"),
+                tags=meta.get("tags", []) or [],
                 parameters=params,
                 request_body=meta.get("requestBody"),
                 responses=meta.get("responses"),
             )
             result.append(endpoint)
     return result
+
+
+# Поля, которые удаляются из контекста промпта первыми при превышении бюджета
+_EXAMPLE_KEYS = {"example", "examples"}
+_DESCRIPTION_KEYS = {"description", "externalDocs"}
+_DESCRIPTION_SHORT_LIMIT = 160
+
+
+class RefResolver:
+    """
+    Разрешение локальных $ref (#/components/...) с мемоизацией
+
+    Ссылки разрешаются транзитивно; циклические и внешние ссылки
+    остаются в виде {"$ref": ...}.
+    """
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.data = data
+        self._resolved: dict[str, Any] = {}
+
+    def resolve(self, node: Any, _stack: tuple[str, ...] = ()) -> Any:
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str):
+                return self._resolve_ref(ref, _stack)
+            return {key: self.resolve(value, _stack) for key, value in node.items()}
+        if isinstance(node, list):
+            return [self.resolve(item, _stack) for item in node]
+        return node
+
+    def _resolve_ref(self, ref: str, stack: tuple[str, ...]) -> Any:
+        if ref in stack or not ref.startswith("#/"):
+            return {"$ref": ref}
+        if ref in self._resolved:
+            return self._resolved[ref]
+
+        target: Any = self.data
+        for part in ref[2:].split("/"):
+            part = part.replace("~1", "/").replace("~0", "~")
+            if not isinstance(target, dict) or part not in target:
+                logger.warning(f"Не удалось разрешить ссылку {ref}")
+                return {"$ref": ref}
+            target = target[part]
+
+        resolved = self.resolve(target, stack + (ref,))
+        self._resolved[ref] = resolved
+        return resolved
+
+
+def _prune(node: Any, drop: set[str], shorten: bool = False) -> Any:
+    """Удаляет ключи drop (и x-* расширения), при shorten укорачивает описания"""
+    if isinstance(node, dict):
+        result = {}
+        for key, value in node.items():
+            if key in drop or key.startswith("x-"):
+                continue
+            if shorten and key in _DESCRIPTION_KEYS and isinstance(value, str):
+                result[key] = value[:_DESCRIPTION_SHORT_LIMIT]
+                continue
+            if key == "properties" and isinstance(value, dict):
+                # Имена свойств схемы — данные, а не служебные ключи
+                result[key] = {name: _prune(schema, drop, shorten) for name, schema in value.items()}
+                continue
+            result[key] = _prune(value, drop, shorten)
+        return result
+    if isinstance(node, list):
+        return [_prune(item, drop, shorten) for item in node]
+    return node
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def build_endpoint_context(
+    data: dict[str, Any],
+    method: str,
+    path: str,
+    max_chars: int = 6000,
+    resolver: RefResolver | None = None,
+) -> str:
+    """
+    Собирает компактный JSON-контекст одной операции для промпта
+
+    В контекст попадают операция с параметрами уровня пути, раскрытые $ref,
+    используемые схемы безопасности и servers. Если результат больше
+    max_chars, сначала удаляются примеры, затем укорачиваются и удаляются
+    описания, и только потом текст обрезается.
+    """
+    path_item = (data.get("paths", {}) or {}).get(path)
+    operation = (path_item or {}).get(method.lower())
+    if operation is None:
+        raise ValueError("Endpoint not found in OpenAPI spec")
+
+    resolver = resolver or RefResolver(data)
+    operation = dict(operation)
+
+    # Параметры уровня пути наследуются операцией, если не переопределены
+    path_params = path_item.get("parameters") or []
+    if path_params:
+        own = {
+            (p.get("name"), p.get("in"))
+            for p in resolver.resolve(operation.get("parameters") or [])
+        }
+        inherited = [p for p in resolver.resolve(path_params) if (p.get("name"), p.get("in")) not in own]
+        operation["parameters"] = inherited + list(operation.get("parameters") or [])
+
+    context: dict[str, Any] = {
+        "openapi": data.get("openapi") or data.get("swagger"),
+        "method": method.upper(),
+        "path": path,
+        "operation": resolver.resolve(operation),
+    }
+    if data.get("servers"):
+        context["servers"] = data["servers"]
+
+    security = operation.get("security", data.get("security")) or []
+    schemes = ((data.get("components") or {}).get("securitySchemes")) or {}
+    used = {name for requirement in security for name in requirement}
+    if used:
+        context["securitySchemes"] = resolver.resolve({n: schemes[n] for n in used if n in schemes})
+
+    text = _compact_json(context)
+    for drop, shorten in ((_EXAMPLE_KEYS, False), (_EXAMPLE_KEYS, True), (_EXAMPLE_KEYS | _DESCRIPTION_KEYS, False)):
+        if len(text) <= max_chars:
+            break
+        text = _compact_json(_prune(context, drop, shorten))
+
+    if len(text) > max_chars:
+        logger.warning(f"Контекст {method.upper()} {path} обрезан до {max_chars} символов")
+        text = text[:max_chars]
+    return text
@@ -161,7 +161,7 @@ class PromptTemplates:
 - Путь: {path}
 - Описание: {summary}
 
-OPENAPI СПЕЦИФИКАЦИЯ:
+OPENAPI СПЕЦИФИКАЦИЯ ЭНДПОИНТА (JSON, $ref раскрыты):
 {{openapi_spec}}
 
 ТРЕБОВАНИЯ К ТЕСТУ:
@@ -311,6 +311,38 @@ OPENAPI СПЕЦИФИКАЦИЯ:
             description="Валидация Python кода тестов"
         )
 
+    
+    @staticmethod
+    def code_repair() -> PromptTemplate:
+        """Шаблон для исправления замечаний валидатора в сгенерированном коде"""
+        return PromptTemplate(
+            system_role=(
+                PromptTemplates.get_system_role() + " "
+                "Сейчас ты исправляешь замечания статической проверки в своем коде, "
+                "ничего не меняя сверх необходимого."
+            ),
+            user_template="""Исправь фрагмент Python кода тестов.
+
+ЗАМЕЧАНИЯ ВАЛИДАТОРА:
+{issues}
+
+ФРАГМЕНТ (строки {start_line}-{end_line} файла):
+```python
+{snippet}
+```
+
+ТРЕБОВАНИЯ:
+1. Исправь только перечисленные замечания
+2. Шаги оформляются через with allure.step("Arrange"), with allure.step("Act"), with allure.step("Assert")
+3. Сохрани отступы фрагмента и не добавляй код за его пределами
+4. Не добавляй пояснений
+
+ВЕРНИ ТОЛЬКО ИСПРАВЛЕННЫЙ ФРАГМЕНТ ЦЕЛИКОМ В БЛОКЕ ```python```.""",
+            temperature=0.1,
+            max_tokens=3500,
+            description="Исправление замечаний валидатора"
+        )
+
 
 # Экспорт удобных функций
 def get_testcase_prompt(
@@ -370,4 +402,28 @@ def get_ui_autotest_prompt(
         "system_role": template.system_role
     }
     
-    return prompt, params
\ No newline at end of file
+    return prompt, params
+
+
+def get_repair_prompt(
+    issues: str,
+    snippet: str,
+    start_line: int,
+    end_line: int,
+) -> tuple[str, Dict[str, Any]]:
+    """Получить промпт для исправления фрагмента кода"""
+    template = PromptTemplates.code_repair()
+    
+    prompt = template.user_template.format(
+        issues=issues,
+        snippet=snippet,
+        start_line=start_line,
+        end_line=end_line,
+    )
+    params = {
+        "temperature": template.temperature,
+        "max_tokens": template.max_tokens,
+        "system_role": template.system_role
+    }
+    
+    return prompt, params
@@ -0,0 +1,254 @@
+"""
+Ограничение нагрузки на LLM: RPM/TPM и адаптивный лимит параллельности
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Optional
+
+import openai
+from loguru import logger
+
+
+class TokenBucket:
+    """Ведро токенов с пополнением rate_per_minute в минуту"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Списать amount и вернуть, сколько секунд ждать до его появления
+
+        Баланс может уйти в минус: следующие запросы ждут дольше, поэтому
+        очередь обслуживается по порядку без повторных проверок.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Задержка из заголовков Retry-After / retry-after-ms ответа провайдера"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_overload(exc: BaseException) -> bool:
+    """Признак перегрузки провайдера: 429 или таймаут"""
+    return isinstance(exc, (openai.RateLimitError, openai.APITimeoutError, asyncio.TimeoutError))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return isinstance(
+        exc,
+        (
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+class RateLimiter:
+    """
+    Клиентский ограничитель запросов к LLM
+
+    Перед запросом резервируются запрос в ведре RPM и оценка токенов в
+    ведре TPM, затем занимается слот параллельности. Лимит параллельности
+    меняется по AIMD: +1/limit за успешный ответ, x decrease_factor на
+    429 или таймаут (не чаще раза за cooldown_seconds). Retry-After из
+    ответа провайдера приостанавливает все новые запросы.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 120,
+        tokens_per_minute: int = 0,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        decrease_factor: float = 0.5,
+        cooldown_seconds: float = 2.0,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        self.throttled = 0
+        self.wait_seconds_total = 0.0
+        self.acquired = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "RateLimiter":
+        # Лимиты заданы на под; процессы uvicorn не обмениваются состоянием,
+        # поэтому каждый получает равную долю
+        processes = max(settings.WEB_CONCURRENCY, 1)
+
+        def share(limit: int) -> int:
+            return max(limit // processes, 1) if limit else 0
+
+        max_concurrency = share(settings.LLM_CONCURRENCY_MAX)
+        return cls(
+            requests_per_minute=share(settings.LLM_RATE_LIMIT_RPM),
+            tokens_per_minute=share(settings.LLM_RATE_LIMIT_TPM),
+            initial_concurrency=min(share(settings.LLM_CONCURRENCY_INITIAL), max_concurrency),
+            min_concurrency=min(settings.LLM_CONCURRENCY_MIN, max_concurrency),
+            max_concurrency=max_concurrency,
+        )
+
+    @asynccontextmanager
+    async def slot(
+        self, estimated_tokens: int = 0, timeout: Optional[float] = None
+    ) -> AsyncIterator[float]:
+        """
+        Занять слот запроса; возвращает время ожидания в секундах
+
+        Если ожидание отменено или не уложилось в timeout, резерв RPM и TPM
+        возвращается в ведра.
+
+        Raises:
+            asyncio.TimeoutError: слот не получен за timeout секунд
+        """
+        started = time.monotonic()
+        self.waiting += 1
+        reserved_requests = reserved_tokens = 0.0
+        acquired = False
+
+        async def acquire(delay: float) -> None:
+            nonlocal acquired
+            if delay:
+                await asyncio.sleep(delay)
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+                self.in_flight += 1
+                acquired = True
+
+        try:
+            delay = max(self.blocked_until - started, 0.0)
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1))
+                reserved_requests = 1
+            if self.tokens is not None and estimated_tokens:
+                delay = max(delay, self.tokens.reserve(estimated_tokens))
+                reserved_tokens = min(estimated_tokens, self.tokens.capacity)
+            if timeout is None:
+                await acquire(delay)
+            elif delay >= timeout:
+                # Резерв ведер заведомо не успевает: не занимаем очередь зря
+                raise asyncio.TimeoutError()
+            else:
+                await asyncio.wait_for(acquire(delay), timeout)
+        finally:
+            self.waiting -= 1
+            if not acquired:
+                if reserved_requests:
+                    self.requests.refund(reserved_requests)
+                if reserved_tokens:
+                    self.tokens.refund(reserved_tokens)
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.wait_seconds_total += waited
+        try:
+            yield waited
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def congested(self) -> bool:
+        """Есть очередь на слоты или действует пауза по Retry-After"""
+        return self.waiting > 0 or self.blocked_until > time.monotonic()
+
+    def refund_tokens(self, amount: float) -> None:
+        """Вернуть в ведро TPM разницу между оценкой и фактическим расходом"""
+        if self.tokens is not None and amount > 0:
+            self.tokens.refund(amount)
+
+    async def on_success(self) -> None:
+        previous = int(self.limit)
+        self.limit = min(self.limit + 1 / self.limit, float(self.max_concurrency))
+        if int(self.limit) > previous:
+            # Ожидающие слота просыпаются сразу, а не при следующем освобождении
+            async with self._condition:
+                self._condition.notify_all()
+
+    def on_error(self, exc: BaseException) -> Optional[float]:
+        """
+        Учесть ошибку запроса
+
+        Returns:
+            Задержка из Retry-After, если провайдер ее указал
+        """
+        retry_after = retry_after_seconds(exc)
+        now = time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if is_overload(exc):
+            self.throttled += 1
+            if now - self._last_decrease >= self.cooldown_seconds:
+                self._last_decrease = now
+                self.limit = max(self.limit * self.decrease_factor, float(self.min_concurrency))
+                logger.warning(f"Перегрузка LLM, лимит параллельности снижен до {int(self.limit)}")
+        return retry_after
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "throttled": self.throttled,
+            "acquired": self.acquired,
+            "avg_wait_seconds": self.wait_seconds_total / self.acquired if self.acquired else 0.0,
+            "blocked_for_seconds": max(self.blocked_until - time.monotonic(), 0.0),
+        }
+
+
+def backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
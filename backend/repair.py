@@ -0,0 +1,168 @@
+"""
+Цикл генерация -> валидация -> исправление сгенерированного кода
+"""
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from loguru import logger
+
+from config import get_settings
+from llm_client import llm_client
+from metrics import metrics_collector
+from prompt_templates import get_repair_prompt
+from schemas import ValidationIssue, ValidationReport
+from tokens import estimate_tokens
+from validation_pool import validation_pool
+
+# Строк контекста вокруг замечания во фрагменте для исправления
+SNIPPET_CONTEXT_LINES = 6
+
+# Лимит ответа: исправленный фрагмент с запасом на рост и обрамление
+REPAIR_OUTPUT_FACTOR = 2
+REPAIR_OUTPUT_EXTRA_TOKENS = 128
+
+
+@dataclass
+class RepairResult:
+    """Итог цикла исправления"""
+    code: str
+    report: ValidationReport
+    rounds: int = 0
+    tokens_spent: int = 0
+    # valid | max_rounds | time_budget | token_budget | llm_error | no_progress
+    outcome: str = "valid"
+    history: list = field(default_factory=list)
+
+
+def _extract_code(text: str) -> str:
+    matches = re.findall(r"```(?:python)?\n?(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    return matches[0].rstrip() if matches else text.strip()
+
+
+def repairable_issues(report: ValidationReport, warning_codes: set) -> list[ValidationIssue]:
+    """Замечания, ради которых стоит еще раз обращаться к модели"""
+    return [
+        issue for issue in report.issues
+        if issue.severity == "error" or issue.code in warning_codes
+    ]
+
+
+def _snippet_bounds(lines: list[str], issues: list[ValidationIssue]) -> tuple[int, int]:
+    """
+    Диапазон строк [start, end) для исправления
+
+    Если у какого-то замечания нет номера строки (оно про модуль целиком),
+    исправляется весь файл.
+    """
+    if any(issue.line is None for issue in issues):
+        return 0, len(lines)
+    start = max(min(issue.line for issue in issues) - 1 - SNIPPET_CONTEXT_LINES, 0)
+    end = min(max(issue.line for issue in issues) + SNIPPET_CONTEXT_LINES, len(lines))
+    return start, end
+
+
+def _format_issues(issues: list[ValidationIssue]) -> str:
+    return "\n".join(
+        f"- [{issue.severity}] "
+        + (f"строка {issue.line}: " if issue.line is not None else "")
+        + f"{issue.code}: {issue.message}"
+        for issue in issues
+    )
+
+
+async def repair_code(
+    code: str,
+    request_type: str,
+    started: Optional[float] = None,
+    max_rounds: Optional[int] = None,
+    time_budget_seconds: Optional[float] = None,
+    token_budget: Optional[int] = None,
+) -> RepairResult:
+    """
+    Проверить код и при замечаниях попросить модель исправить только их
+
+    В модель уходят только замечания и фрагмент кода вокруг них; исправленный
+    фрагмент вставляется обратно. Цикл ограничен числом раундов, временем с
+    момента started и оценкой потраченных токенов.
+    """
+    settings = get_settings()
+    started = started or time.monotonic()
+    max_rounds = settings.REPAIR_MAX_ROUNDS if max_rounds is None else max_rounds
+    time_budget_seconds = time_budget_seconds or settings.REPAIR_TIME_BUDGET_SECONDS
+    token_budget = token_budget or settings.REPAIR_TOKEN_BUDGET
+    warning_codes = {c.strip() for c in settings.REPAIR_WARNING_CODES.split(",") if c.strip()}
+
+    report = await validation_pool.validate(code)
+    result = RepairResult(code=code, report=report)
+    last_round_seconds = 0.0
+
+    while True:
+        issues = repairable_issues(result.report, warning_codes)
+        if not issues:
+            result.outcome = "valid"
+            break
+        if result.rounds >= max_rounds:
+            result.outcome = "max_rounds"
+            break
+        if time.monotonic() - started + last_round_seconds > time_budget_seconds:
+            result.outcome = "time_budget"
+            break
+
+        lines = result.code.splitlines()
+        start, end = _snippet_bounds(lines, issues)
+        prompt, params = get_repair_prompt(
+            issues=_format_issues(issues),
+            snippet="\n".join(lines[start:end]),
+            start_line=start + 1,
+            end_line=end,
+        )
+        # Ответ примерно того же размера, что и фрагмент
+        snippet_tokens = estimate_tokens("\n".join(lines[start:end]))
+        prompt_tokens = estimate_tokens(prompt) + estimate_tokens(params["system_role"])
+        round_tokens = prompt_tokens + snippet_tokens
+        if result.tokens_spent + round_tokens > token_budget:
+            result.outcome = "token_budget"
+            break
+
+        round_started = time.monotonic()
+        try:
+            raw = await llm_client.generate(
+                prompt=prompt,
+                system_prompt=params["system_role"],
+                use_cache=True,
+                validate=False,
+                template="repair",
+                fallback=False,
+                temperature=params["temperature"],
+                max_tokens=min(
+                    params["max_tokens"],
+                    snippet_tokens * REPAIR_OUTPUT_FACTOR + REPAIR_OUTPUT_EXTRA_TOKENS,
+                ),
+            )
+        except Exception as e:
+            logger.warning(f"Исправление кода прервано ошибкой модели: {e}")
+            result.outcome = "llm_error"
+            break
+        last_round_seconds = time.monotonic() - round_started
+        result.rounds += 1
+        result.tokens_spent += prompt_tokens + estimate_tokens(raw)
+
+        fixed = _extract_code(raw).splitlines()
+        candidate = "\n".join(lines[:start] + fixed + lines[end:]) + "\n"
+        candidate_report = await validation_pool.validate(candidate)
+        result.history.append([issue.code for issue in issues])
+        if len(repairable_issues(candidate_report, warning_codes)) >= len(issues):
+            # Исправление не помогло — оставляем предыдущую версию
+            logger.info(f"Раунд исправления {result.rounds} не уменьшил число замечаний")
+            result.outcome = "no_progress"
+            break
+        result.code, result.report = candidate, candidate_report
+
+    metrics_collector.record_repair(request_type, result.rounds, result.outcome)
+    logger.info(
+        f"Исправление {request_type}: раундов {result.rounds}, "
+        f"итог {result.outcome}, ~{result.tokens_spent} токенов"
+    )
+    return result
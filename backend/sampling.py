@@ -0,0 +1,148 @@
+"""
+Best-of-N: несколько параллельных вариантов ответа с ранним выходом по валидатору
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from loguru import logger
+
+from config import get_settings
+from llm_client import llm_client
+from metrics import metrics_collector
+from prompt_templates import TestPriority
+from schemas import ValidationReport
+from validation_pool import validation_pool
+
+
+@dataclass
+class SamplingResult:
+    """Выбранный вариант best-of-N"""
+    code: str
+    report: ValidationReport
+    samples: int = 0  # запущено вариантов
+    completed: int = 0  # завершено до выбора результата
+    winner: int = 0  # номер выбранного варианта
+    # valid | best_effort | deadline
+    outcome: str = "valid"
+
+
+def parse_priority_map(value: str) -> Dict[TestPriority, float]:
+    """Разбор настройки вида "CRITICAL=4,HIGH=3" в словарь по приоритету"""
+    result: Dict[TestPriority, float] = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, number = item.partition("=")
+        result[TestPriority(name.strip().upper())] = float(number)
+    return result
+
+
+def sampling_plan(priority: TestPriority, settings=None) -> tuple[int, float]:
+    """Число вариантов и дедлайн в секундах для приоритета"""
+    settings = settings or get_settings()
+    samples = parse_priority_map(settings.BEST_OF_N_SAMPLES).get(priority, 1)
+    deadline = parse_priority_map(settings.BEST_OF_N_DEADLINE_SECONDS).get(
+        priority, settings.LLM_TIMEOUT_SECONDS
+    )
+    return max(int(samples), 1), deadline
+
+
+def _score(report: ValidationReport) -> tuple[int, int]:
+    """Меньше — лучше: сначала ошибки, затем предупреждения"""
+    errors = sum(issue.severity == "error" for issue in report.issues)
+    return errors, len(report.issues) - errors
+
+
+async def generate_best_of_n(
+    prompt: str,
+    params: Dict[str, Any],
+    priority: TestPriority,
+    template: str,
+    finalize: Callable[[str], str],
+    request_type: str,
+    samples: Optional[int] = None,
+    deadline_seconds: Optional[float] = None,
+) -> SamplingResult:
+    """
+    Запустить N вариантов генерации и вернуть первый валидный
+
+    Варианты отличаются температурой и seed. Каждый ответ проверяется
+    валидатором по мере поступления; первый без ошибок возвращается сразу,
+    остальные запросы отменяются. Если к дедлайну валидного нет, возвращается
+    лучший из завершенных.
+
+    Raises:
+        Exception: ни один вариант не завершился успешно
+    """
+    settings = get_settings()
+    planned_samples, planned_deadline = sampling_plan(priority, settings)
+    samples = samples or planned_samples
+    deadline_seconds = deadline_seconds or planned_deadline
+    base_temperature = params.get("temperature", settings.LLM_TEMPERATURE)
+
+    async def run_sample(index: int) -> tuple[int, str, ValidationReport]:
+        temperature = round(min(
+            base_temperature + index * settings.BEST_OF_N_TEMPERATURE_STEP,
+            settings.BEST_OF_N_MAX_TEMPERATURE,
+        ), 2)
+        raw = await llm_client.generate(
+            prompt=prompt,
+            system_prompt=params.get("system_role"),
+            # Первый вариант совпадает с обычной генерацией и может прийти из кэша
+            use_cache=index == 0,
+            validate=True,
+            template=template,
+            fallback=False,
+            temperature=temperature,
+            max_tokens=params.get("max_tokens"),
+            seed=index or None,
+        )
+        code = finalize(raw)
+        return index, code, await validation_pool.validate(code)
+
+    started = time.monotonic()
+    tasks = [asyncio.create_task(run_sample(index)) for index in range(samples)]
+    result: Optional[SamplingResult] = None
+    completed = 0
+    last_error: Optional[BaseException] = None
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=deadline_seconds):
+            try:
+                index, code, report = await next_done
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning(f"Вариант best-of-N завершился ошибкой: {e}")
+                continue
+            completed += 1
+            if result is None or _score(report) < _score(result.report):
+                result = SamplingResult(code=code, report=report, winner=index, outcome="best_effort")
+            if report.is_valid:
+                result.outcome = "valid"
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"Best-of-N {request_type}: дедлайн {deadline_seconds}с истек")
+        if result is not None:
+            result.outcome = "deadline"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if result is None:
+        metrics_collector.record_best_of_n(request_type, completed, "error")
+        raise last_error or asyncio.TimeoutError(
+            f"Ни один вариант не завершился за {deadline_seconds}с"
+        )
+
+    result.samples, result.completed = samples, completed
+    metrics_collector.record_best_of_n(request_type, completed, result.outcome)
+    logger.info(
+        f"Best-of-N {request_type}: выбран вариант {result.winner} из {samples} "
+        f"({completed} завершено), итог {result.outcome}, "
+        f"{(time.monotonic() - started) * 1000:.1f}ms"
+    )
+    return result
@@ -1,30 +1,90 @@
 from typing import Any, Literal
 from pydantic import BaseModel, Field
 
-from loguru import logger
-
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
 
 class GenerateTestcaseRequest(BaseModel):
     test_type: Literal["ui", "api"] = Field(description="Тип тест-кейса")
     requirements_text: str | None = Field(default=None, description="Текст требований")
     openapi_spec: Any | None = Field(default=None, description="OpenAPI JSON/YAML")
+    priority: Literal["CRITICAL", "HIGH", "NORMAL", "LOW"] | None = Field(
+        default=None,
+        description="Приоритет теста (тег и число вариантов best-of-N), по умолчанию api — CRITICAL, ui — NORMAL",
+    )
+    repair: bool = Field(default=False, description="Исправлять замечания валидатора повторными запросами")
+    best_of_n: bool = Field(default=False, description="Несколько параллельных вариантов, первый валидный побеждает")
+    async_job: bool = Field(default=False, description="Сразу вернуть id задачи, генерацию выполнит воркер")
 
 
 class GenerateCodeResponse(BaseModel):
     code: str
 
 
+class JobInfo(BaseModel):
+    job_id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    attempts: int
+    created_at: str
+    started_at: str | None = None
+    finished_at: str | None = None
+    code: str | None = Field(default=None, description="Результат генерации")
+    error: str | None = None
+
+
 class GenerateAutotestRequest(BaseModel):
     target: Literal["api", "ui"]
     openapi_spec: Any | None = None
+    spec_id: str | None = Field(default=None, description="ID загруженной спецификации")
     method: str | None = None
     path: str | None = None
     scenario: str | None = None
+    repair: bool = Field(default=False, description="Исправлять замечания валидатора повторными запросами")
+    best_of_n: bool = Field(default=False, description="Несколько параллельных вариантов, первый валидный побеждает")
+    async_job: bool = Field(default=False, description="Сразу вернуть id задачи, генерацию выполнит воркер")
+
+
+class GenerateAutotestBatchRequest(BaseModel):
+    openapi_spec: Any | None = Field(default=None, description="OpenAPI JSON/YAML")
+    spec_id: str | None = Field(default=None, description="ID загруженной спецификации")
+    tags: list[str] | None = Field(default=None, description="Только эндпоинты с этими тегами")
+    path_prefix: str | None = Field(default=None, description="Только пути с этим префиксом")
+    methods: list[str] | None = Field(default=None, description="Только эти HTTP методы")
+    concurrency: int | None = Field(default=None, ge=1, description="Число одновременных генераций")
+
+
+class SpecUploadRequest(BaseModel):
+    openapi_spec: Any = Field(description="OpenAPI JSON/YAML")
+
+
+class SpecEndpointInfo(BaseModel):
+    method: str
+    path: str
+    summary: str | None = None
+    tags: list[str] = []
+
+
+class SpecInfo(BaseModel):
+    spec_id: str
+    title: str | None = None
+    version: str | None = None
+    valid: bool
+    validation_error: str | None = None
+    endpoints_count: int
+    endpoints: list[SpecEndpointInfo]
+    created_at: str
 
 
 class ValidateTestcaseRequest(BaseModel):
     code: str
+    incremental: bool = Field(
+        default=True,
+        description="Переразбирать только измененные верхнеуровневые определения",
+    )
+    rules: list[str] | None = Field(default=None, description="Включенные правила, по умолчанию все")
+    execute: Literal["none", "collect", "run"] = Field(
+        default="none",
+        description="Прогнать pytest --collect-only (collect) или сами тесты (run)",
+    )
 
 
 class ValidationIssue(BaseModel):
@@ -35,7 +95,53 @@ class ValidationIssue(BaseModel):
     severity: Literal["error", "warning"]
 
 
+class ExecutionReport(BaseModel):
+    mode: Literal["collect", "run"]
+    status: Literal["ok", "failed", "timeout", "crashed"]
+    exit_code: int | None = None
+    collected: list[str] = Field(default_factory=list)
+    collection_errors: list[dict[str, str]] = Field(default_factory=list)
+    passed: int | None = None
+    failed: int | None = None
+    skipped: int | None = None
+    duration_ms: float | None = None
+    output: str = ""
+
+
 class ValidationReport(BaseModel):
     is_valid: bool
     issues: list[ValidationIssue]
     stats: dict[str, Any]
+    execution: ExecutionReport | None = None
+
+
+class ValidationRuleInfo(BaseModel):
+    name: str
+    description: str
+    node_types: list[str]
+    enabled_by_default: bool
+
+
+class ValidateFile(BaseModel):
+    name: str = Field(description="Имя файла в наборе")
+    code: str
+
+
+class ValidateTestcaseBatchRequest(BaseModel):
+    files: list[ValidateFile] = Field(min_length=1, description="Файлы для валидации")
+    rules: list[str] | None = Field(default=None, description="Включенные правила, по умолчанию все")
+    execute: Literal["none", "collect", "run"] = Field(
+        default="none",
+        description="Прогнать pytest --collect-only (collect) или сами тесты (run)",
+    )
+
+
+class ValidationBatchItem(BaseModel):
+    name: str
+    report: ValidationReport
+
+
+class ValidationBatchReport(BaseModel):
+    is_valid: bool
+    results: list[ValidationBatchItem]
+    stats: dict[str, Any]
@@ -0,0 +1,75 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight)
+"""
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from deadlines import deadline_var, within_deadline
+
+
+class _Call:
+    """Выполняющийся запрос и число ожидающих его вызовов"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Дедупликация одновременных вызовов с одинаковым ключом
+
+    Первый вызов запускает задачу, остальные ждут ее результат. Ошибка
+    задачи получает каждый ожидающий. Отмена одного ожидающего не влияет
+    на остальных; задача отменяется, только когда ее больше никто не ждет.
+
+    Задача выполняется без дедлайна первого вызова: каждый ожидающий ждет
+    ее не дольше своего дедлайна.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполнить fn или присоединиться к уже выполняющемуся вызову
+
+        Returns:
+            tuple: (результат, был_ли_вызов_объединен)
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            context = contextvars.copy_context()
+            context.run(deadline_var.set, None)
+            call = _Call(asyncio.get_running_loop().create_task(fn(), context=context))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finish(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            result = await within_deadline(
+                asyncio.shield(call.task), "Объединенный запрос не завершился до дедлайна"
+            )
+            return result, shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _finish(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Помечаем исключение полученным, даже если ожидающих не осталось
+        if not call.task.cancelled():
+            call.task.exception()
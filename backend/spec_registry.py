@@ -0,0 +1,245 @@
+"""
+Реестр загруженных OpenAPI спецификаций с индексом эндпоинтов
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from config import get_settings
+from openapi_parser import (
+    OpenAPIEndpoint,
+    RefResolver,
+    build_endpoint_context,
+    extract_endpoints,
+    load_spec,
+)
+
+try:
+    from openapi_spec_validator import validate as validate_openapi_spec
+except ImportError:  # старые версии или пакет не установлен
+    try:
+        from openapi_spec_validator import validate_spec as validate_openapi_spec
+    except ImportError:
+        validate_openapi_spec = None
+
+
+@dataclass
+class RegisteredSpec:
+    """Разобранная спецификация с индексом (METHOD, path) -> эндпоинт"""
+    spec_id: str
+    raw: Any
+    data: Dict[str, Any]
+    endpoints: Dict[Tuple[str, str], OpenAPIEndpoint]
+    valid: bool = True
+    validation_error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    _resolver: Optional[RefResolver] = field(default=None, repr=False)
+    _contexts: Dict[Tuple[str, str, int], str] = field(default_factory=dict, repr=False)
+
+    def endpoint_context(self, endpoint: OpenAPIEndpoint, max_chars: int) -> str:
+        """Контекст операции для промпта; $ref и готовые контексты мемоизируются"""
+        key = (endpoint.method.upper(), endpoint.path, max_chars)
+        context = self._contexts.get(key)
+        if context is None:
+            if self._resolver is None:
+                self._resolver = RefResolver(self.data)
+            context = build_endpoint_context(
+                self.data, endpoint.method, endpoint.path, max_chars, self._resolver
+            )
+            self._contexts[key] = context
+        return context
+
+    def get_endpoint(self, method: str, path: str) -> OpenAPIEndpoint:
+        endpoint = self.endpoints.get((method.upper(), path))
+        if endpoint is None:
+            raise ValueError("Endpoint not found in OpenAPI spec")
+        return endpoint
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Краткое описание спецификации для API"""
+        info = self.data.get("info", {}) or {}
+        version = info.get("version")
+        return {
+            "spec_id": self.spec_id,
+            "title": info.get("title"),
+            "version": str(version) if version is not None else None,
+            "valid": self.valid,
+            "validation_error": self.validation_error,
+            "endpoints_count": len(self.endpoints),
+            "endpoints": [
+                {
+                    "method": e.method,
+                    "path": e.path,
+                    "summary": e.summary,
+                    "tags": e.tags,
+                }
+                for e in self.endpoints.values()
+            ],
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+def compute_spec_id(spec: Any) -> str:
+    """Идентификатор спецификации — хэш ее содержимого"""
+    if isinstance(spec, str):
+        content = spec
+    else:
+        content = json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+class SpecRegistry:
+    """
+    LRU реестр спецификаций
+
+    Спецификация разбирается и валидируется один раз при регистрации,
+    повторная регистрация того же содержимого возвращает готовую запись.
+    Если задан store_dir, документы сохраняются в общий каталог, и
+    spec_id, загруженный через другой воркер, находится по файлу.
+    """
+
+    def __init__(self, max_entries: int = 64, strict: bool = False, store_dir: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.strict = strict
+        self.store_dir = Path(store_dir) if store_dir else None
+        self._specs: "OrderedDict[str, RegisteredSpec]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def register(self, spec: Any) -> RegisteredSpec:
+        """
+        Зарегистрировать спецификацию
+
+        Raises:
+            ValueError: спецификация не разбирается или невалидна в strict режиме
+        """
+        spec_id = compute_spec_id(spec)
+        entry = self._specs.get(spec_id)
+        if entry is not None:
+            self._specs.move_to_end(spec_id)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        data = load_spec(spec)
+        if not isinstance(data, dict):
+            raise ValueError("OpenAPI спецификация должна быть объектом")
+
+        valid, validation_error = self._validate(data)
+        if not valid and self.strict:
+            raise ValueError(f"Невалидная OpenAPI спецификация: {validation_error}")
+
+        endpoints = {(e.method.upper(), e.path): e for e in extract_endpoints(data)}
+        entry = RegisteredSpec(
+            spec_id=spec_id,
+            raw=spec,
+            data=data,
+            endpoints=endpoints,
+            valid=valid,
+            validation_error=validation_error,
+        )
+        self._specs[spec_id] = entry
+        self._save(spec_id, spec)
+        while len(self._specs) > self.max_entries:
+            self._specs.popitem(last=False)
+            self.evictions += 1
+
+        logger.info(f"Зарегистрирована спецификация {spec_id}: {len(endpoints)} эндпоинтов")
+        return entry
+
+    @staticmethod
+    def _validate(data: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+        if validate_openapi_spec is None:
+            return True, None
+        try:
+            validate_openapi_spec(data)
+        except Exception as exc:
+            message = str(exc).split("\n", 1)[0]
+            logger.warning(f"OpenAPI спецификация не прошла валидацию: {message}")
+            return False, message
+        return True, None
+
+    def _path(self, spec_id: str) -> Optional[Path]:
+        # spec_id приходит из URL: в имени файла только шестнадцатеричный хэш
+        if self.store_dir is None or not spec_id.isalnum():
+            return None
+        return self.store_dir / f"{spec_id}.json"
+
+    def _save(self, spec_id: str, spec: Any) -> None:
+        path = self._path(spec_id)
+        if path is None or path.exists():
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(spec, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as exc:
+            logger.warning(f"Спецификация {spec_id} не сохранена в {self.store_dir}: {exc}")
+
+    def _load(self, spec_id: str) -> Optional[RegisteredSpec]:
+        path = self._path(spec_id)
+        if path is None or not path.exists():
+            return None
+        try:
+            spec = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            logger.warning(f"Спецификация {spec_id} не прочитана из {path}: {exc}")
+            return None
+        return self.register(spec)
+
+    def find(self, spec_id: str) -> Optional[RegisteredSpec]:
+        entry = self._specs.get(spec_id)
+        if entry is not None:
+            self._specs.move_to_end(spec_id)
+            return entry
+        return self._load(spec_id)
+
+    def get(self, spec_id: str) -> RegisteredSpec:
+        entry = self.find(spec_id)
+        if entry is None:
+            raise ValueError(f"Спецификация {spec_id} не найдена, загрузите ее заново")
+        return entry
+
+    def resolve(self, openapi_spec: Any = None, spec_id: Optional[str] = None) -> RegisteredSpec:
+        """Спецификация по spec_id или по самому документу"""
+        if spec_id:
+            return self.get(spec_id)
+        if openapi_spec is None:
+            raise ValueError("Нужен openapi_spec или spec_id")
+        return self.register(openapi_spec)
+
+    def remove(self, spec_id: str) -> bool:
+        removed = self._specs.pop(spec_id, None) is not None
+        path = self._path(spec_id)
+        if path is not None and path.exists():
+            path.unlink(missing_ok=True)
+            removed = True
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._specs),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_settings = get_settings()
+
+# Глобальный реестр спецификаций
+spec_registry = SpecRegistry(
+    max_entries=_settings.SPEC_REGISTRY_MAX_ENTRIES,
+    strict=_settings.SPEC_VALIDATION_STRICT,
+    store_dir=_settings.SPEC_STORE_DIR,
+)
@@ -1,12 +1,15 @@
 import re
-from typing import Any
+import time
+from typing import Any, AsyncIterator
 
 from llm_client import llm_client
 from prompt_templates import PromptTemplates, TestType, TestPriority, get_testcase_prompt
+from deadlines import RequestAborted
+from repair import repair_code
+from sampling import generate_best_of_n
+from tokens import PromptTooLarge, fit_prompt
 from loguru import logger
 
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
-
 
 def _extract_python_code(text: str) -> str:
     """Извлекает Python код из markdown блоков или текста ответа LLM"""
@@ -34,17 +37,13 @@ def _extract_python_code(text: str) -> str:
     return text.strip()
 
 
-async def generate_testcase(
+def _build_testcase_prompt(
     test_type: str,
     requirements_text: str | None = None,
     openapi_spec: Any | None = None,
-) -> str:
-    """
-    Генерирует тест-кейс в формате Allure TestOps as Code
-    используя Cloud.ru GigaChat
-    """
-    logger.info(f"Генерация тест-кейса типа: {test_type} через Cloud.ru GigaChat")
-    
+    priority: str | None = None,
+) -> tuple[str, dict[str, Any]]:
+    """Формирует промпт и параметры генерации тест-кейса"""
     if not requirements_text and not openapi_spec:
         raise ValueError("Необходимо предоставить либо requirements_text, либо openapi_spec")
 
@@ -56,39 +55,139 @@ async def generate_testcase(
 
     # Определяем приоритет и тип теста
     test_type_enum = TestType.API if test_type == "api" else TestType.UI
-    priority = TestPriority.CRITICAL if test_type == "api" else TestPriority.NORMAL
+    test_priority = _testcase_priority(test_type, priority)
+    
+    # Используем промпт-шаблоны для GigaChat; ввод подгоняется под контекст модели
+    return fit_prompt(req, lambda text: get_testcase_prompt(
+        requirements=text,
+        test_type=test_type_enum,
+        priority=test_priority
+    ))
+
+
+def _testcase_priority(test_type: str, priority: str | None = None) -> TestPriority:
+    """
+    Приоритет тест-кейса: из запроса, иначе по типу (api — CRITICAL, ui — NORMAL)
+    
+    От приоритета зависят тег в промпте и план best-of-N (BEST_OF_N_SAMPLES).
+    """
+    if priority:
+        return TestPriority(priority)
+    return TestPriority.CRITICAL if test_type == "api" else TestPriority.NORMAL
+
+
+def _finalize_testcase_code(raw: str) -> str:
+    """Извлекает код из ответа модели и добавляет недостающий импорт allure"""
+    code = _extract_python_code(raw)
+    logger.debug(f"Извлечен код, длина: {len(code)} символов")
+    
+    # Базовая валидация и исправление
+    if "import allure" not in code and "test_" in code:
+        code = "import allure\n\n" + code
+        logger.info("Добавлен импорт allure")
+    
+    return code
+
+
+async def generate_testcase(
+    test_type: str,
+    requirements_text: str | None = None,
+    openapi_spec: Any | None = None,
+    repair: bool = False,
+    best_of_n: bool = False,
+    priority: str | None = None,
+) -> str:
+    """
+    Генерирует тест-кейс в формате Allure TestOps as Code
+    используя Cloud.ru GigaChat
+    
+    При best_of_n=True запускается несколько вариантов параллельно (число по
+    приоритету: из запроса или по типу теста) и берется первый валидный. При repair=True замечания
+    валидатора исправляются повторными запросами в пределах бюджета REPAIR_*.
+    """
+    started = time.monotonic()
+    logger.info(f"Генерация тест-кейса типа: {test_type} через Cloud.ru GigaChat")
+    
+    prompt, params = _build_testcase_prompt(test_type, requirements_text, openapi_spec, priority)
     
     try:
-        # Используем промпт-шаблоны для GigaChat
-        prompt, params = get_testcase_prompt(
-            requirements=req,
-            test_type=test_type_enum,
-            priority=priority
-        )
-        
         logger.debug(f"Отправка промпта Cloud.ru GigaChat, длина: {len(prompt)} символов")
         
-        # Генерация через Cloud.ru GigaChat с системным промптом
-        raw = await llm_client.generate(
-            prompt=prompt,
-            system_prompt=params.get("system_role"),
-            use_cache=True,
-            validate=True
-        )
-        
-        logger.debug(f"Получен ответ от Cloud.ru GigaChat, длина: {len(raw)} символов")
-        
-        code = _extract_python_code(raw)
-        logger.debug(f"Извлечен код, длина: {len(code)} символов")
-        
-        # Базовая валидация и исправление
-        if "import allure" not in code and "test_" in code:
-            code = "import allure\n\n" + code
-            logger.info("Добавлен импорт allure")
-        
+        if best_of_n:
+            code = (await generate_best_of_n(
+                prompt, params, _testcase_priority(test_type, priority), "testcase",
+                _finalize_testcase_code, "testcase",
+            )).code
+        else:
+            # Генерация через Cloud.ru GigaChat с системным промптом
+            raw = await llm_client.generate(
+                prompt=prompt,
+                system_prompt=params.get("system_role"),
+                use_cache=True,
+                validate=True,
+                template="testcase",
+                temperature=params.get("temperature"),
+                max_tokens=params.get("max_tokens")
+            )
+            
+            logger.debug(f"Получен ответ от Cloud.ru GigaChat, длина: {len(raw)} символов")
+            
+            code = _finalize_testcase_code(raw)
+        if repair:
+            code = (await repair_code(code, "testcase", started)).code
         return code
         
+    except (RequestAborted, PromptTooLarge):
+        raise
     except Exception as e:
         logger.error(f"Ошибка при генерации тест-кейса через Cloud.ru GigaChat: {e}")
         # Fallback на простой тест
-        return llm_client._fallback_test()
\ No newline at end of file
+        return llm_client._fallback_test()
+
+
+async def _stream_testcase_events(prompt: str, params: dict[str, Any]) -> AsyncIterator[tuple[str, Any]]:
+    """Цикл потоковой генерации тест-кейса"""
+    parts: list[str] = []
+    
+    try:
+        async for delta in llm_client.generate_stream(
+            prompt=prompt,
+            system_prompt=params.get("system_role"),
+            use_cache=True,
+            template="testcase",
+            temperature=params.get("temperature"),
+            max_tokens=params.get("max_tokens")
+        ):
+            parts.append(delta)
+            yield "token", delta
+    except RequestAborted:
+        # Дедлайн: поток завершается событием error без fallback
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при потоковой генерации тест-кейса через Cloud.ru GigaChat: {e}")
+        yield "error", str(e)
+        yield "done", llm_client._fallback_test()
+        return
+    
+    validated, _ = llm_client._validate_response("".join(parts))
+    yield "done", _finalize_testcase_code(validated)
+
+
+def stream_testcase(
+    test_type: str,
+    requirements_text: str | None = None,
+    openapi_spec: Any | None = None,
+    priority: str | None = None,
+) -> AsyncIterator[tuple[str, Any]]:
+    """
+    Потоковая генерация тест-кейса
+    
+    Входные данные проверяются сразу, до начала потока.
+    
+    Yields:
+        ("token", фрагмент) по мере генерации, при ошибке ("error", сообщение),
+        в конце ("done", итоговый код)
+    """
+    prompt, params = _build_testcase_prompt(test_type, requirements_text, openapi_spec, priority)
+    logger.info(f"Потоковая генерация тест-кейса типа: {test_type} через Cloud.ru GigaChat")
+    return _stream_testcase_events(prompt, params)
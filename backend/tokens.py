@@ -0,0 +1,119 @@
+"""
+Локальная оценка числа токенов и бюджет контекстного окна модели
+"""
+import math
+import re
+from typing import Any, Callable, Dict, Tuple
+
+from loguru import logger
+
+from config import get_settings
+
+# Слова, числа, пробельные последовательности и отдельные знаки
+_PIECE = re.compile(r"[A-Za-z]+|[А-Яа-яЁё]+|\d+|\s+|[^\w\s]|\w+")
+
+# Средняя длина токена в символах для разных видов фрагментов
+_LATIN_CHARS = 4
+_CYRILLIC_CHARS = 3
+_DIGIT_CHARS = 3
+_INDENT_CHARS = 4
+
+TRIM_MARKER = "\n... [входные данные обрезаны по размеру контекста]"
+
+
+class PromptTooLarge(ValueError):
+    """Промпт не помещается в контекстное окно модели"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели
+
+    Латиница и код — около 4 символов на токен, кириллица и числа — около 3,
+    знаки препинания — по токену, перевод строки — токен, отступы — по
+    токену на 4 пробела.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE.findall(text):
+        first = piece[0]
+        if first.isspace():
+            tokens += piece.count("\n") + (len(piece) - 1) // _INDENT_CHARS
+        elif "a" <= first.lower() <= "z":
+            tokens += math.ceil(len(piece) / _LATIN_CHARS)
+        elif first.isdigit():
+            tokens += math.ceil(len(piece) / _DIGIT_CHARS)
+        elif first.isalpha() or first == "_":
+            tokens += math.ceil(len(piece) / _CYRILLIC_CHARS)
+        else:
+            tokens += 1
+    return tokens
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезать текст с конца так, чтобы оценка не превышала max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRIM_MARKER)
+    # Длина пропорционально бюджету, затем уточнение с шагом 10%
+    length = int(len(text) * budget / total)
+    while length > 0 and estimate_tokens(text[:length]) > budget:
+        length = int(length * 0.9)
+    return text[:length] + TRIM_MARKER if length > 0 else ""
+
+
+def output_budget(prompt_tokens: int, requested: int, settings=None) -> int:
+    """
+    max_tokens для запроса: не больше запрошенного и остатка контекстного окна
+
+    Raises:
+        PromptTooLarge: на ответ остается меньше LLM_MIN_OUTPUT_TOKENS
+    """
+    settings = settings or get_settings()
+    available = settings.LLM_CONTEXT_WINDOW - prompt_tokens - settings.LLM_CONTEXT_MARGIN_TOKENS
+    if available < settings.LLM_MIN_OUTPUT_TOKENS:
+        raise PromptTooLarge(
+            f"Промпт ~{prompt_tokens} токенов не оставляет места для ответа "
+            f"в контексте {settings.LLM_CONTEXT_WINDOW} токенов"
+        )
+    return min(requested, available)
+
+
+def fit_prompt(
+    user_input: str,
+    build: Callable[[str], Tuple[str, Dict[str, Any]]],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Собрать промпт так, чтобы он вместе с ожидаемым ответом (max_tokens
+    шаблона) помещался в контекстное окно
+
+    Лишнее обрезается с конца пользовательского ввода (LLM_INPUT_OVERFLOW=trim)
+    или запрос отклоняется (reject).
+
+    Raises:
+        PromptTooLarge: ввод не помещается и обрезка выключена или невозможна
+    """
+    settings = get_settings()
+    prompt, params = build(user_input)
+    prompt_tokens = estimate_tokens(prompt) + estimate_tokens(params.get("system_role") or "")
+    limit = (
+        settings.LLM_CONTEXT_WINDOW
+        - settings.LLM_CONTEXT_MARGIN_TOKENS
+        - params.get("max_tokens", settings.LLM_MAX_TOKENS)
+    )
+    if prompt_tokens <= limit:
+        return prompt, params
+
+    message = f"Входные данные ~{prompt_tokens} токенов, доступно ~{limit} токенов контекста"
+    if settings.LLM_INPUT_OVERFLOW != "trim":
+        raise PromptTooLarge(message)
+    input_budget = limit - (prompt_tokens - estimate_tokens(user_input))
+    trimmed = trim_to_tokens(user_input, input_budget)
+    if not trimmed:
+        raise PromptTooLarge(message)
+    logger.warning(f"{message}: ввод обрезан")
+    return build(trimmed)
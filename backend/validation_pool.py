@@ -0,0 +1,222 @@
+"""
+Валидация тест-кейсов вне event loop в ограниченном пуле процессов
+"""
+import asyncio
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from config import get_settings
+from schemas import ValidationIssue, ValidationReport
+from validation_rules import resolve_rules
+from validator import LRUCache, content_hash, validate_testcase
+
+
+def _error_report(code: str, message: str) -> ValidationReport:
+    return ValidationReport(
+        is_valid=False,
+        issues=[ValidationIssue(code=code, message=message, severity="error")],
+        stats={},
+    )
+
+
+class ValidationPool:
+    """
+    Пул воркеров для validate_testcase
+
+    Разбор AST выполняется в отдельном процессе, поэтому большой или
+    патологический файл не останавливает обработку остальных запросов.
+    Файлы больше max_file_bytes отклоняются без разбора. Если валидация не
+    уложилась в timeout_seconds, пул пересоздается, а зависший процесс
+    завершается.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_file_bytes: int = 512 * 1024,
+        timeout_seconds: float = 5.0,
+        kind: str = "process",
+        memo_size: int = 1024,
+    ) -> None:
+        if kind not in {"process", "thread"}:
+            raise ValueError(f"Неизвестный тип пула валидации: {kind}")
+        self.max_workers = max_workers
+        self.max_file_bytes = max_file_bytes
+        self.timeout_seconds = timeout_seconds
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+        # Отчеты по хэшу содержимого: повторная проверка того же кода не идет в пул
+        self.memo = LRUCache(memo_size)
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ValidationPool":
+        return cls(
+            max_workers=settings.VALIDATION_MAX_WORKERS,
+            max_file_bytes=settings.VALIDATION_MAX_FILE_BYTES,
+            timeout_seconds=settings.VALIDATION_TIMEOUT_SECONDS,
+            kind=settings.VALIDATION_POOL_KIND,
+            memo_size=settings.VALIDATION_MEMO_SIZE,
+        )
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: воркеры не наследуют потоки и event loop родителя
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="validation"
+                )
+        return self._executor
+
+    async def start(self) -> None:
+        """Запустить воркеры заранее, чтобы старт процессов не съедал таймаут первых запросов"""
+        executor = self._get_executor()
+        await asyncio.gather(*(
+            asyncio.wrap_future(executor.submit(validate_testcase, ""))
+            for _ in range(self.max_workers)
+        ))
+
+    def _restart(self) -> None:
+        """Пересоздать пул, завершив процессы с зависшими задачами"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        self.restarts += 1
+        processes = list(getattr(executor, "_processes", {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    async def validate(
+        self,
+        code: str,
+        incremental: bool = True,
+        rules: Optional[Sequence[str]] = None,
+    ) -> ValidationReport:
+        """
+        Валидировать один файл в пуле с ограничением размера и времени
+
+        Raises:
+            ValueError: неизвестное имя правила
+        """
+        rule_names = resolve_rules(rules)
+        # Отчет зависит от набора правил, поэтому он входит в ключ
+        key = f"{content_hash(code)}:{','.join(rule_names)}"
+        cached = self.memo.get(key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+
+        size = len(code.encode("utf-8"))
+        if size > self.max_file_bytes:
+            self.rejected += 1
+            return _error_report(
+                "file_too_large",
+                f"Файл {size} байт больше лимита {self.max_file_bytes} байт",
+            )
+
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                report = await asyncio.wait_for(
+                    asyncio.wrap_future(executor.submit(validate_testcase, code, incremental, rule_names)),
+                    self.timeout_seconds,
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"Валидация не уложилась в {self.timeout_seconds}с, пул пересоздается")
+                if self._executor is executor and self.kind == "process":
+                    self._restart()
+                return _error_report(
+                    "validation_timeout",
+                    f"Валидация не уложилась в {self.timeout_seconds}с",
+                )
+            except (BrokenProcessPool, asyncio.CancelledError):
+                task = asyncio.current_task()
+                if task is not None and task.cancelling():
+                    raise
+                # Пул пересоздан из-за соседней задачи или процесс упал — повторяем один раз
+                if self._executor is executor:
+                    self._restart()
+                if attempt:
+                    return _error_report("validation_failed", "Процесс валидации аварийно завершился")
+            else:
+                break
+
+        self.completed += 1
+        self.memo.put(key, report)
+        return report.model_copy(deep=True)
+
+    async def validate_many(
+        self,
+        files: Sequence[Tuple[str, str]],
+        rules: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[Tuple[str, ValidationReport]], Dict[str, Any]]:
+        """
+        Параллельная валидация набора файлов
+
+        Returns:
+            tuple: (список (имя файла, отчет) в исходном порядке, агрегированная статистика)
+        """
+        rule_names = resolve_rules(rules)
+        started = time.perf_counter()
+        reports = await asyncio.gather(*(self.validate(code, rules=rule_names) for _, code in files))
+        results = list(zip((name for name, _ in files), reports))
+
+        issues_by_code: Counter = Counter()
+        errors = warnings = test_functions = 0
+        for report in reports:
+            for issue in report.issues:
+                issues_by_code[issue.code] += 1
+                if issue.severity == "error":
+                    errors += 1
+                else:
+                    warnings += 1
+            test_functions += report.stats.get("test_functions_count", 0)
+
+        valid_files = sum(report.is_valid for report in reports)
+        stats = {
+            "files_count": len(reports),
+            "valid_files": valid_files,
+            "invalid_files": len(reports) - valid_files,
+            "errors_count": errors,
+            "warnings_count": warnings,
+            "test_functions_count": test_functions,
+            "issues_by_code": dict(issues_by_code),
+            "duration_ms": (time.perf_counter() - started) * 1000,
+        }
+        return results, stats
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "memo": self.memo.stats(),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Глобальный пул валидации
+validation_pool = ValidationPool.from_settings(get_settings())
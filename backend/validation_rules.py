@@ -0,0 +1,209 @@
+"""
+Правила валидации тест-кейсов
+
+Каждое правило подписывается на типы узлов AST и накапливает факты о коде
+в своем контексте. Все включенные правила выполняются за один обход дерева.
+Факты по фрагментам модуля складываются через merge, поэтому результат
+правила можно кэшировать по фрагментам.
+"""
+import ast
+from typing import Any, ClassVar, Dict, List, Optional, Sequence
+
+from schemas import ValidationIssue
+
+
+class RuleContext:
+    """Факты и замечания одного правила для одного фрагмента кода"""
+
+    __slots__ = ("facts", "issues")
+
+    def __init__(self, facts: Any) -> None:
+        self.facts = facts
+        self.issues: List[ValidationIssue] = []
+
+    def report(
+        self,
+        code: str,
+        message: str,
+        severity: str = "warning",
+        node: Optional[ast.AST] = None,
+    ) -> None:
+        self.issues.append(
+            ValidationIssue(
+                code=code,
+                message=message,
+                line=getattr(node, "lineno", None),
+                column=getattr(node, "col_offset", None),
+                severity=severity,
+            )
+        )
+
+
+class Rule:
+    """
+    Базовое правило
+
+    visit вызывается для каждого узла из node_types, finalize — один раз по
+    сложенным фактам всего модуля и возвращает вклад правила в stats.
+    """
+
+    name: ClassVar[str] = ""
+    description: ClassVar[str] = ""
+    node_types: ClassVar[tuple] = ()
+    enabled_by_default: ClassVar[bool] = True
+
+    def initial(self) -> Any:
+        return None
+
+    def visit(self, node: ast.AST, ctx: RuleContext) -> None:
+        pass
+
+    def merge(self, left: Any, right: Any) -> Any:
+        return right
+
+    def finalize(self, facts: Any, ctx: RuleContext) -> Dict[str, Any]:
+        return {}
+
+
+# Реестр правил по имени
+RULES: Dict[str, Rule] = {}
+
+
+def register_rule(cls: type) -> type:
+    """Декоратор: зарегистрировать правило в реестре"""
+    if not cls.name or cls.name in RULES:
+        raise ValueError(f"Некорректное или повторное имя правила: {cls.name!r}")
+    RULES[cls.name] = cls()
+    return cls
+
+
+def resolve_rules(names: Optional[Sequence[str]] = None) -> tuple:
+    """
+    Имена включенных правил в порядке реестра
+
+    Raises:
+        ValueError: неизвестное имя правила
+    """
+    if names is None:
+        return tuple(name for name, rule in RULES.items() if rule.enabled_by_default)
+    unknown = sorted(set(names) - RULES.keys())
+    if unknown:
+        raise ValueError(f"Неизвестные правила валидации: {', '.join(unknown)}")
+    return tuple(name for name in RULES if name in set(names))
+
+
+def _allure_step_names(node: ast.With) -> List[str]:
+    """Имена шагов allure.step("...") в заголовке with"""
+    steps = []
+    for item in node.items:
+        ctx_expr = item.context_expr
+        if isinstance(ctx_expr, ast.Call) and isinstance(ctx_expr.func, ast.Attribute):
+            if isinstance(ctx_expr.func.value, ast.Name) and ctx_expr.func.value.id == "allure":
+                if ctx_expr.func.attr == "step" and ctx_expr.args:
+                    first_arg = ctx_expr.args[0]
+                    if isinstance(first_arg, ast.Constant) and isinstance(first_arg.value, str):
+                        steps.append(first_arg.value)
+    return steps
+
+
+@register_rule
+class AllureImportRule(Rule):
+    name = "allure_import"
+    description = "Модуль импортирует allure"
+    node_types = (ast.Import, ast.ImportFrom)
+
+    def initial(self) -> bool:
+        return False
+
+    def visit(self, node: ast.AST, ctx: RuleContext) -> None:
+        if isinstance(node, ast.Import):
+            if any(alias.name == "allure" for alias in node.names):
+                ctx.facts = True
+        elif node.module == "allure":
+            ctx.facts = True
+
+    def merge(self, left: bool, right: bool) -> bool:
+        return left or right
+
+    def finalize(self, facts: bool, ctx: RuleContext) -> Dict[str, Any]:
+        if not facts:
+            ctx.report("missing_import_allure", "Не найден import allure", "error")
+        return {"has_import_allure": facts}
+
+
+@register_rule
+class TestFunctionsRule(Rule):
+    name = "test_functions"
+    description = "В модуле есть функции test_*"
+    node_types = (ast.FunctionDef,)
+
+    def initial(self) -> int:
+        return 0
+
+    def visit(self, node: ast.FunctionDef, ctx: RuleContext) -> None:
+        if node.name.startswith("test_"):
+            ctx.facts += 1
+
+    def merge(self, left: int, right: int) -> int:
+        return left + right
+
+    def finalize(self, facts: int, ctx: RuleContext) -> Dict[str, Any]:
+        if not facts:
+            ctx.report("no_test_functions", "Не найдено ни одной функции test_*", "error")
+        return {"test_functions_count": facts}
+
+
+@register_rule
+class AllureDecoratorsRule(Rule):
+    name = "allure_decorators"
+    description = "У тестов есть декораторы allure.feature/story/title/tag/label"
+    node_types = (ast.FunctionDef,)
+    required = ("feature", "story", "title", "tag", "label")
+
+    def initial(self) -> frozenset:
+        return frozenset()
+
+    def visit(self, node: ast.FunctionDef, ctx: RuleContext) -> None:
+        if not node.name.startswith("test_"):
+            return
+        found = set()
+        for dec in node.decorator_list:
+            if isinstance(dec, ast.Attribute):
+                found.add(dec.attr)
+            elif isinstance(dec, ast.Name):
+                found.add(dec.id)
+        ctx.facts = ctx.facts | found
+
+    def merge(self, left: frozenset, right: frozenset) -> frozenset:
+        return left | right
+
+    def finalize(self, facts: frozenset, ctx: RuleContext) -> Dict[str, Any]:
+        for dec in self.required:
+            if dec not in facts:
+                ctx.report(f"missing_allure_{dec}", f"Не найден декоратор allure.{dec}")
+        return {"decorators_found": sorted(facts)}
+
+
+@register_rule
+class AAAStepsRule(Rule):
+    name = "aaa_steps"
+    description = "Есть шаги allure.step Arrange/Act/Assert"
+    node_types = (ast.With,)
+    steps = ("Arrange", "Act", "Assert")
+
+    def initial(self) -> frozenset:
+        return frozenset()
+
+    def visit(self, node: ast.With, ctx: RuleContext) -> None:
+        found = {step for step in _allure_step_names(node) if step in self.steps}
+        if found:
+            ctx.facts = ctx.facts | found
+
+    def merge(self, left: frozenset, right: frozenset) -> frozenset:
+        return left | right
+
+    def finalize(self, facts: frozenset, ctx: RuleContext) -> Dict[str, Any]:
+        for step in self.steps:
+            if step not in facts:
+                ctx.report(f"missing_step_{step.lower()}", f"Не найден шаг AAA: {step}")
+        return {"aaa_steps": {step: step in facts for step in self.steps}}
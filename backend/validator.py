@@ -1,126 +1,223 @@
 import ast
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Sequence
 
 from schemas import ValidationIssue, ValidationReport
+from validation_rules import RULES, RuleContext, resolve_rules
+
+
+class LRUCache:
+    """
+    Ограниченный LRU словарь со счетчиками попаданий
+
+    Потокобезопасен: валидация в пуле потоков обращается к нему одновременно.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, hits, misses = len(self._data), self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0,
+        }
+
+
+def content_hash(code: str) -> str:
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Факты по фрагментам модуля (верхнеуровневым определениям) в текущем процессе
+SEGMENT_CACHE_MAX_ENTRIES = 8192
+_segment_cache = LRUCache(SEGMENT_CACHE_MAX_ENTRIES)
+
+# Строки с этими словами в колонке 0 продолжают предыдущую конструкцию
+_CONTINUATION_PREFIXES = ("else", "elif", "except", "finally", ")", "]", "}")
+
+
+def split_top_level(code: str) -> list[str]:
+    """
+    Разбить модуль на верхнеуровневые фрагменты по строкам в колонке 0
+
+    Декораторы, продолжения строк и ветки else/except остаются с
+    определением. Неудачный разрез (например, внутри многострочной строки)
+    дает синтаксически неверный фрагмент, и вызывающий код переходит к
+    разбору модуля целиком.
+    """
+    segments: list[str] = []
+    current: list[str] = []
+    joins_next = False
+    for line in code.splitlines(keepends=True):
+        starts_statement = line[:1] not in ("", " ", "\t", "\n", "\r", "#")
+        if (
+            starts_statement
+            and current
+            and not joins_next
+            and not line.startswith(_CONTINUATION_PREFIXES)
+        ):
+            segments.append("".join(current))
+            current = []
+        current.append(line)
+        stripped = line.rstrip("\r\n")
+        if line[:1] == "@":
+            joins_next = True
+        elif stripped.strip() and not stripped.lstrip().startswith("#"):
+            joins_next = stripped.endswith("\\")
+    if current:
+        segments.append("".join(current))
+    return segments
+
+
+SegmentResult = tuple[Any, tuple[ValidationIssue, ...]]
+
+
+def run_rules(tree: ast.AST, rule_names: Sequence[str], timings: dict[str, float]) -> dict[str, SegmentResult]:
+    """
+    Один обход дерева с таблицей диспетчеризации тип узла -> правила
+
+    Returns:
+        dict: имя правила -> (факты, замечания с номерами строк фрагмента)
+    """
+    contexts = {name: RuleContext(RULES[name].initial()) for name in rule_names}
+    dispatch: dict[type, list] = {}
+    for name in rule_names:
+        for node_type in RULES[name].node_types:
+            dispatch.setdefault(node_type, []).append((RULES[name].visit, contexts[name], name))
+
+    perf_counter = time.perf_counter
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        handlers = dispatch.get(type(node))
+        if handlers:
+            for visit, ctx, name in handlers:
+                started = perf_counter()
+                visit(node, ctx)
+                timings[name] += perf_counter() - started
+        # Обратный порядок на стеке — обход в порядке исходного кода
+        stack.extend(reversed(list(ast.iter_child_nodes(node))))
+    return {name: (ctx.facts, tuple(ctx.issues)) for name, ctx in contexts.items()}
+
+
+def _shift_lines(issues: Sequence[ValidationIssue], offset: int) -> list[ValidationIssue]:
+    """Копии замечаний из кэша фрагментов со сдвигом номеров строк"""
+    return [
+        issue.model_copy(update={"line": issue.line + offset}) if issue.line is not None else issue.model_copy()
+        for issue in issues
+    ]
+
+
+def _line_count(text: str) -> int:
+    return text.count("\n") + text.count("\r") - text.count("\r\n")
+
+
+def _incremental_results(
+    code: str, rule_names: Sequence[str], timings: dict[str, float]
+) -> dict[str, SegmentResult] | None:
+    """Результаты правил с переиспользованием неизмененных фрагментов; None — нужен полный разбор"""
+    merged = {name: (RULES[name].initial(), []) for name in rule_names}
+    offset = 0
+    for segment in split_top_level(code):
+        key = content_hash(segment)
+        # Запись кэша — результаты всех когда-либо запрошенных правил для фрагмента
+        results = _segment_cache.get(key)
+        if results is None:
+            results = {}
+            _segment_cache.put(key, results)
+        missing = [name for name in rule_names if name not in results]
+        if missing:
+            try:
+                tree = ast.parse(segment)
+            except SyntaxError:
+                return None
+            results.update(run_rules(tree, missing, timings))
+        for name in rule_names:
+            facts, issues = results[name]
+            merged_facts, merged_issues = merged[name]
+            merged_issues.extend(_shift_lines(issues, offset))
+            merged[name] = (RULES[name].merge(merged_facts, facts), merged_issues)
+        offset += _line_count(segment)
+    return merged
+
+
+def _syntax_error_report(exc: SyntaxError) -> ValidationReport:
+    issue = ValidationIssue(
+        code="syntax_error",
+        message=str(exc),
+        line=exc.lineno,
+        column=exc.offset,
+        severity="error",
+    )
+    return ValidationReport(is_valid=False, issues=[issue], stats={})
+
+
+def validate_testcase(
+    code: str,
+    incremental: bool = True,
+    rules: Sequence[str] | None = None,
+) -> ValidationReport:
+    """
+    Валидация кода тест-кейса набором правил
+
+    В инкрементальном режиме верхнеуровневые определения разбираются по
+    отдельности, а результаты правил кэшируются по хэшу фрагмента, так что
+    после правки заново разбираются только измененные фрагменты.
+
+    Raises:
+        ValueError: неизвестное имя правила
+    """
+    rule_names = resolve_rules(rules)
+    timings = dict.fromkeys(rule_names, 0.0)
+    results = _incremental_results(code, rule_names, timings) if incremental else None
+    if results is None:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as exc:
+            return _syntax_error_report(exc)
+        results = run_rules(tree, rule_names, timings)
 
-from loguru import logger
-
-logger.add("logs/app.log", rotation="500 MB", retention="10 days")
-
-class TestCaseValidator(ast.NodeVisitor):
-    def __init__(self) -> None:
-        self.issues: list[ValidationIssue] = []
-        self.has_import_allure = False
-        self.test_functions: list[ast.FunctionDef] = []
-        self.aaa_steps_found = {"Arrange": False, "Act": False, "Assert": False}
-        self.decorators_found: set[str] = set()
-
-    def visit_Import(self, node: ast.Import):
-        for alias in node.names:
-            if alias.name == "allure":
-                self.has_import_allure = True
-        self.generic_visit(node)
-
-    def visit_ImportFrom(self, node: ast.ImportFrom):
-        if node.module == "allure":
-            self.has_import_allure = True
-        self.generic_visit(node)
-
-    def visit_FunctionDef(self, node: ast.FunctionDef):
-        if node.name.startswith("test_"):
-            self.test_functions.append(node)
-            for dec in node.decorator_list:
-                if isinstance(dec, ast.Attribute):
-                    self.decorators_found.add(dec.attr)
-                elif isinstance(dec, ast.Name):
-                    self.decorators_found.add(dec.id)
-        self.generic_visit(node)
-
-    def visit_With(self, node: ast.With):
-        for item in node.items:
-            ctx_expr = item.context_expr
-            if isinstance(ctx_expr, ast.Call) and isinstance(ctx_expr.func, ast.Attribute):
-                if isinstance(ctx_expr.func.value, ast.Name) and ctx_expr.func.value.id == "allure":
-                    if ctx_expr.func.attr == "step" and ctx_expr.args:
-                        first_arg = ctx_expr.args[0]
-                        if isinstance(first_arg, ast.Constant) and isinstance(first_arg.value, str):
-                            if first_arg.value in self.aaa_steps_found:
-                                self.aaa_steps_found[first_arg.value] = True
-        self.generic_visit(node)
-
-
-def validate_testcase(code: str) -> ValidationReport:
     issues: list[ValidationIssue] = []
-
-    try:
-        tree = ast.parse(code)
-    except SyntaxError as exc:
-        issues.append(
-            ValidationIssue(
-                code="syntax_error",
-                message=str(exc),
-                line=exc.lineno,
-                column=exc.offset,
-                severity="error",
-            )
-        )
-        return ValidationReport(is_valid=False, issues=issues, stats={})
-
-    validator = TestCaseValidator()
-    validator.visit(tree)
-
-    if not validator.has_import_allure:
-        issues.append(
-            ValidationIssue(
-                code="missing_import_allure",
-                message="Не найден import allure",
-                line=None,
-                column=None,
-                severity="error",
-            )
-        )
-
-    if not validator.test_functions:
-        issues.append(
-            ValidationIssue(
-                code="no_test_functions",
-                message="Не найдено ни одной функции test_*",
-                line=None,
-                column=None,
-                severity="error",
-            )
-        )
-
-    required_decorators = {"feature", "story", "title", "tag", "label"}
-    for dec in required_decorators:
-        if dec not in validator.decorators_found:
-            issues.append(
-                ValidationIssue(
-                    code=f"missing_allure_{dec}",
-                    message=f"Не найден декоратор allure.{dec}",
-                    line=None,
-                    column=None,
-                    severity="warning",
-                )
-            )
-
-    for step, found in validator.aaa_steps_found.items():
-        if not found:
-            issues.append(
-                ValidationIssue(
-                    code=f"missing_step_{step.lower()}",
-                    message=f"Не найден шаг AAA: {step}",
-                    line=None,
-                    column=None,
-                    severity="warning",
-                )
-            )
+    stats: dict[str, Any] = {}
+    for name in rule_names:
+        facts, rule_issues = results[name]
+        ctx = RuleContext(facts)
+        started = time.perf_counter()
+        stats.update(RULES[name].finalize(facts, ctx))
+        timings[name] += time.perf_counter() - started
+        issues.extend(rule_issues)
+        issues.extend(ctx.issues)
 
     is_valid = not any(i.severity == "error" for i in issues)
-    stats = {
-        "test_functions_count": len(validator.test_functions),
-        "has_import_allure": validator.has_import_allure,
-        "decorators_found": sorted(list(validator.decorators_found)),
-        "aaa_steps": validator.aaa_steps_found,
-    }
-
+    stats["rules"] = list(rule_names)
+    stats["rule_timings_ms"] = {name: round(t * 1000, 3) for name, t in timings.items()}
     return ValidationReport(is_valid=is_valid, issues=issues, stats=stats)
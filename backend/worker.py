@@ -0,0 +1,221 @@
+"""
+Воркер очереди задач генерации
+
+Запуск отдельным процессом: python worker.py [--concurrency N]
+Воркеры масштабируются независимо от реплик API.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+from contextlib import suppress
+from typing import Dict, Optional
+
+from loguru import logger
+
+from config import get_settings
+from deadlines import RequestAborted, deadline_var
+from jobs import FAILED, JOB_SCHEMAS, SUCCEEDED, Job, JobQueue, generation_request_type, generation_work, job_queue
+from logging_config import request_id_var, setup_logging
+from metrics import metrics_collector
+
+
+class Worker:
+    """
+    Потребитель очереди задач
+
+    concurrency циклов берут задачи из очереди и выполняют генерацию;
+    отдельный цикл раз в heartbeat_seconds продлевает выполняемые задачи
+    и возвращает в очередь задачи упавших воркеров. При остановке новые
+    задачи не берутся, выполняемые получают grace_seconds на завершение,
+    остальные возвращаются в очередь.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int = 4,
+        timeout_seconds: float = 900.0,
+        heartbeat_seconds: float = 15.0,
+        poll_seconds: float = 1.0,
+        grace_seconds: float = 30.0,
+    ) -> None:
+        self.queue = queue
+        self.concurrency = concurrency
+        self.timeout_seconds = timeout_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.grace_seconds = grace_seconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls, queue: JobQueue, settings, concurrency: Optional[int] = None) -> "Worker":
+        return cls(
+            queue,
+            concurrency=concurrency or settings.JOB_WORKER_CONCURRENCY,
+            timeout_seconds=settings.JOB_TIMEOUT_SECONDS,
+            heartbeat_seconds=settings.JOB_HEARTBEAT_SECONDS,
+            poll_seconds=settings.JOB_POLL_INTERVAL_SECONDS,
+            grace_seconds=settings.JOB_SHUTDOWN_GRACE_SECONDS,
+        )
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Обрабатывать задачи до вызова stop()"""
+        logger.info(f"Воркер {self.name} запущен, параллельность {self.concurrency}")
+        consumers = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        keeper = asyncio.create_task(self._keep_alive())
+        try:
+            await self._stopping.wait()
+        finally:
+            self._stopping.set()
+            # Циклы выходят после текущей задачи или очередного ожидания claim
+            _, pending = await asyncio.wait(consumers, timeout=self.poll_seconds + self.grace_seconds)
+            unfinished = list(self._running.values())
+            for task in (*unfinished, *pending, keeper):
+                task.cancel()
+            await asyncio.gather(*unfinished, *consumers, keeper, return_exceptions=True)
+            logger.info(
+                f"Воркер {self.name} остановлен: выполнено {self.completed}, с ошибкой {self.failed}"
+            )
+
+    async def _consume(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(self.name, self.poll_seconds)
+            except Exception as e:
+                logger.error(f"Очередь задач недоступна: {e}")
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            if job is None:
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running[job.id] = task
+            try:
+                await asyncio.shield(task)
+            finally:
+                self._running.pop(job.id, None)
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.queue.heartbeat(list(self._running))
+                requeued = await self.queue.requeue_stale()
+            except Exception as e:
+                logger.error(f"Не удалось обновить heartbeat задач: {e}")
+                continue
+            if requeued:
+                logger.warning(f"Возвращено в очередь задач без heartbeat: {requeued}")
+
+    async def _execute(self, job: Job) -> None:
+        """Выполнить задачу и записать результат в очередь"""
+        request_id_var.set(job.id[:16])
+        deadline_var.set(time.monotonic() + self.timeout_seconds)
+        started = time.perf_counter()
+        request_type = job.kind
+        logger.info(f"Задача {job.id} ({job.kind}) взята, попытка {job.attempts}")
+        try:
+            payload = JOB_SCHEMAS[job.kind].model_validate(job.payload)
+            request_type = generation_request_type(job.kind, payload)
+            code = await generation_work(job.kind, payload)
+        except asyncio.CancelledError:
+            await self.queue.release(job.id)
+            logger.warning(f"Задача {job.id} прервана остановкой воркера и возвращена в очередь")
+            raise
+        except Exception as e:
+            self.failed += 1
+            outcome = e.reason if isinstance(e, RequestAborted) else "error"
+            metrics_collector.record_request(
+                request_type, False, (time.perf_counter() - started) * 1000, 0, outcome=outcome
+            )
+            logger.error(f"Задача {job.id} завершилась ошибкой: {e}")
+            await self._finish(job, FAILED, error=str(e) or type(e).__name__)
+            return
+
+        self.completed += 1
+        metrics_collector.record_request(
+            request_type, True, (time.perf_counter() - started) * 1000, len(code)
+        )
+        if await self._finish(job, SUCCEEDED, result=code):
+            logger.info(f"Задача {job.id} выполнена за {time.perf_counter() - started:.1f}с")
+
+    async def _finish(self, job: Job, status: str, result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        """Записать итог задачи; итог задачи, которую воркер потерял, отбрасывается"""
+        if await self.queue.finish(job.id, self.name, status, result=result, error=error):
+            return True
+        logger.warning(
+            f"Итог задачи {job.id} отброшен: задача уже возвращена в очередь или завершена другим воркером"
+        )
+        return False
+
+
+async def _serve(concurrency: Optional[int]) -> None:
+    from llm_client import llm_client
+    from metrics_multiprocess import MultiprocessMetrics
+    from metrics_store import MetricsStore
+    from validation_pool import validation_pool
+
+    settings = get_settings()
+    await validation_pool.start()
+    # Метрики задач попадают в API через общее хранилище и каталог снимков
+    tasks = [asyncio.create_task(metrics_collector.rollup.run_sampler())]
+    store = None
+    if settings.METRICS_STORE_ENABLED:
+        store = MetricsStore.from_settings(settings)
+        try:
+            await store.open()
+        except Exception as e:
+            logger.error(f"Хранилище метрик недоступно, история не сохраняется: {e}")
+            store = None
+        else:
+            metrics_collector.store = store
+            tasks.append(asyncio.create_task(store.run_flusher()))
+    snapshots = MultiprocessMetrics.from_settings(settings, metrics_collector, llm_client)
+    if snapshots is not None:
+        tasks.append(asyncio.create_task(snapshots.run_writer()))
+    await job_queue.open()
+    worker = Worker.from_settings(job_queue, settings, concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # На Windows обработчики сигналов в event loop недоступны
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        if store is not None:
+            metrics_collector.store = None
+            await store.close()
+        validation_pool.close()
+        await job_queue.close()
+        await llm_client.close()
+        await logger.complete()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воркер очереди задач генерации")
+    parser.add_argument(
+        "--concurrency", type=int, default=None,
+        help="Задач одновременно (по умолчанию JOB_WORKER_CONCURRENCY)",
+    )
+    args = parser.parse_args()
+    setup_logging(get_settings())
+    asyncio.run(_serve(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()